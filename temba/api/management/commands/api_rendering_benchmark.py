@@ -0,0 +1,74 @@
+import time
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import resolve, reverse
+
+from temba.api.support import FastJSONRenderer
+from temba.orgs.models import Org
+
+ENDPOINTS = ("contacts", "messages", "runs", "flows", "groups", "fields", "labels", "broadcasts", "channels")
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks orjson against regular rendering of API responses, using pages of existing data of an org"
+
+    def add_arguments(self, parser):
+        parser.add_argument("org_id", type=int, help="the org whose data will be rendered")
+        parser.add_argument("endpoints", nargs="*", metavar="ENDPOINT", help="API v2 endpoints, e.g. contacts")
+        parser.add_argument(
+            "--iterations", type=int, action="store", dest="iterations", default=20, help="renders of each page"
+        )
+
+    def handle(self, org_id, endpoints, iterations, *args, **options):
+        org = Org.objects.get(id=org_id)
+        user = org.administrators.filter(is_active=True).first()
+        if not user:
+            raise CommandError(f"org #{org.id} has no active administrator to make requests as")
+
+        user.set_org(org)
+
+        for endpoint in endpoints or ENDPOINTS:
+            data = self.fetch_page(user, endpoint)
+
+            regular, fast = JSONRenderer(), FastJSONRenderer()
+
+            with override_settings(API_ORJSON_RENDERING=True):
+                rendered = fast.render(data)
+
+                if rendered != regular.render(data):
+                    raise CommandError(f"renderings of {endpoint} page don't match")
+
+                regular_time = self.time_render(regular, data, iterations)
+                fast_time = self.time_render(fast, data, iterations)
+
+            self.stdout.write(
+                f"{endpoint}: {len(data['results'])} results ({len(rendered)} bytes), {iterations} iterations: "
+                f"regular {regular_time:.3f}s, orjson {fast_time:.3f}s "
+                f"({regular_time / fast_time if fast_time else 0:.1f}x)"
+            )
+
+    def fetch_page(self, user, endpoint: str):
+        """
+        Fetches the first page of the given endpoint, returning the data that would be rendered
+        """
+        path = reverse(f"api.v2.{endpoint}") + ".json"
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=user)
+
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+
+        if response.status_code != 200:
+            raise CommandError(f"fetching {endpoint} page returned status {response.status_code}")
+
+        return response.data
+
+    def time_render(self, renderer, data, iterations: int) -> float:
+        start = time.perf_counter()
+        for i in range(iterations):
+            renderer.render(data)
+        return time.perf_counter() - start
@@ -0,0 +1,102 @@
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from temba.api.v2.serializers import FlowRunReadSerializer
+from temba.contacts.models import ContactURN
+from temba.flows.models import FlowRun
+from temba.orgs.models import Org
+from temba.utils import json
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks hand-written against field by field serialization of runs, using existing runs of an org"
+
+    def add_arguments(self, parser):
+        parser.add_argument("org_id", type=int, help="the org whose runs will be serialized")
+        parser.add_argument("--runs", type=int, action="store", dest="num_runs", default=250, help="runs per page")
+        parser.add_argument(
+            "--steps", type=int, action="store", dest="num_steps", default=0, help="pad run paths to this many steps"
+        )
+        parser.add_argument(
+            "--iterations", type=int, action="store", dest="iterations", default=10, help="pages to serialize"
+        )
+
+    def handle(self, org_id, num_runs, num_steps, iterations, *args, **options):
+        org = Org.objects.get(id=org_id)
+        runs = list(
+            FlowRun.objects.filter(org=org)
+            .order_by("-modified_on")
+            .prefetch_related(
+                "flow", "contact", "start", Prefetch("contact__urns", ContactURN.objects.order_by("-priority", "id"))
+            )[:num_runs]
+        )
+        if not runs:
+            raise CommandError(f"org #{org.id} has no runs to serialize")
+
+        # pad paths and results in memory only, so that short test runs look like those of long running flows
+        if num_steps:
+            for run in runs:
+                self.pad_run(run, num_steps)
+
+        serializer = FlowRunReadSerializer(context={"org": org})
+
+        def by_field(run):
+            return super(FlowRunReadSerializer, serializer).to_representation(run)
+
+        for run in runs:
+            if json.dumps(by_field(run)) != json.dumps(serializer.to_representation(run)):
+                raise CommandError(f"serializations of run #{run.id} don't match")
+
+        by_field_time = self.time_page(runs, by_field, iterations)
+        compiled_time = self.time_page(runs, serializer.to_representation, iterations)
+
+        avg_steps = sum(len(r.path) for r in runs) / len(runs)
+
+        self.stdout.write(
+            f"{len(runs)} runs with {avg_steps:.1f} steps on average, {iterations} iterations: "
+            f"field by field {by_field_time:.3f}s, hand-written {compiled_time:.3f}s "
+            f"({by_field_time / compiled_time if compiled_time else 0:.1f}x)"
+        )
+
+    def time_page(self, runs, serialize, iterations: int) -> float:
+        start = time.perf_counter()
+        for i in range(iterations):
+            [serialize(r) for r in runs]
+        return time.perf_counter() - start
+
+    def pad_run(self, run, num_steps: int):
+        """
+        Pads the path of the given run with steps a few seconds apart in the same format as mailroom writes them, and
+        adds a result for every fifth step
+        """
+        arrived_on = run.created_on
+
+        while len(run.path) < num_steps:
+            arrived_on += timedelta(seconds=3, microseconds=123)
+            node_uuid = str(uuid4())
+            time_str = arrived_on.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f") + "789Z"
+
+            run.path.append(
+                {
+                    FlowRun.PATH_STEP_UUID: str(uuid4()),
+                    FlowRun.PATH_NODE_UUID: node_uuid,
+                    FlowRun.PATH_ARRIVED_ON: time_str,
+                    FlowRun.PATH_EXIT_UUID: str(uuid4()),
+                }
+            )
+
+            if len(run.path) % 5 == 0:
+                key = f"result_{len(run.path)}"
+                run.results[key] = {
+                    FlowRun.RESULT_NAME: f"Result {len(run.path)}",
+                    FlowRun.RESULT_VALUE: "yes",
+                    FlowRun.RESULT_CATEGORY: "Yes",
+                    FlowRun.RESULT_NODE_UUID: node_uuid,
+                    FlowRun.RESULT_INPUT: "yes please",
+                    FlowRun.RESULT_CREATED_ON: time_str,
+                }
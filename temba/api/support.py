@@ -1,18 +1,31 @@
 import logging
+import re
+from json.encoder import encode_basestring_ascii
 
 from rest_framework import exceptions, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication, TokenAuthentication
 from rest_framework.exceptions import APIException
-from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.throttling import ScopedRateThrottle
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpResponseServerError
 
 from .models import APIToken
 
+# orjson is optional, but must be installed if API_ORJSON_RENDERING is enabled
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# characters which the standard library escapes when encoding JSON as ASCII, and the UTF-8 bytes which indicate them
+UNESCAPED_CHARS = re.compile("[\x7f-\U0010ffff]+")
+UNESCAPED_BYTES = re.compile(rb"[\x7f-\xff]")
+
 
 class APITokenAuthentication(TokenAuthentication):
     """
@@ -162,3 +175,58 @@ def temba_exception_handler(exc, context):
 
         # respond with simple message
         return HttpResponseServerError("Server Error. Site administrators have been notified.")
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer which, when the API_ORJSON_RENDERING setting is enabled, uses orjson to produce the same output as
+    the regular REST framework renderer. Anything orjson can't encode the same way, e.g. integers larger than 64 bits
+    or dictionaries with non-string keys, falls back to the regular renderer, as do requests for indented output.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not self.use_orjson(data, accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            # pass datetimes through to the regular encoder since orjson doesn't replace +00:00 with Z
+            rendered = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # orjson always writes UTF-8 so escape anything which the regular renderer would have escaped
+        if UNESCAPED_BYTES.search(rendered):
+            rendered = UNESCAPED_CHARS.sub(lambda m: encode_basestring_ascii(m.group(0))[1:-1], rendered.decode())
+            rendered = rendered.encode()
+
+        return rendered
+
+    def use_orjson(self, data, accepted_media_type, renderer_context) -> bool:
+        if not settings.API_ORJSON_RENDERING:
+            return False
+        if orjson is None:
+            raise ImproperlyConfigured("API_ORJSON_RENDERING is enabled but orjson is not installed")
+
+        return (
+            data is not None
+            and self.ensure_ascii
+            and self.compact
+            and not self.get_indent(accepted_media_type, renderer_context)
+        )
+
+
+class NDJSONRenderer(FastJSONRenderer):
+    """
+    Renderer for newline delimited JSON. Endpoints which support it stream their results with each object rendered
+    separately, and anything else, e.g. an error, is rendered as a single line.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        # never indent as that would break the one object per line format
+        return super().render(data, None, renderer_context) + b"\n"
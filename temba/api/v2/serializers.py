@@ -32,6 +32,9 @@ from .validators import UniqueForOrgValidator
 
 INVALID_EXTRA_KEY_CHARS = regex.compile(r"[^a-zA-Z0-9_]")
 
+# UTC datetimes as stored in run JSON, e.g. 2021-03-04T10:11:12.123456789Z
+STORED_UTC_DATETIME = regex.compile(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?Z")
+
 logger = logging.getLogger(__name__)
 
 
@@ -42,6 +45,18 @@ def format_datetime(value):
     return json.encode_datetime(value, micros=True) if value else None
 
 
+def format_stored_datetime(value: str):
+    """
+    Formats a datetime string from run JSON in the same way as format_datetime. UTC values only need their fraction
+    padded or truncated to microseconds, so they're reformatted without being parsed.
+    """
+    match = STORED_UTC_DATETIME.fullmatch(value)
+    if match:
+        return f"{match.group(1)}.{(match.group(2) or '').ljust(6, '0')[:6]}Z"
+
+    return format_datetime(iso8601.parse_date(value))
+
+
 def normalize_extra(extra):
     """
     Normalizes a dict of extra passed to the flow start endpoint. We need to do this for backwards compatibility with
@@ -477,6 +492,32 @@ class ClassifierReadSerializer(ReadSerializer):
         fields = ("uuid", "name", "type", "intents", "created_on")
 
 
+class ContactFieldsTable:
+    """
+    Lookup of the given fields by UUID, so that the field values of a contact can be serialized by projecting the
+    values it has, rather than looking up every field on every contact
+    """
+
+    def __init__(self, contact_fields):
+        self.empty = {}
+        self.by_uuid = {}
+
+        for field in contact_fields:
+            self.empty[field.key] = None
+            self.by_uuid[str(field.uuid)] = (field.key, field.value_type)
+
+    def serialize(self, contact) -> dict:
+        serialized = self.empty.copy()
+
+        for field_uuid, json_value in (contact.fields or {}).items():
+            field = self.by_uuid.get(field_uuid)
+            if field and json_value:
+                key, value_type = field
+                serialized[key] = ContactField.serialize_json(value_type, json_value)
+
+        return serialized
+
+
 class ContactReadSerializer(ReadSerializer):
     name = serializers.SerializerMethodField()
     language = serializers.SerializerMethodField()
@@ -505,6 +546,11 @@ class ContactReadSerializer(ReadSerializer):
         if not obj.is_active:
             return []
 
+        # use the map of contacts to groups for the page if the endpoint has prepared one
+        contact_groups = self.context.get("contact_groups")
+        if contact_groups is not None:
+            return contact_groups.get(obj.id, [])
+
         groups = obj.prefetched_user_groups if hasattr(obj, "prefetched_user_groups") else obj.user_groups.all()
         return [{"uuid": g.uuid, "name": g.name} for g in groups]
 
@@ -512,6 +558,10 @@ class ContactReadSerializer(ReadSerializer):
         if not obj.is_active:
             return {}
 
+        fields_table = self.context.get("contact_fields_table")
+        if fields_table is not None:
+            return fields_table.serialize(obj)
+
         fields = {}
         for contact_field in self.context["contact_fields"]:
             fields[contact_field.key] = obj.get_field_serialized(contact_field)
@@ -869,7 +919,8 @@ class FlowReadSerializer(ReadSerializer):
         return [{"uuid": l.uuid, "name": l.name} for l in obj.labels.all()]
 
     def get_runs(self, obj):
-        stats = obj.get_run_stats()
+        # stats may be cached on the object
+        stats = obj.run_stats if hasattr(obj, "run_stats") else obj.get_run_stats()
         return {
             "active": stats["active"],
             "completed": stats["completed"],
@@ -945,6 +996,41 @@ class FlowRunReadSerializer(ReadSerializer):
     def get_exit_type(self, obj):
         return self.EXIT_TYPES.get(obj.status)
 
+    def to_representation(self, obj):
+        """
+        Hand-written equivalent of serializing field by field, which is too slow for pages of runs with long paths.
+        This skips field dispatch and formats the times in the path and results without parsing them.
+        """
+        fields = self.fields
+
+        return {
+            "id": obj.id,
+            "uuid": str(obj.uuid),
+            "flow": fields["flow"].to_representation(obj.flow),
+            "contact": fields["contact"].to_representation(obj.contact),
+            "start": {"uuid": str(obj.start.uuid)} if obj.start else None,
+            "responded": obj.responded,
+            "path": [
+                {"node": s[FlowRun.PATH_NODE_UUID], "time": format_stored_datetime(s[FlowRun.PATH_ARRIVED_ON])}
+                for s in obj.path
+            ],
+            "values": {
+                k: {
+                    "value": r[FlowRun.RESULT_VALUE],
+                    "category": r.get(FlowRun.RESULT_CATEGORY),
+                    "node": r[FlowRun.RESULT_NODE_UUID],
+                    "time": format_stored_datetime(r[FlowRun.RESULT_CREATED_ON]),
+                    "input": r.get(FlowRun.RESULT_INPUT),
+                    "name": r.get(FlowRun.RESULT_NAME),
+                }
+                for k, r in obj.results.items()
+            },
+            "created_on": fields["created_on"].to_representation(obj.created_on),
+            "modified_on": fields["modified_on"].to_representation(obj.modified_on),
+            "exited_on": fields["exited_on"].to_representation(obj.exited_on) if obj.exited_on else None,
+            "exit_type": self.EXIT_TYPES.get(obj.status),
+        }
+
     class Meta:
         model = FlowRun
         fields = (
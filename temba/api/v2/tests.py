@@ -1,7 +1,8 @@
 import base64
 import time
+import uuid
 from collections import OrderedDict
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 from unittest.mock import patch
 from urllib.parse import quote_plus
@@ -9,18 +10,22 @@ from urllib.parse import quote_plus
 import iso8601
 import pytz
 from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
 from django.conf import settings
 from django.contrib.auth.models import Group
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.db import connection
 from django.test import override_settings
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.translation import gettext_lazy
 
 from temba.api.models import APIToken, Resthook, WebHookEvent
+from temba.api.support import FastJSONRenderer
 from temba.archives.models import Archive
 from temba.campaigns.models import Campaign, CampaignEvent
 from temba.channels.models import Channel, ChannelEvent
@@ -43,7 +48,14 @@ from temba.triggers.models import Trigger
 from temba.utils import json
 
 from . import fields
-from .serializers import format_datetime, normalize_extra
+from .serializers import (
+    ContactReadSerializer,
+    FlowRunReadSerializer,
+    format_datetime,
+    format_stored_datetime,
+    normalize_extra,
+)
+from .views import ContactsEndpoint, RunsEndpoint
 
 NUM_BASE_REQUEST_QUERIES = 6  # number of db queries required for any API request
 
@@ -489,6 +501,124 @@ class APITest(TembaTest):
 
         self.assertEqual(returned_ids, actual_ids)  # ensure all results were returned and in correct order
 
+    def test_orjson_rendering(self):
+        regular, fast = JSONRenderer(), FastJSONRenderer()
+
+        data = OrderedDict(
+            [
+                ("uuid", uuid.UUID("b7cf0d83-f1c9-411c-96fd-c511a4cfa86d")),
+                ("created_on", datetime(2021, 3, 4, 5, 6, 7, 123456, pytz.UTC)),
+                ("modified_on", datetime(2021, 3, 4, 5, 6, 7, 0, pytz.UTC)),
+                ("day", date(2021, 3, 4)),
+                ("value", Decimal("12.5")),
+                ("name", 'Ann\u00e9e \U0001f600 \x7f \x1f \u2028 "quoted" \\ /'),
+                ("label", gettext_lazy("Label")),
+                ("items", [1, 2.5, None, True, (3, 4)]),
+            ]
+        )
+
+        # with the setting disabled we get the regular renderer
+        self.assertEqual(regular.render(data), fast.render(data))
+
+        with override_settings(API_ORJSON_RENDERING=True):
+            self.assertEqual(regular.render(data), fast.render(data))
+            self.assertEqual(b"", fast.render(None))
+
+            # things orjson can't encode the same way fall back to the regular renderer
+            self.assertEqual(regular.render({"count": 2 ** 70}), fast.render({"count": 2 ** 70}))
+            self.assertEqual(regular.render({1: "one"}), fast.render({1: "one"}))
+
+            # as do requests for indented output
+            self.assertEqual(
+                regular.render(data, "application/json; indent=4"), fast.render(data, "application/json; indent=4")
+            )
+
+        # enabling the setting without orjson installed is an error rather than silently ignored
+        with override_settings(API_ORJSON_RENDERING=True), patch("temba.api.support.orjson", None):
+            with self.assertRaises(ImproperlyConfigured):
+                fast.render(data)
+
+        # check that responses from actual endpoints are the same either way
+        self.login(self.admin)
+        self.create_field("age", "Age", value_type=ContactField.TYPE_NUMBER)
+        self.create_contact("Ren\u00e9e", phone="+250788000001", language="fra", fields={"age": "32.5"})
+        self.create_flow()
+
+        for endpoint in ("api.v2.contacts", "api.v2.fields", "api.v2.flows", "api.v2.groups", "api.v2.runs"):
+            response = self.fetchJSON(reverse(endpoint))
+
+            with override_settings(API_ORJSON_RENDERING=True):
+                self.assertEqual(response.content, self.fetchJSON(reverse(endpoint)).content)
+
+    def test_streaming(self):
+        self.login(self.admin)
+
+        def stream(endpoint, query=None):
+            url = reverse(endpoint) + ".ndjson" + (f"?{query}" if query else "")
+            response = self.client.get(url, HTTP_X_FORWARDED_HTTPS="https")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+            lines = b"".join(response.streaming_content).splitlines()
+            *results, last = [json.loads(line) for line in lines]
+            return results, last["next"]
+
+        for i in range(3):
+            self.create_contact(f"Contact {i}", phone=f"+25078800000{i}")
+
+        contacts = list(Contact.objects.filter(org=self.org, is_active=True).order_by("-modified_on", "-id"))
+        self.assertEqual(5, len(contacts))
+
+        # results are the same as those in pages
+        results, next_cursor = stream("api.v2.contacts")
+        self.assertEqual([str(c.uuid) for c in contacts], [r["uuid"] for r in results])
+        self.assertEqual(self.fetchJSON(reverse("api.v2.contacts")).json()["results"], results)
+        self.assertIsNone(next_cursor)
+
+        # streams are limited but can be resumed from where they stopped
+        with patch.object(ContactsEndpoint, "stream_batch_size", 2), patch.object(
+            ContactsEndpoint, "stream_max_results", 4
+        ):
+            results, next_cursor = stream("api.v2.contacts")
+            self.assertEqual([str(c.uuid) for c in contacts[:4]], [r["uuid"] for r in results])
+            self.assertIsNotNone(next_cursor)
+
+            results, next_cursor = stream("api.v2.contacts", f"cursor={next_cursor}")
+            self.assertEqual([str(contacts[4].uuid)], [r["uuid"] for r in results])
+            self.assertIsNone(next_cursor)
+
+        # filters still apply
+        results, next_cursor = stream("api.v2.contacts", f"uuid={self.joe.uuid}")
+        self.assertEqual([str(self.joe.uuid)], [r["uuid"] for r in results])
+
+        # messages and runs can also be streamed
+        msg1 = self.create_incoming_msg(self.joe, "Hello")
+        msg2 = self.create_incoming_msg(self.frank, "Hi")
+
+        results, next_cursor = stream("api.v2.messages", "folder=incoming")
+        self.assertEqual([msg2.id, msg1.id], [r["id"] for r in results])
+
+        flow = self.create_flow()
+        FlowRun.objects.bulk_create([FlowRun(org=self.org, flow=flow, contact=self.joe) for r in range(3)])
+        runs = list(FlowRun.objects.filter(org=self.org).order_by("-modified_on", "-id"))
+
+        with patch.object(RunsEndpoint, "stream_batch_size", 2), patch.object(RunsEndpoint, "stream_max_results", 2):
+            results, next_cursor = stream("api.v2.runs")
+            self.assertEqual([r.id for r in runs[:2]], [r["id"] for r in results])
+
+            results, next_cursor = stream("api.v2.runs", f"cursor={next_cursor}")
+            self.assertEqual([runs[2].id], [r["id"] for r in results])
+
+        # invalid cursors are errors rendered as a single line
+        response = self.client.get(reverse("api.v2.runs") + ".ndjson?cursor=xyz", HTTP_X_FORWARDED_HTTPS="https")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(b'{"detail":"Invalid cursor"}\n', response.content)
+
+        # and other endpoints can't be streamed
+        response = self.client.get(reverse("api.v2.groups") + ".ndjson", HTTP_X_FORWARDED_HTTPS="https")
+        self.assertEqual(response.status_code, 404)
+
     def test_authenticate(self):
         url = reverse("api.v2.authenticate")
 
@@ -1961,6 +2091,45 @@ class APITest(TembaTest):
         response = self.deleteJSON(url, "uuid=%s" % hans.uuid)
         self.assert404(response)
 
+    def test_contacts_prepared_fields_and_groups(self):
+        url = reverse("api.v2.contacts")
+        self.login(self.admin)
+
+        def assert_same_as_unprepared(response):
+            # serializing without the prepared fields table and groups map should give the same results
+            contacts = Contact.objects.filter(org=self.org, is_active=True).order_by("-modified_on", "-id")
+            context = {"org": self.org, "contact_fields": ContactField.user_fields.active_for_org(org=self.org)}
+            unprepared = ContactReadSerializer(contacts, many=True, context=context).data
+
+            self.assertEqual(json.loads(json.dumps(unprepared)), response.json()["results"])
+
+        self.create_field("age", "Age", value_type=ContactField.TYPE_NUMBER)
+        self.create_field("joined", "Joined", value_type=ContactField.TYPE_DATETIME)
+        self.create_contact("Ann", phone="0788000001", fields={"age": "12.50", "joined": "2021-03-04T05:06:07Z"})
+
+        deleted_field = self.create_field("deleted", "Deleted")
+        self.create_contact("Bob", phone="0788000002", fields={"deleted": "gone", "nickname": "Bobby"})
+        deleted_field.release(self.admin)
+
+        self.create_group("Customers", contacts=[self.joe, self.frank])
+        self.create_group("Testers", contacts=[self.joe])
+
+        with self.assertNumQueries(NUM_BASE_REQUEST_QUERIES + 4):
+            response = self.fetchJSON(url)
+
+        assert_same_as_unprepared(response)
+
+        # number of queries doesn't depend on the number of fields or groups
+        for i in range(20):
+            field = self.create_field(f"field_{i}", f"Field {i}")
+            self.create_group(f"Group {i}", contacts=[self.joe, self.frank])
+            self.create_contact(f"Contact {i}", phone=f"+2507880001{i:02d}", fields={field.key: f"Value {i}"})
+
+        with self.assertNumQueries(NUM_BASE_REQUEST_QUERIES + 4):
+            response = self.fetchJSON(url)
+
+        assert_same_as_unprepared(response)
+
     def test_prevent_modifying_contacts_with_fields_that_have_null_chars(self):
         """
         Verifies fix for: https://sentry.io/nyaruka/textit/issues/770220071/
@@ -2515,7 +2684,7 @@ class APITest(TembaTest):
         self.create_flow(org=self.org2, name="Other")
 
         # no filtering
-        with self.assertNumQueries(NUM_BASE_REQUEST_QUERIES + 5):
+        with self.assertNumQueries(NUM_BASE_REQUEST_QUERIES + 3):
             response = self.fetchJSON(url)
 
         resp_json = response.json()
@@ -3601,6 +3770,24 @@ class APITest(TembaTest):
         response = self.fetchJSON(url, "contact=%s&flow=%s" % (self.joe.uuid, flow1.uuid))
         self.assertResponseError(response, None, "You may only specify one of the contact, flow parameters")
 
+        # runs are serialized by hand but the same as they would be field by field
+        serializer = FlowRunReadSerializer(context={"org": self.org})
+        for run in (joe_run1, joe_run2, joe_run3, frank_run1, frank_run2):
+            by_field = super(FlowRunReadSerializer, serializer).to_representation(run)
+            self.assertEqual(list(by_field.items()), list(serializer.to_representation(run).items()))
+
+    def test_format_stored_datetime(self):
+        tests = (
+            ("2021-03-04T10:11:12.123456Z", "2021-03-04T10:11:12.123456Z"),
+            ("2021-03-04T10:11:12.123456789Z", "2021-03-04T10:11:12.123456Z"),
+            ("2021-03-04T10:11:12.12Z", "2021-03-04T10:11:12.120000Z"),
+            ("2021-03-04T10:11:12Z", "2021-03-04T10:11:12.000000Z"),
+            ("2021-03-04T12:11:12.123456+02:00", "2021-03-04T10:11:12.123456Z"),
+        )
+        for value, expected in tests:
+            self.assertEqual(expected, format_stored_datetime(value), f"mismatch for {value}")
+            self.assertEqual(format_datetime(iso8601.parse_date(value)), format_stored_datetime(value))
+
     def test_runs_with_action_results(self):
         """
         Runs from save_run_result actions may have some fields missing
@@ -72,4 +72,4 @@ urlpatterns = [
     url(r"^workspace$", WorkspaceEndpoint.as_view(), name="api.v2.workspace"),
 ]
 
-urlpatterns = format_suffix_patterns(urlpatterns, allowed=["json", "api"])
+urlpatterns = format_suffix_patterns(urlpatterns, allowed=["json", "api", "ndjson"])
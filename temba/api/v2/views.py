@@ -1,4 +1,5 @@
 import itertools
+from collections import defaultdict
 from enum import Enum
 
 from rest_framework import generics, status, views
@@ -57,6 +58,7 @@ from .serializers import (
     ClassifierReadSerializer,
     ContactBulkActionSerializer,
     ContactFieldReadSerializer,
+    ContactFieldsTable,
     ContactFieldWriteSerializer,
     ContactGroupReadSerializer,
     ContactGroupWriteSerializer,
@@ -1290,6 +1292,24 @@ class ContactsEndpoint(ListAPIMixin, WriteAPIMixin, DeleteAPIMixin, BaseAPIView)
             }]
         }
 
+    ## Streaming Contacts
+
+    To fetch all contacts without paging, for example to mirror them elsewhere, request the `ndjson` format. The
+    same filters can be used, and contacts are returned in the same order as pages, as one JSON object per line.
+    Streams are limited to 50,000 contacts and end with a line containing only a `next` cursor which can be
+    passed as the `cursor` parameter of another request to resume from that point. It is null when there are no more
+    contacts.
+
+    Example:
+
+        GET /api/v2/contacts.ndjson
+
+    Response is one contact per line, followed by the cursor:
+
+        {"uuid": ...}
+        {"uuid": ...}
+        {"next": "WyIyMDE1LTExLTExVDEzOjA1OjU3LjU3NjA1NiswMDowMCIsIDEyMzQ1XQ=="}
+
     ## Adding Contacts
 
     You can add a new contact to your account by sending a **POST** request to this URL with the following JSON data:
@@ -1378,8 +1398,13 @@ class ContactsEndpoint(ListAPIMixin, WriteAPIMixin, DeleteAPIMixin, BaseAPIView)
     write_with_transaction = False
     pagination_class = ModifiedOnCursorPagination
     throttle_scope = "v2.contacts"
+    streamable = True
     lookup_params = {"uuid": "uuid", "urn": "urns__identity"}
 
+    # prepared for each page of contacts being read
+    contact_fields_table = None
+    contact_groups = None
+
     def filter_queryset(self, queryset):
         params = self.request.query_params
         org = self.request.user.get_org()
@@ -1406,28 +1431,48 @@ class ContactsEndpoint(ListAPIMixin, WriteAPIMixin, DeleteAPIMixin, BaseAPIView)
             else:
                 queryset = queryset.filter(pk=-1)
 
-        # use prefetch rather than select_related for foreign keys to avoid joins
-        queryset = queryset.prefetch_related(
-            Prefetch(
-                "all_groups",
-                queryset=ContactGroup.user_groups.only("uuid", "name").order_by("pk"),
-                to_attr="prefetched_user_groups",
-            )
-        )
-
         return self.filter_before_after(queryset, "modified_on")
 
     def prepare_for_serialization(self, object_list):
+        if not object_list:
+            return
+
         # initialize caches of all contact fields and URNs
         org = self.request.user.get_org()
         Contact.bulk_cache_initialize(org, object_list)
 
+        # build a table of active fields once per request so field values can be serialized without looping over them
+        if self.contact_fields_table is None:
+            self.contact_fields_table = ContactFieldsTable(ContactField.user_fields.active_for_org(org=org))
+
+        # and map each contact to its user groups, fetched in a single query for the page
+        memberships = (
+            ContactGroup.contacts.through.objects.filter(
+                contact_id__in=[c.id for c in object_list],
+                contactgroup__group_type=ContactGroup.TYPE_USER_DEFINED,
+                contactgroup__is_active=True,
+            )
+            .order_by("contactgroup_id")
+            .values_list("contact_id", "contactgroup_id", "contactgroup__uuid", "contactgroup__name")
+        )
+
+        self.contact_groups = defaultdict(list)
+        groups_by_id = {}
+        for contact_id, group_id, group_uuid, group_name in memberships:
+            group = groups_by_id.get(group_id)
+            if not group:
+                group = groups_by_id[group_id] = {"uuid": group_uuid, "name": group_name}
+
+            self.contact_groups[contact_id].append(group)
+
     def get_serializer_context(self):
         """
         So that we only fetch active contact fields once for all contacts
         """
         context = super().get_serializer_context()
         context["contact_fields"] = ContactField.user_fields.active_for_org(org=self.request.user.get_org())
+        context["contact_fields_table"] = self.contact_fields_table
+        context["contact_groups"] = self.contact_groups
         return context
 
     def get_object(self):
@@ -1905,6 +1950,11 @@ class FlowsEndpoint(ListAPIMixin, BaseAPIView):
 
         return self.filter_before_after(queryset, "modified_on")
 
+    def prepare_for_serialization(self, object_list):
+        run_stats = Flow.get_run_stats_many(object_list)
+        for flow in object_list:
+            flow.run_stats = run_stats[flow]
+
     @classmethod
     def get_read_explorer(cls):
         return {
@@ -2496,6 +2546,24 @@ class MessagesEndpoint(ListAPIMixin, BaseAPIView):
             },
             ...
         }
+
+    ## Streaming Messages
+
+    To fetch all messages without paging, for example to mirror them elsewhere, request the `ndjson` format. The
+    same filters can be used, and messages are returned in the same order as pages, as one JSON object per line.
+    Streams are limited to 50,000 messages and end with a line containing only a `next` cursor which can be
+    passed as the `cursor` parameter of another request to resume from that point. It is null when there are no more
+    messages.
+
+    Example:
+
+        GET /api/v2/messages.ndjson?folder=incoming
+
+    Response is one message per line, followed by the cursor:
+
+        {"id": ...}
+        {"id": ...}
+        {"next": "WyIyMDE1LTExLTExVDEzOjA1OjU3LjU3NjA1NiswMDowMCIsIDEyMzQ1XQ=="}
     """
 
     class Pagination(CreatedOnCursorPagination):
@@ -2516,6 +2584,7 @@ class MessagesEndpoint(ListAPIMixin, BaseAPIView):
     pagination_class = Pagination
     exclusive_params = ("contact", "folder", "label", "broadcast")
     throttle_scope = "v2.messages"
+    streamable = True
 
     FOLDER_FILTERS = {
         "inbox": SystemLabel.TYPE_INBOX,
@@ -3052,6 +3121,24 @@ class RunsEndpoint(ListAPIMixin, BaseAPIView):
             },
             ...
         }
+
+    ## Streaming Runs
+
+    To fetch all runs without paging, for example to mirror them elsewhere, request the `ndjson` format. The
+    same filters can be used, and runs are returned in the same order as pages, as one JSON object per line.
+    Streams are limited to 50,000 runs and end with a line containing only a `next` cursor which can be
+    passed as the `cursor` parameter of another request to resume from that point. It is null when there are no more
+    runs.
+
+    Example:
+
+        GET /api/v2/runs.ndjson?flow=f5901b62-ba76-4003-9c62-72fdacc1b7b7
+
+    Response is one run per line, followed by the cursor:
+
+        {"uuid": ...}
+        {"uuid": ...}
+        {"next": "WyIyMDE1LTExLTExVDEzOjA1OjU3LjU3NjA1NiswMDowMCIsIDEyMzQ1XQ=="}
     """
 
     permission = "flows.flow_api"
@@ -3060,6 +3147,7 @@ class RunsEndpoint(ListAPIMixin, BaseAPIView):
     pagination_class = ModifiedOnCursorPagination
     exclusive_params = ("contact", "flow")
     throttle_scope = "v2.runs"
+    streamable = True
 
     def filter_queryset(self, queryset):
         params = self.request.query_params
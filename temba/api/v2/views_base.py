@@ -1,3 +1,4 @@
+import base64
 import contextlib
 from uuid import UUID
 
@@ -7,10 +8,13 @@ from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 
 from django.db import transaction
+from django.http import StreamingHttpResponse
 
 from temba.api.models import APIPermission, SSLPermission
-from temba.api.support import InvalidQueryError
+from temba.api.support import InvalidQueryError, NDJSONRenderer
 from temba.contacts.models import URN
+from temba.utils import json
+from temba.utils.models import KeysetIterator
 from temba.utils.views import NonAtomicMixin
 
 from .serializers import BulkActionFailure
@@ -104,12 +108,26 @@ class ListAPIMixin(mixins.ListModelMixin):
 
     exclusive_params = ()
 
+    # whether this endpoint can stream all of its results as NDJSON
+    streamable = False
+    stream_batch_size = 500
+    stream_max_results = 50000
+
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.streamable:
+            renderers.append(NDJSONRenderer())
+        return renderers
+
     def list(self, request, *args, **kwargs):
         self.check_query(self.request.query_params)
 
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return self.stream(request)
+
         if not kwargs.get("format", None):
             # if this is just a request to browse the endpoint docs, don't make a query
             return Response([])
@@ -157,6 +175,40 @@ class ListAPIMixin(mixins.ListModelMixin):
         """
         pass
 
+    def stream(self, request):
+        """
+        Streams all results as NDJSON, walking them in the same order as pages in batches. Streams are limited to
+        stream_max_results and end with an object whose next value is a cursor from which to resume or null.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        ordering = self.paginator.get_ordering(request, queryset, self)
+
+        cursor = request.query_params.get("cursor")
+        after = decode_stream_cursor(cursor) if cursor else None
+
+        batches = KeysetIterator(queryset, keys=ordering, batch_size=self.stream_batch_size, after=after)
+
+        return StreamingHttpResponse(self.stream_results(batches), content_type=NDJSONRenderer.media_type)
+
+    def stream_results(self, batches: KeysetIterator):
+        renderer = self.request.accepted_renderer
+        num_results = 0
+        next_cursor = None
+
+        for batch in batches:
+            self.prepare_for_serialization(batch)
+
+            for item in self.get_serializer(batch, many=True).data:
+                yield renderer.render(item)
+
+            num_results += len(batch)
+
+            if num_results >= self.stream_max_results:
+                next_cursor = encode_stream_cursor(batches.last_key)
+                break
+
+        yield renderer.render({"next": next_cursor})
+
 
 class WriteAPIMixin:
     """
@@ -246,6 +298,23 @@ class DeleteAPIMixin(mixins.DestroyModelMixin):
         instance.release()
 
 
+def encode_stream_cursor(key) -> str:
+    """
+    Encodes a (datetime, id) key of the last streamed result as a cursor token. The datetime may be null.
+    """
+    timestamp, obj_id = key
+    timestamp = timestamp.isoformat() if timestamp else None
+    return base64.urlsafe_b64encode(json.dumps([timestamp, obj_id]).encode()).decode()
+
+
+def decode_stream_cursor(token: str) -> tuple:
+    try:
+        timestamp, obj_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return iso8601.parse_date(timestamp) if timestamp is not None else None, int(obj_id)
+    except Exception:
+        raise InvalidQueryError("Invalid cursor")
+
+
 class CreatedOnCursorPagination(CursorPagination):
     ordering = ("-created_on", "-id")
     offset_cutoff = 1000000
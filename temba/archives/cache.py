@@ -0,0 +1,142 @@
+import os
+import threading
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO, Iterable, Optional
+
+from django.conf import settings
+
+from temba.utils import analytics
+
+# our cache instance, created on first use
+_archive_cache = None
+
+
+class CachedArchive:
+    """
+    A decompressed archive file in the cache, stored as JSONL
+    """
+
+    def __init__(self, lines_path: str):
+        self.lines_path = lines_path
+
+    def open(self) -> BinaryIO:
+        return open(self.lines_path, "rb")
+
+    def iter_lines(self) -> Iterable[bytes]:
+        with self.open() as f:
+            yield from f
+
+
+class ArchiveCache:
+    """
+    Local on-disk cache of decompressed archive files keyed by archive hash. When the total size of the cache exceeds
+    its maximum size, the least recently used archives are evicted.
+    """
+
+    LINES_EXT = ".jsonl"
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.LINES_EXT)
+
+    def get(self, key: str) -> Optional[CachedArchive]:
+        lines_path = self._path(key)
+
+        try:
+            # touch the file so that its modified time can be used to track recency of use
+            os.utime(lines_path)
+            cached = CachedArchive(lines_path)
+        except FileNotFoundError:
+            cached = None
+
+        with self._lock:
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            hit_ratio = self.hits / (self.hits + self.misses)
+
+        analytics.gauge("temba.archive_cache_hit_ratio", hit_ratio)
+        return cached
+
+    def put(self, key: str, lines: Iterable[bytes]) -> CachedArchive:
+        """
+        Writes the given lines to the cache under the given key
+        """
+        lines_path = self._path(key)
+
+        # write to a temporary file and then move it into place so readers never see partially written archives
+        with NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as lines_file:
+            for line in lines:
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+
+                lines_file.write(line)
+
+        os.replace(lines_file.name, lines_path)
+
+        self.evict(keep=key)
+
+        return CachedArchive(lines_path)
+
+    def remove(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, keep: str = None):
+        """
+        Evicts least recently used archives until the cache is within its maximum size
+        """
+        with self._lock:
+            entries = []
+            total_size = 0
+
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(self.LINES_EXT):
+                    key = entry.name[: -len(self.LINES_EXT)]
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:  # pragma: no cover
+                        continue
+
+                    entries.append((stat.st_mtime, key, stat.st_size))
+                    total_size += stat.st_size
+
+            for last_used, key, size in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                if key == keep:
+                    continue
+
+                self.remove(key)
+                total_size -= size
+
+
+def get_archive_cache() -> Optional[ArchiveCache]:
+    """
+    Gets the archive cache if one is configured
+    """
+    global _archive_cache
+
+    if not settings.ARCHIVE_CACHE_DIR:
+        return None
+
+    if (
+        _archive_cache is None
+        or _archive_cache.directory != settings.ARCHIVE_CACHE_DIR
+        or _archive_cache.max_size != settings.ARCHIVE_CACHE_MAX_SIZE
+    ):
+        _archive_cache = ArchiveCache(settings.ARCHIVE_CACHE_DIR, settings.ARCHIVE_CACHE_MAX_SIZE)
+
+    return _archive_cache
@@ -1,10 +1,12 @@
 import gzip
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from gettext import gettext as _
+from tempfile import SpooledTemporaryFile
 from urllib.parse import urlparse
 
 import boto3
-import iso8601
 from dateutil.relativedelta import relativedelta
 
 from django.conf import settings
@@ -13,7 +15,9 @@ from django.db.models import Q
 from django.utils import timezone
 
 from temba.utils import json, sizeof_fmt
-from temba.utils.s3 import EventStreamReader
+from temba.utils.s3 import EventStreamReader, SelectExpression, select_literal
+
+from .cache import get_archive_cache
 
 
 class Archive(models.Model):
@@ -27,6 +31,9 @@ class Archive(models.Model):
     PERIOD_MONTHLY = "M"
     PERIOD_CHOICES = ((PERIOD_DAILY, "Day"), (PERIOD_MONTHLY, "Month"))
 
+    # prefetched archives are kept in memory up to this size and then spill to disk
+    PREFETCH_SPOOL_SIZE = 10 * 1024 * 1024
+
     org = models.ForeignKey("orgs.Org", related_name="archives", on_delete=models.PROTECT)
 
     archive_type = models.CharField(choices=TYPE_CHOICES, max_length=16)
@@ -148,6 +155,21 @@ class Archive(models.Model):
 
         return archives.order_by("start_date")
 
+    @classmethod
+    def get_archived_until(cls, org, archive_type: str, after: datetime = None, before: datetime = None):
+        """
+        Gets the end of the latest archive which covers the given period, i.e. records created before then are found
+        in archives rather than the database, or None if there are no such archives
+        """
+        archives = cls._get_covering_period(org, archive_type, after, before)
+        end_dates = [a.get_end_date() for a in archives]
+
+        return (
+            timezone.make_aware(datetime.combine(max(end_dates), datetime.min.time()), timezone.utc)
+            if end_dates
+            else None
+        )
+
     @classmethod
     def iter_all_records(
         cls, org, archive_type: str, after: datetime = None, before: datetime = None, expression: str = None
@@ -155,27 +177,101 @@ class Archive(models.Model):
         """
         Creates a record iterator across archives of the given type for records which match the given criteria
 
-        Expression should be SQL with s prefix for fields, e.g. s.direction = 'in' AND s.type = 'flow'
+        Expression should be SQL with s prefix for fields, e.g. s.direction = 'in' AND s.type = 'flow'. Date criteria
+        are added to the expression so that records outside of the period are filtered out by S3 Select.
+
+        Archives are downloaded and decompressed ahead of being consumed by a bounded pool of threads, but records are
+        always yielded in archive order.
         """
+        conditions = []
+        if after:
+            conditions.append(f"CAST(s.created_on AS TIMESTAMP) >= {select_literal(after)}")
+        if before:
+            conditions.append(f"CAST(s.created_on AS TIMESTAMP) <= {select_literal(before)}")
+        if expression:
+            conditions.append(f"({expression})")
+
+        expression = " AND ".join(conditions) or None
+        cache = get_archive_cache()
         archives = cls._get_covering_period(org, archive_type, after, before)
-        for archive in archives:
-            for record in archive.iter_records(expression):
 
-                # TODO could do this in S3 select
-                created_on = iso8601.parse_date(record["created_on"])
-                if after and created_on < after:
-                    continue
-                if before and created_on > before:
-                    continue
+        for lines in cls._iter_prefetched(archives, cache, expression):
+            # cached copies are complete so the expression must be evaluated locally
+            yield from cls._iter_decoded(lines, expression if cache else None)
 
-                yield record
+    @classmethod
+    def _iter_prefetched(cls, archives, cache, expression: str = None):
+        """
+        Iterates over the given archives, yielding for each one a file of its decompressed JSONL lines. While one file
+        is being consumed, up to ARCHIVE_PREFETCH_SIZE of the following archives are being fetched in the background.
+        """
+        s3 = cls.s3_client()  # boto clients are thread safe so this can be shared by the workers
+        archives = iter(archives)
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=settings.ARCHIVE_PREFETCH_SIZE) as executor:
+
+            def fetch_next():
+                archive = next(archives, None)
+                if archive:
+                    pending.append(executor.submit(archive._fetch_lines, s3, cache, expression))
+
+            try:
+                for i in range(settings.ARCHIVE_PREFETCH_SIZE):
+                    fetch_next()
+
+                while pending:
+                    lines = pending.popleft().result()
+                    fetch_next()
+
+                    with lines:
+                        yield lines
+            finally:
+                # if our consumer stopped early, don't bother fetching archives it won't read
+                for future in pending:
+                    if not future.cancel() and not future.exception():
+                        future.result().close()
+
+    def _fetch_lines(self, s3, cache, expression: str = None):
+        """
+        Downloads and decompresses the lines of this archive, returning them as an open file. If we have a cache, that's
+        the unfiltered cached copy, otherwise it's a temporary file of the lines which matched the expression.
+        """
+        if cache:
+            return self._get_cached(cache, s3).open()
+
+        lines = SpooledTemporaryFile(max_size=self.PREFETCH_SPOOL_SIZE)
+        for line in self._iter_lines(s3, expression):
+            lines.write(line)
+        lines.seek(0)
+        return lines
 
     def iter_records(self, expression: str = None):
         """
         Creates an iterator for the records in this archive, streaming and decompressing on the fly
         """
         s3 = self.s3_client()
+        cache = get_archive_cache()
+
+        if cache:
+            with self._get_cached(cache, s3).open() as lines:
+                yield from self._iter_decoded(lines, expression)
+        else:
+            yield from self._iter_decoded(self._iter_lines(s3, expression))
+
+    @staticmethod
+    def _iter_decoded(lines, expression: str = None):
+        """
+        Decodes the given JSONL lines, yielding only the records which match the given expression if there is one
+        """
+        where = SelectExpression(expression) if expression else None
 
+        for line in lines:
+            record = json.loads(line.decode("utf-8"))
+            if not where or where.matches(record):
+                yield record
+
+    def _iter_lines(self, s3, expression: str = None):
         if expression:
             response = s3.select_object_content(
                 **self.s3_location(),
@@ -185,8 +281,7 @@ class Archive(models.Model):
                 OutputSerialization={"JSON": {"RecordDelimiter": "\n"}},
             )
 
-            for record in EventStreamReader(response["Payload"]):
-                yield record
+            yield from EventStreamReader(response["Payload"]).iter_lines()
         else:
             s3_obj = s3.get_object(**self.s3_location())
             stream = gzip.GzipFile(fileobj=s3_obj["Body"])
@@ -196,18 +291,32 @@ class Archive(models.Model):
                 if not line:
                     break
 
-                yield json.loads(line.decode("utf-8"))
+                yield line
+
+    def _get_cached(self, cache, s3):
+        """
+        Gets the local cached copy of this archive, downloading it first if necessary
+        """
+        cached = cache.get(self.hash)
+        if not cached:
+            s3_obj = s3.get_object(**self.s3_location())
+            cached = cache.put(self.hash, gzip.GzipFile(fileobj=s3_obj["Body"]))
+        return cached
 
     def release(self):
 
         # detach us from our rollups
         Archive.objects.filter(rollup=self).update(rollup=None)
 
-        # delete our archive file from s3
+        # delete our archive file from s3 and any local copy
         if self.url:
             s3 = self.s3_client()
             s3.delete_object(**self.s3_location())
 
+            cache = get_archive_cache()
+            if cache:
+                cache.remove(self.hash)
+
         # and lastly delete ourselves
         self.delete()
 
@@ -1,14 +1,19 @@
+import json
+import tempfile
+import time
 from datetime import date, datetime
 from unittest.mock import patch
 
 import pytz
 
+from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
 from temba.tests import CRUDLTestMixin, TembaTest
-from temba.tests.s3 import MockS3Client
+from temba.tests.s3 import LocalS3Client, MockS3Client
 
+from .cache import ArchiveCache, get_archive_cache
 from .models import Archive
 
 
@@ -30,15 +35,18 @@ class ArchiveTest(TembaTest):
     def test_iter_records_with_expression(self):
         mock_s3 = MockS3Client()
         archive = self.create_archive(
-            Archive.TYPE_MSG, "D", timezone.now().date(), [{"id": 1}, {"id": 2}, {"id": 3}], s3=mock_s3
+            Archive.TYPE_MSG,
+            "D",
+            timezone.now().date(),
+            [{"id": 1, "direction": "in"}, {"id": 2, "direction": "out"}, {"id": 3, "direction": "in"}],
+            s3=mock_s3,
         )
 
         with patch("temba.archives.models.Archive.s3_client", return_value=mock_s3):
             records_iter = archive.iter_records(expression="s.direction = 'in'")
 
-            self.assertEqual(next(records_iter), {"id": 1})
-            self.assertEqual(next(records_iter), {"id": 2})
-            self.assertEqual(next(records_iter), {"id": 3})
+            self.assertEqual(next(records_iter), {"id": 1, "direction": "in"})
+            self.assertEqual(next(records_iter), {"id": 3, "direction": "in"})
             self.assertRaises(StopIteration, next, records_iter)
 
     @patch("temba.archives.models.Archive.s3_client")
@@ -105,6 +113,182 @@ class ArchiveTest(TembaTest):
             [2, 3, 4, 5],
         )
 
+        # date criteria are pushed into the S3 Select expression along with any other criteria
+        with patch.object(mock_s3, "select_object_content", wraps=mock_s3.select_object_content) as mock_select:
+            assert_records(
+                Archive.iter_all_records(
+                    self.org,
+                    Archive.TYPE_MSG,
+                    after=datetime(2020, 7, 30, 12, 0, 0, 0, pytz.UTC),
+                    expression="s.id != 4",
+                ),
+                [2, 3, 5, 6],
+            )
+
+            self.assertEqual(
+                "SELECT * FROM s3object s WHERE CAST(s.created_on AS TIMESTAMP) >= "
+                "CAST('2020-07-30T12:00:00+00:00' AS TIMESTAMP) AND (s.id != 4)",
+                mock_select.call_args[1]["Expression"],
+            )
+
+        # without any criteria we just download the whole archive
+        with patch.object(mock_s3, "select_object_content") as mock_select:
+            assert_records(Archive.iter_all_records(self.org, Archive.TYPE_MSG), [1, 2, 3, 4, 5, 6])
+            self.assertEqual(0, mock_select.call_count)
+
+    def test_get_archived_until(self):
+        self.assertIsNone(Archive.get_archived_until(self.org, Archive.TYPE_MSG))
+
+        self.create_archive(Archive.TYPE_MSG, "M", date(2020, 7, 1), [{"id": 1}])
+        self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, 1), [{"id": 2}])
+        self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, 2), [])  # empty so ignored
+        self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2020, 8, 5), [{"id": 3}])
+
+        self.assertEqual(
+            datetime(2020, 8, 2, 0, 0, 0, 0, pytz.UTC), Archive.get_archived_until(self.org, Archive.TYPE_MSG)
+        )
+        self.assertEqual(
+            datetime(2020, 8, 1, 0, 0, 0, 0, pytz.UTC),
+            Archive.get_archived_until(self.org, Archive.TYPE_MSG, before=datetime(2020, 7, 15, 0, 0, 0, 0, pytz.UTC)),
+        )
+        self.assertEqual(
+            datetime(2020, 8, 6, 0, 0, 0, 0, pytz.UTC), Archive.get_archived_until(self.org, Archive.TYPE_FLOWRUN)
+        )
+
+    @override_settings(ARCHIVE_PREFETCH_SIZE=2)
+    def test_iter_all_records_prefetched(self):
+        with tempfile.TemporaryDirectory() as root:
+            local_s3 = LocalS3Client(root)
+
+            for d in range(1, 7):
+                self.create_archive(
+                    Archive.TYPE_MSG,
+                    "D",
+                    date(2020, 8, d),
+                    [{"id": d * 10 + i, "created_on": f"2020-08-0{d}T1{i}:00:00Z"} for i in range(3)],
+                    s3=local_s3,
+                )
+
+            get_object = local_s3.get_object
+            fetched = []
+
+            def slow_get_object(Bucket, Key, **kwargs):
+                # make earlier archives slower to download than later ones
+                time.sleep(0.05 * (6 - len(fetched)))
+                fetched.append(Key)
+                return get_object(Bucket, Key, **kwargs)
+
+            with patch("temba.archives.models.Archive.s3_client", return_value=local_s3):
+                with patch.object(local_s3, "get_object", side_effect=slow_get_object):
+                    records = list(Archive.iter_all_records(self.org, Archive.TYPE_MSG))
+
+                    # records still come out in archive order
+                    self.assertEqual([d * 10 + i for d in range(1, 7) for i in range(3)], [r["id"] for r in records])
+                    self.assertEqual(6, len(fetched))
+
+                    # if we stop consuming early, archives which haven't started downloading are skipped
+                    fetched.clear()
+                    records_iter = Archive.iter_all_records(self.org, Archive.TYPE_MSG)
+                    self.assertEqual(10, next(records_iter)["id"])
+                    records_iter.close()
+
+                    self.assertLessEqual(len(fetched), 4)
+
+                # expressions are passed through to S3 select
+                records = list(Archive.iter_all_records(self.org, Archive.TYPE_MSG, expression="s.direction = 'in'"))
+                self.assertEqual(18, len(records))
+
+                # local client also supports what we need to release archives
+                archive = Archive.objects.filter(org=self.org).first()
+                archive.release()
+
+                self.assertEqual(5, len(local_s3.list_objects_v2(Bucket="s3-bucket", Prefix="things/")["Contents"]))
+
+    @patch("temba.utils.analytics.gauge")
+    def test_iter_records_cached(self, mock_gauge):
+        mock_s3 = MockS3Client()
+        records = [{"id": 1, "direction": "in"}, {"id": 2, "direction": "out"}, {"id": 3, "direction": "in"}]
+        archive1 = self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, 1), records, s3=mock_s3)
+        archive2 = self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, 2), records, s3=mock_s3)
+
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(ARCHIVE_CACHE_DIR=cache_dir):
+            cache = get_archive_cache()
+            self.assertEqual(cache_dir, cache.directory)
+
+            with patch("temba.archives.models.Archive.s3_client", return_value=mock_s3):
+                with patch.object(mock_s3, "get_object", wraps=mock_s3.get_object) as mock_get:
+                    self.assertEqual(records, list(archive1.iter_records()))
+                    self.assertEqual(1, mock_get.call_count)
+                    self.assertEqual((0, 1), (cache.hits, cache.misses))
+
+                    # second time around we don't touch S3 at all
+                    self.assertEqual(records, list(archive1.iter_records()))
+                    self.assertEqual(1, mock_get.call_count)
+                    self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+                    # expressions are evaluated locally against the cached copy
+                    with patch.object(mock_s3, "select_object_content") as mock_select:
+                        self.assertEqual([1, 3], [r["id"] for r in archive1.iter_records("s.direction = 'in'")])
+                        self.assertEqual(0, mock_select.call_count)
+
+                    self.assertEqual([1, 3], [r["id"] for r in archive2.iter_records("s.direction = 'in'")])
+                    self.assertEqual(2, mock_get.call_count)
+
+                # gauge reports the ratio of hits to lookups
+                mock_gauge.assert_any_call("temba.archive_cache_hit_ratio", 0.0)
+                mock_gauge.assert_called_with("temba.archive_cache_hit_ratio", 0.5)
+
+                # iterating across archives reads the cached copies and decodes each line once
+                with patch("temba.archives.models.json.loads", wraps=json.loads) as mock_loads:
+                    self.assertEqual(
+                        [1, 3, 1, 3],
+                        [
+                            r["id"]
+                            for r in Archive.iter_all_records(
+                                self.org, Archive.TYPE_MSG, expression="s.direction = 'in'"
+                            )
+                        ],
+                    )
+                    self.assertEqual(6, mock_loads.call_count)
+                    self.assertEqual(1, mock_get.call_count)
+
+                cached = cache.get(archive1.hash)
+                self.assertEqual(
+                    [
+                        b'{"id": 1, "direction": "in"}\n',
+                        b'{"id": 2, "direction": "out"}\n',
+                        b'{"id": 3, "direction": "in"}\n',
+                    ],
+                    list(cached.iter_lines()),
+                )
+
+                # releasing an archive removes its cached copy
+                archive2.release()
+                self.assertIsNone(cache.get(archive2.hash))
+
+    def test_cache_eviction(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            line = b'{"id": 1}\n'
+            cache = ArchiveCache(cache_dir, max_size=100)
+
+            cache.put("a", [line] * 2)
+            cache.put("b", [line] * 2)
+            time.sleep(0.01)
+            cache.get("a")  # makes b the least recently used
+
+            # lines without trailing newlines are terminated
+            cache.put("c", [line, b'{"id": 2}'])
+
+            self.assertIsNotNone(cache.get("a"))
+            self.assertIsNone(cache.get("b"))
+            self.assertEqual([line, b'{"id": 2}\n'], list(cache.get("c").iter_lines()))
+
+            # newly added entries are kept even if they alone exceed the max size
+            cache.put("d", [line] * 20)
+            self.assertIsNone(cache.get("a"))
+            self.assertIsNone(cache.get("c"))
+            self.assertEqual(20, len(list(cache.get("d").iter_lines())))
+
     def test_end_date(self):
         daily = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2018, 2, 1), [], needs_deletion=True)
         monthly = self.create_archive(Archive.TYPE_FLOWRUN, "M", date(2018, 1, 1), [])
@@ -77,7 +77,8 @@ class BaseAssetStore(object):
             raise AssetFileNotFound()
 
         # create a more friendly download filename
-        remainder, extension = path.rsplit(".", 1)
+        # extensions can be compound, e.g. jsonl.gz, but base names are UUIDs so never contain dots
+        extension = os.path.basename(path).split(".", 1)[1]
         filename = f"{self.key}_{pk}_{slugify(asset.org.name)}.{extension}"
 
         # if our storage backend is S3
@@ -1113,6 +1113,7 @@ class ChannelCount(SquashableModel):
     """
 
     SQUASH_OVER = ("channel_id", "count_type", "day")
+    SQUASH_BATCHED = True
 
     INCOMING_MSG_TYPE = "IM"  # Incoming message
     OUTGOING_MSG_TYPE = "OM"  # Outgoing message
@@ -1229,7 +1230,11 @@ class ChannelEvent(models.Model):
     created_on = models.DateTimeField(default=timezone.now)
 
     @classmethod
-    def create_relayer_event(cls, channel, urn, event_type, occurred_on, extra=None):
+    def create_relayer_event(cls, channel, urn, event_type, occurred_on, extra=None, handle=True):
+        """
+        Creates a channel event from a relayer. Unless handle is false, in which case callers should queue missed calls
+        for handling themselves, missed calls are queued for handling by mailroom after we commit.
+        """
         from temba.contacts.models import Contact
 
         contact, contact_urn = Contact.resolve(channel, urn)
@@ -1244,12 +1249,15 @@ class ChannelEvent(models.Model):
             extra=extra,
         )
 
-        if event_type == cls.TYPE_CALL_IN_MISSED:
+        if handle and event.is_handled_by_mailroom():
             # pass off handling of the message to mailroom after we commit
             on_transaction_commit(lambda: mailroom.queue_mo_miss_event(event))
 
         return event
 
+    def is_handled_by_mailroom(self) -> bool:
+        return self.event_type == self.TYPE_CALL_IN_MISSED
+
     @classmethod
     def get_all(cls, org):
         return cls.objects.filter(org=org)
@@ -38,12 +38,13 @@ from django.utils.http import urlencode
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.csrf import csrf_exempt
 
+from temba import mailroom
 from temba.contacts.models import URN
 from temba.msgs.models import OUTGOING, PENDING, QUEUED, WIRED, Msg, SystemLabel
 from temba.msgs.views import InboxView
 from temba.orgs.models import Org
 from temba.orgs.views import AnonMixin, ModalMixin, OrgObjPermsMixin, OrgPermsMixin
-from temba.utils import analytics, json
+from temba.utils import analytics, json, on_transaction_commit
 from temba.utils.fields import SelectWidget
 from temba.utils.http import http_headers
 from temba.utils.models import patch_queryset_count
@@ -783,6 +784,10 @@ def sync(request, channel_id):
 
     unique_calls = set()
 
+    # new messages and events to be queued for handling together once we commit
+    handle_msgs = []
+    handle_events = []
+
     for cmd in cmds:
         handled = False
         extra = None
@@ -809,8 +814,10 @@ def sync(request, channel_id):
                     urn = URN.normalize(URN.from_tel(tel), channel.country.code)
 
                     if "msg" in cmd:
-                        msg = Msg.create_relayer_incoming(channel.org, channel, urn, cmd["msg"], date)
+                        msg, created = Msg.get_or_create_relayer_incoming(channel.org, channel, urn, cmd["msg"], date)
                         extra = dict(msg_id=msg.id)
+                        if created:
+                            handle_msgs.append(msg)
                 except ValueError:
                     pass
 
@@ -831,9 +838,11 @@ def sync(request, channel_id):
                 if cmd["phone"] and call_tuple not in unique_calls:
                     urn = URN.from_tel(cmd["phone"])
                     try:
-                        ChannelEvent.create_relayer_event(
-                            channel, urn, cmd["type"], date, extra=dict(duration=duration)
+                        event = ChannelEvent.create_relayer_event(
+                            channel, urn, cmd["type"], date, extra=dict(duration=duration), handle=False
                         )
+                        if event.is_handled_by_mailroom():
+                            handle_events.append(event)
                     except ValueError:
                         # in some cases Android passes us invalid URNs, in those cases just ignore them
                         pass
@@ -879,6 +888,11 @@ def sync(request, channel_id):
 
             commands.append(ack)
 
+    if handle_msgs:
+        on_transaction_commit(lambda: mailroom.queue_msg_handling_many(handle_msgs))
+    if handle_events:
+        on_transaction_commit(lambda: mailroom.queue_mo_miss_events_many(handle_events))
+
     outgoing_cmds = get_commands(channel, commands, sync_event)
     result = dict(cmds=outgoing_cmds)
 
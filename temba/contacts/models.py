@@ -1,8 +1,10 @@
+import heapq
 import logging
 import time
+from collections import defaultdict
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from itertools import chain
+from itertools import chain, islice
 from pathlib import Path
 from typing import Any, Dict, List, Set, Tuple
 from uuid import uuid4
@@ -18,9 +20,11 @@ from django.conf import settings
 from django.contrib.postgres.fields import ArrayField, JSONField
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.db import IntegrityError, models, transaction
+from django.db import IntegrityError, connection, models, transaction
 from django.db.models import Count, F, Max, Q, Sum, Value
 from django.db.models.functions import Concat
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
@@ -29,10 +33,17 @@ from temba.assets.models import register_asset_store
 from temba.channels.models import Channel, ChannelEvent
 from temba.locations.models import AdminBoundary
 from temba.mailroom import ContactSpec, modifiers, queue_populate_dynamic_group
-from temba.orgs.models import Org, OrgLock
-from temba.utils import chunk_list, format_number, on_transaction_commit
+from temba.orgs.models import Org, OrgCache, OrgLock
+from temba.utils import chunk_list, format_number, json, on_transaction_commit
+from temba.utils.dates import datetime_to_str
 from temba.utils.export import BaseExportAssetStore, BaseExportTask, TableExporter
-from temba.utils.models import JSONField as TembaJSONField, RequireUpdateFieldsMixin, SquashableModel, TembaModel
+from temba.utils.models import (
+    JSONField as TembaJSONField,
+    KeysetIterator,
+    RequireUpdateFieldsMixin,
+    SquashableModel,
+    TembaModel,
+)
 from temba.utils.text import decode_stream, truncate, unsnakify
 from temba.utils.urns import ParsedURN, parse_number, parse_urn
 
@@ -372,6 +383,8 @@ class ContactField(SmartModel):
     TYPE_DISTRICT = "I"
     TYPE_WARD = "W"
 
+    LOCATION_TYPES = (TYPE_STATE, TYPE_DISTRICT, TYPE_WARD)
+
     TYPE_CHOICES = (
         (TYPE_TEXT, _("Text")),
         (TYPE_NUMBER, _("Number")),
@@ -595,6 +608,15 @@ class ContactField(SmartModel):
     def get_by_key(cls, org, key):
         return cls.user_fields.active_for_org(org=org).filter(key=key).first()
 
+    @classmethod
+    def get_by_key_cached(cls, org, key):
+        """
+        Gets an active user field by key using the process-local cache of the org's fields. The returned field is
+        shared and shouldn't be modified.
+        """
+        fields = OrgCache.fields.local.get(org.id, lambda: {f.key: f for f in cls.user_fields.active_for_org(org=org)})
+        return fields.get(key)
+
     @classmethod
     def get_location_field(cls, org, value_type):
         return cls.user_fields.active_for_org(org=org).filter(value_type=value_type).first()
@@ -613,6 +635,19 @@ class ContactField(SmartModel):
             field_type = field_def.get(ContactField.EXPORT_TYPE)
             ContactField.get_or_create(org, user, key=field_key, label=field_name, value_type=db_types[field_type])
 
+    @classmethod
+    def serialize_json(cls, value_type, json_value):
+        """
+        Given the JSON value of a field of the passed in type, returns the value as a string or None
+        """
+        engine_type = cls.ENGINE_TYPES[value_type]
+
+        if value_type == cls.TYPE_NUMBER:
+            dec_value = json_value.get(engine_type, json_value.get("decimal"))
+            return format_number(Decimal(dec_value)) if dec_value is not None else None
+
+        return json_value.get(engine_type)
+
     def as_export_def(self):
         return {
             ContactField.EXPORT_KEY: self.key,
@@ -629,6 +664,13 @@ class ContactField(SmartModel):
         return "%s" % self.label
 
 
+@receiver((post_save, post_delete), sender=ContactField)
+def invalidate_field_cache(sender, instance, **kwargs):
+    # wait for the change to be committed, otherwise other processes could reload the old fields before it is
+    org_id = instance.org_id
+    on_transaction_commit(lambda: OrgCache.fields.local.invalidate(org_id))
+
+
 class Contact(RequireUpdateFieldsMixin, TembaModel):
     """
     A contact represents an individual with which we can communicate and collect data
@@ -765,96 +807,113 @@ class Contact(RequireUpdateFieldsMixin, TembaModel):
         """
         Gets this contact's history of messages, calls, runs etc in the given time window
         """
+        return list(islice(self.iter_history(after, before, include_event_types, page_size=limit), limit))
+
+    def iter_history(self, after: datetime, before: datetime, include_event_types: set, page_size: int = 100):
+        """
+        Iterates over this contact's history of messages, calls, runs etc in the given time window, newest first. Each
+        type of item is fetched lazily in pages which are already in order, and merged as they are consumed, so that
+        taking the first N items never fetches more than N items of any one type.
+        """
         from temba.flows.models import FlowExit
         from temba.ivr.models import IVRCall
         from temba.mailroom.events import get_event_time
         from temba.msgs.models import Msg
 
+        def items(queryset, time_key="created_on"):
+            return chain.from_iterable(KeysetIterator(queryset, keys=(f"-{time_key}", "-id"), batch_size=page_size))
+
         msgs = (
             self.msgs.filter(created_on__gte=after, created_on__lt=before)
             .exclude(visibility=Msg.VISIBILITY_DELETED)
-            .order_by("-created_on")
             .select_related("channel", "contact_urn", "broadcast")
-            .prefetch_related("channel_logs")[:limit]
+            .prefetch_related("channel_logs")
         )
 
-        # get all runs start started or ended in this period
-        runs = (
-            self.runs.filter(
-                Q(created_on__gte=after, created_on__lt=before)
-                | Q(exited_on__isnull=False, exited_on__gte=after, exited_on__lt=before)
-            )
-            .exclude(flow__is_system=True)
-            .order_by("-created_on")
-            .select_related("flow")[:limit]
-        )
-        started_runs = [r for r in runs if after <= r.created_on < before]
-        exited_runs = [FlowExit(r) for r in runs if r.exited_on and after <= r.exited_on < before]
+        # runs appear as a start when they were created in this period and as an exit when they exited in it
+        runs = self.runs.exclude(flow__is_system=True).select_related("flow")
+        started_runs = runs.filter(created_on__gte=after, created_on__lt=before)
+        exited_runs = runs.filter(exited_on__isnull=False, exited_on__gte=after, exited_on__lt=before)
 
-        channel_events = (
-            self.channel_events.filter(created_on__gte=after, created_on__lt=before)
-            .order_by("-created_on")
-            .select_related("channel")[:limit]
+        channel_events = self.channel_events.filter(created_on__gte=after, created_on__lt=before).select_related(
+            "channel"
         )
 
         campaign_events = (
             self.campaign_fires.filter(fired__gte=after, fired__lt=before)
             .exclude(fired=None)
-            .order_by("-fired")
-            .select_related("event__campaign", "event__relative_to")[:limit]
+            .select_related("event__campaign", "event__relative_to")
         )
 
-        webhook_results = self.webhook_results.filter(created_on__gte=after, created_on__lt=before).order_by(
-            "-created_on"
-        )[:limit]
+        webhook_results = self.webhook_results.filter(created_on__gte=after, created_on__lt=before)
 
         calls = (
             IVRCall.objects.filter(contact=self, created_on__gte=after, created_on__lt=before)
             .filter(status__in=[IVRCall.BUSY, IVRCall.FAILED, IVRCall.NO_ANSWER, IVRCall.CANCELED, IVRCall.COMPLETED])
-            .order_by("-created_on")
-            .select_related("channel")[:limit]
+            .select_related("channel")
         )
 
-        transfers = self.airtime_transfers.filter(created_on__gte=after, created_on__lt=before).order_by(
-            "-created_on"
-        )[:limit]
-
-        session_events = self.get_session_events(after, before, include_event_types)
-
-        # chain all items together, sort by their event time, and slice
-        items = chain(
-            msgs,
-            started_runs,
-            exited_runs,
-            channel_events,
-            campaign_events,
-            webhook_results,
-            calls,
-            transfers,
-            session_events,
+        transfers = self.airtime_transfers.filter(created_on__gte=after, created_on__lt=before)
+
+        return heapq.merge(
+            items(msgs),
+            items(started_runs),
+            (FlowExit(r) for r in items(exited_runs, "exited_on")),
+            items(channel_events),
+            items(campaign_events, "fired"),
+            items(webhook_results),
+            items(calls),
+            items(transfers),
+            self.iter_session_events(after, before, include_event_types, page_size=page_size),
+            key=get_event_time,
+            reverse=True,
         )
 
-        # sort and slice
-        return sorted(items, key=get_event_time, reverse=True)[:limit]
-
-    def get_session_events(self, after: datetime, before: datetime, types: set) -> list:
+    def iter_session_events(self, after: datetime, before: datetime, types: set, page_size: int = 100):
         """
-        Extracts events from this contacts sessions that overlap with the given time window
+        Iterates over events from this contact's sessions that overlap with the given time window, newest first. Events
+        are extracted from session outputs by the database so that we never load whole outputs.
         """
-        sessions = self.sessions.filter(
-            Q(created_on__gte=after, created_on__lt=before) | Q(ended_on__gte=after, ended_on__lt=before)
-        )
-        events = []
-        for session in sessions:
-            for run in session.output.get("runs", []):
-                for event in run.get("events", []):
-                    event["session_uuid"] = str(session.uuid)
-                    event_time = iso8601.parse_date(event["created_on"])
+        if not types:
+            return
+
+        event_time = "(e.event->>'created_on')::timestamptz"
+        sql = f"""
+        SELECT s.uuid, e.event::text, {event_time}, s.id, r.idx, e.idx
+        FROM flows_flowsession s,
+             jsonb_array_elements(s.output::jsonb->'runs') WITH ORDINALITY AS r(run, idx),
+             jsonb_array_elements(r.run->'events') WITH ORDINALITY AS e(event, idx)
+        WHERE s.contact_id = %s
+          AND ((s.created_on >= %s AND s.created_on < %s) OR (s.ended_on >= %s AND s.ended_on < %s))
+          AND e.event->>'type' = ANY(%s) AND {event_time} >= %s AND {event_time} < %s
+          {{keyset}}
+        ORDER BY 3 DESC, 4 DESC, 5 DESC, 6 DESC
+        LIMIT %s
+        """
+        params = [self.id, after, before, after, before, list(types), after, before]
+        last_key = None
+
+        while True:
+            with connection.cursor() as cursor:
+                if last_key:
+                    cursor.execute(
+                        sql.format(keyset=f"AND ({event_time}, s.id, r.idx, e.idx) < (%s, %s, %s, %s)"),
+                        params + list(last_key) + [page_size],
+                    )
+                else:
+                    cursor.execute(sql.format(keyset=""), params + [page_size])
+
+                rows = cursor.fetchall()
+
+            for session_uuid, event, *key in rows:
+                event = json.loads(event)
+                event["session_uuid"] = str(session_uuid)
+                yield event
 
-                    if event["type"] in types and after <= event_time < before:
-                        events.append(event)
+            if len(rows) < page_size:
+                return
 
-        return events
+            last_key = rows[-1][2:]
 
     def get_field_json(self, field):
         """
@@ -872,13 +931,7 @@ class Contact(RequireUpdateFieldsMixin, TembaModel):
         if not json_value:
             return
 
-        engine_type = ContactField.ENGINE_TYPES[field.value_type]
-
-        if field.value_type == ContactField.TYPE_NUMBER:
-            dec_value = json_value.get(engine_type, json_value.get("decimal"))
-            return format_number(Decimal(dec_value)) if dec_value is not None else None
-
-        return json_value.get(engine_type)
+        return ContactField.serialize_json(field.value_type, json_value)
 
     def get_field_value(self, field):
         """
@@ -886,18 +939,11 @@ class Contact(RequireUpdateFieldsMixin, TembaModel):
         for this contact or None.
         """
         if field.field_type == ContactField.FIELD_TYPE_USER:
-            string_value = self.get_field_serialized(field)
-            if string_value is None:
-                return None
-
-            if field.value_type == ContactField.TYPE_TEXT:
-                return string_value
-            elif field.value_type == ContactField.TYPE_DATETIME:
-                return iso8601.parse_date(string_value)
-            elif field.value_type == ContactField.TYPE_NUMBER:
-                return Decimal(string_value)
-            elif field.value_type in [ContactField.TYPE_STATE, ContactField.TYPE_DISTRICT, ContactField.TYPE_WARD]:
-                return AdminBoundary.get_by_path(self.org, string_value)
+            values_cache = getattr(self, "_field_values_cache", None)
+            if values_cache is not None and field.uuid in values_cache:
+                return values_cache[field.uuid]
+
+            return self._decode_field_value(field)
 
         elif field.field_type == ContactField.FIELD_TYPE_SYSTEM:
             if field.key == "created_on":
@@ -914,6 +960,26 @@ class Contact(RequireUpdateFieldsMixin, TembaModel):
         else:  # pragma: no cover
             raise ValueError(f"Unhandled ContactField type '{field.field_type}'.")
 
+    def _decode_field_value(self, field, boundaries=None):
+        """
+        Decodes the value of the given user field, looking up location values in the given mapping of path to boundary
+        if provided
+        """
+        string_value = self.get_field_serialized(field)
+        if string_value is None:
+            return None
+
+        if field.value_type == ContactField.TYPE_TEXT:
+            return string_value
+        elif field.value_type == ContactField.TYPE_DATETIME:
+            return iso8601.parse_date(string_value)
+        elif field.value_type == ContactField.TYPE_NUMBER:
+            return Decimal(string_value)
+        elif field.value_type in ContactField.LOCATION_TYPES:
+            if boundaries is not None:
+                return boundaries.get(string_value)
+            return AdminBoundary.get_by_path(self.org, string_value)
+
     def get_field_display(self, field):
         """
         Returns the display value for the passed in field, or empty string if None
@@ -1177,10 +1243,12 @@ class Contact(RequireUpdateFieldsMixin, TembaModel):
                 broadcast.contacts.remove(self)
 
     @classmethod
-    def bulk_cache_initialize(cls, org, contacts):
+    def bulk_cache_initialize(cls, org, contacts, *, groups: bool = False, fields=()):
         """
-        Performs optimizations on our contacts to prepare them to send. This includes loading all our contact fields for
-        variable substitution.
+        Performs optimizations on our contacts to prepare them to be sent to, displayed or exported. This always loads
+        URNs and the channel of each contact's preferred URN. If groups is set, group memberships are loaded as sets of
+        group ids, and the values of any given fields are decoded. The number of queries doesn't depend on the number of
+        contacts.
         """
         if not contacts:
             return
@@ -1197,11 +1265,53 @@ class Contact(RequireUpdateFieldsMixin, TembaModel):
             contact = contact_map[urn.contact_id]
             getattr(contact, "_urns_cache").append(urn)
 
+        # cache the channels of preferred URNs, which are few so fetched separately rather than joined on every URN
+        preferred_urns = [c._urns_cache[0] for c in contacts if c._urns_cache and c._urns_cache[0].channel_id]
+        if preferred_urns:
+            channels = Channel.objects.in_bulk({u.channel_id for u in preferred_urns})
+            for urn in preferred_urns:
+                urn.channel = channels[urn.channel_id]
+
+        # cache group memberships as sets of group ids
+        if groups:
+            for contact in contacts:
+                setattr(contact, "_group_ids_cache", set())
+
+            memberships = ContactGroup.contacts.through.objects.filter(contact_id__in=contact_map.keys())
+            for contact_id, group_id in memberships.values_list("contact_id", "contactgroup_id"):
+                getattr(contact_map[contact_id], "_group_ids_cache").add(group_id)
+
+        # cache decoded values of user fields, with locations looked up for all contacts at once
+        fields = [f for f in fields if f.field_type == ContactField.FIELD_TYPE_USER]
+        if fields:
+            location_fields = [f for f in fields if f.value_type in ContactField.LOCATION_TYPES]
+            boundaries = {}
+            if location_fields:
+                if org.country_id:
+                    boundaries = AdminBoundary.get_path_index(org)
+                else:
+                    paths = {c.get_field_serialized(f) for c in contacts for f in location_fields} - {None}
+                    boundaries = {b.path: b for b in AdminBoundary.objects.filter(path__in=paths)}
+
+            for contact in contacts:
+                values = {f.uuid: contact._decode_field_value(f, boundaries) for f in fields}
+                setattr(contact, "_field_values_cache", values)
+
         # set the cache initialize as correct
         for contact in contacts:
             contact.org = org
             setattr(contact, "__cache_initialized", True)
 
+    def get_group_ids(self) -> Set[int]:
+        """
+        Gets the ids of all groups this contact belongs to
+        """
+        cache_attr = "_group_ids_cache"
+        if hasattr(self, cache_attr):
+            return getattr(self, cache_attr)
+
+        return set(self.all_groups.values_list("id", flat=True))
+
     def get_urns(self):
         """
         Gets all URNs ordered by priority
@@ -1777,6 +1887,7 @@ class ContactGroupCount(SquashableModel):
     """
 
     SQUASH_OVER = ("group_id",)
+    SQUASH_BATCHED = True
 
     group = models.ForeignKey(ContactGroup, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
@@ -1925,10 +2036,7 @@ class ExportContactsTask(BaseExportTask):
 
         include_group_memberships = bool(self.group_memberships.exists())
 
-        if self.search:
-            contact_ids = elastic.query_contact_ids(self.org, self.search, group=group)
-        else:
-            contact_ids = group.contacts.order_by("name", "id").values_list("id", flat=True)
+        total_contacts, contact_batches = self._get_contact_batches(group)
 
         # create our exporter
         exporter = TableExporter(self, "Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields])
@@ -1936,65 +2044,24 @@ class ExportContactsTask(BaseExportTask):
         total_exported_contacts = 0
         start = time.time()
 
-        # write out contacts in batches to limit memory usage
-        for batch_ids in chunk_list(contact_ids, 1000):
-            # fetch all the contacts for our batch
-            batch_contacts = (
-                Contact.objects.filter(id__in=batch_ids).prefetch_related("all_groups").select_related("org")
-            )
-
-            # to maintain our sort, we need to lookup by id, create a map of our id->contact to aid in that
-            contact_by_id = {c.id: c for c in batch_contacts}
+        # compile our columns once so each batch of contacts can be turned into rows in a single pass
+        plan = ContactExportPlan(self, fields)
+        group_ids = [g["group_id"] for g in group_fields]
 
-            # bulk initialize them
-            Contact.bulk_cache_initialize(self.org, batch_contacts)
+        # write out contacts in batches to limit memory usage
+        for batch_contacts in contact_batches:
+            # bulk initialize them, leaving field values to the plan which only needs their JSON
+            Contact.bulk_cache_initialize(self.org, batch_contacts, groups=include_group_memberships)
 
-            for contact_id in batch_ids:
-                contact = contact_by_id[contact_id]
+            plan.resolve_locations(batch_contacts)
 
-                values = []
+            for contact in batch_contacts:
+                values = plan.get_values(contact)
                 group_values = []
-                for col in range(len(fields)):
-                    field = fields[col]
-
-                    if field["key"] == ContactField.KEY_NAME:
-                        field_value = contact.name
-                    elif field["key"] == Contact.UUID:
-                        field_value = contact.uuid
-                    elif field["key"] == ContactField.KEY_LANGUAGE:
-                        field_value = contact.language
-                    elif field["key"] == ContactField.KEY_CREATED_ON:
-                        field_value = contact.created_on
-                    elif field["key"] == ContactField.KEY_ID:
-                        field_value = str(contact.id)
-                    elif field["urn_scheme"] is not None:
-                        contact_urns = contact.get_urns()
-                        scheme_urns = []
-                        for urn in contact_urns:
-                            if urn.scheme == field["urn_scheme"]:
-                                scheme_urns.append(urn)
-                        position = field["position"]
-                        if len(scheme_urns) > position:
-                            urn_obj = scheme_urns[position]
-                            field_value = urn_obj.get_display(org=self.org, formatted=False) if urn_obj else ""
-                        else:
-                            field_value = ""
-                    else:
-                        field_value = contact.get_field_display(field["field"])
-
-                    if field_value is None:
-                        field_value = ""
-
-                    if field_value:
-                        field_value = self.prepare_value(field_value)
-
-                    values.append(field_value)
 
                 if include_group_memberships:
-                    contact_groups_ids = [g.id for g in contact.all_groups.all()]
-                    for col in range(len(group_fields)):
-                        field = group_fields[col]
-                        group_values.append(field["group_id"] in contact_groups_ids)
+                    contact_groups_ids = contact.get_group_ids()
+                    group_values = [group_id in contact_groups_ids for group_id in group_ids]
 
                 # write this contact's values
                 exporter.write_row(values + group_values)
@@ -2003,15 +2070,15 @@ class ExportContactsTask(BaseExportTask):
                 # output some status information every 10,000 contacts
                 if total_exported_contacts % ExportContactsTask.LOG_PROGRESS_PER_ROWS == 0:
                     elapsed = time.time() - start
-                    predicted = elapsed // (total_exported_contacts / len(contact_ids))
+                    predicted = elapsed // (total_exported_contacts / total_contacts)
 
                     logger.info(
                         "Export of %s contacts - %d%% (%s/%s) complete in %0.2fs (predicted %0.0fs)"
                         % (
                             self.org.name,
-                            total_exported_contacts * 100 // len(contact_ids),
+                            total_exported_contacts * 100 // total_contacts,
                             "{:,}".format(total_exported_contacts),
-                            "{:,}".format(len(contact_ids)),
+                            "{:,}".format(total_contacts),
                             time.time() - start,
                             predicted,
                         )
@@ -2022,6 +2089,169 @@ class ExportContactsTask(BaseExportTask):
 
         return exporter.save_file()
 
+    def _get_contact_batches(self, group):
+        """
+        Gets the total number of contacts to export and an iterator of batches of those contacts
+        """
+        if self.search:
+            total = elastic.count_contacts(self.org, self.search, group=group)
+            id_batches = elastic.iter_contact_id_batches(
+                self.org, self.search, group=group, slices=settings.ELASTICSEARCH_EXPORT_SLICES
+            )
+            return total, self._get_contact_batches_by_ids(id_batches)
+        else:
+            memberships = ContactGroup.contacts.through.objects.filter(contactgroup=group)
+            return memberships.count(), self._get_group_contact_batches(memberships)
+
+    def _get_group_contact_batches(self, memberships):
+        """
+        Pages through the group's memberships by contact id, which unlike name can't change during the export and which
+        memberships are indexed by, so each batch is sorted by name rather than the whole group
+        """
+        for batch in KeysetIterator(memberships, keys=("contact_id",)):
+            yield list(Contact.objects.filter(id__in=[m.contact_id for m in batch]).order_by("name", "id"))
+
+    def _get_contact_batches_by_ids(self, id_batches):
+        for batch_ids in chain.from_iterable(chunk_list(ids, 1000) for ids in id_batches):
+            batch_contacts = Contact.objects.filter(id__in=batch_ids)
+
+            # to maintain our sort, we need to lookup by id, create a map of our id->contact to aid in that
+            contact_by_id = {c.id: c for c in batch_contacts}
+
+            yield [contact_by_id[contact_id] for contact_id in batch_ids]
+
+
+class ContactExportPlan:
+    """
+    The columns of a contacts export compiled into a list of functions, one per column, which each take a contact and
+    its URNs grouped by scheme, and return the prepared value of that column. This avoids re-dispatching on each field
+    for every contact, and location values are resolved for a whole batch of contacts at once.
+    """
+
+    LOCATION_TYPES = ContactField.LOCATION_TYPES
+
+    def __init__(self, export, fields):
+        self.export = export
+        self.org = export.org
+        self.date_format = self.org.get_datetime_formats()[1]
+
+        # the location fields as tuples of field UUID and value key, and the names of the boundaries resolved so far
+        self.location_fields = set()
+        self.location_names = {}
+
+        self.columns = [self._compile(f) for f in fields]
+
+    def _compile(self, field):
+        key, prepare = field["key"], self.export.prepare_value
+
+        if key == ContactField.KEY_NAME:
+            return lambda c, urns: prepare(c.name) if c.name else ""
+        elif key == Contact.UUID:
+            return lambda c, urns: prepare(c.uuid)
+        elif key == ContactField.KEY_LANGUAGE:
+            return lambda c, urns: prepare(c.language) if c.language else ""
+        elif key == ContactField.KEY_CREATED_ON:
+            return lambda c, urns: prepare(c.created_on)
+        elif key == ContactField.KEY_ID:
+            return lambda c, urns: prepare(str(c.id))
+        elif field["urn_scheme"] is not None:
+            return self._compile_urn(field["urn_scheme"], field["position"])
+        else:
+            return self._compile_field(field["field"])
+
+    def _compile_urn(self, scheme, position):
+        def get_value(contact, urns):
+            scheme_urns = urns.get(scheme, ())
+            if len(scheme_urns) > position:
+                display = scheme_urns[position].get_display(org=self.org, formatted=False)
+                return self.export.prepare_value(display) if display else ""
+            return ""
+
+        return get_value
+
+    def _compile_field(self, field):
+        field_uuid = str(field.uuid)
+        value_key = ContactField.ENGINE_TYPES[field.value_type]
+        prepare = self.export.prepare_value
+
+        def get_json_value(contact):
+            value = contact.fields.get(field_uuid) if contact.fields else None
+            return value.get(value_key) if value else None
+
+        if field.value_type == ContactField.TYPE_DATETIME:
+
+            def get_value(contact, urns):
+                value = get_json_value(contact)
+                if value is None:
+                    return ""
+                return prepare(datetime_to_str(iso8601.parse_date(value), self.date_format, self.org.timezone))
+
+        elif field.value_type == ContactField.TYPE_NUMBER:
+
+            def get_value(contact, urns):
+                value = contact.fields.get(field_uuid) if contact.fields else None
+                number = value.get(value_key, value.get("decimal")) if value else None
+                if number is None:
+                    return ""
+                formatted = format_number(Decimal(number))
+                return prepare(formatted) if formatted else ""
+
+        elif field.value_type in self.LOCATION_TYPES:
+            self.location_fields.add((field_uuid, value_key))
+
+            def get_value(contact, urns):
+                path = get_json_value(contact)
+                name = self.location_names.get(path) if path else None
+                return prepare(name) if name else ""
+
+        else:
+
+            def get_value(contact, urns):
+                value = get_json_value(contact)
+                return prepare(value) if value else ""
+
+        return get_value
+
+    def resolve_locations(self, contacts):
+        """
+        Resolves the names of the boundaries referenced by location fields of the given contacts, using the index of
+        the org's country if it has one, and otherwise in a single query
+        """
+        if not self.location_fields:
+            return
+
+        paths = set()
+        for contact in contacts:
+            if contact.fields:
+                for field_uuid, value_key in self.location_fields:
+                    value = contact.fields.get(field_uuid)
+                    if value and value.get(value_key):
+                        paths.add(value[value_key])
+
+        missing = paths - self.location_names.keys()
+        if missing:
+            if self.org.country_id:
+                index = AdminBoundary.get_path_index(self.org)
+                for path in missing & index.keys():
+                    self.location_names[path] = index[path].name
+            else:
+                for path, name in AdminBoundary.objects.filter(path__in=missing).values_list("path", "name"):
+                    self.location_names[path] = name
+
+            # remember paths which don't match any boundary so we don't look them up again
+            for path in missing - self.location_names.keys():
+                self.location_names[path] = None
+
+    def get_values(self, contact):
+        """
+        Gets the values of all columns for the given contact
+        """
+        urns = defaultdict(list)
+        for urn in contact.get_urns():
+            urns[urn.scheme].append(urn)
+
+        return [column(contact, urns) for column in self.columns]
+
 
 def get_import_upload_path(instance: Any, filename: str):
     ext = Path(filename).suffix.lower()
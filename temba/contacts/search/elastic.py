@@ -1,24 +1,125 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
+
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search as es_Search
 
 from django.conf import settings
 
+from temba.utils import chunk_list
+
 from .mailroom import parse_query
 
 ES = Elasticsearch(hosts=[settings.ELASTICSEARCH_URL])
 
 
+# the number of contact ids fetched per page when iterating over search results
+ID_BATCH_SIZE = 10000
+
+# how long sliced scrolls are kept alive between pages, and how many batches each slice can fetch ahead of the consumer
+SLICE_SCROLL = "5m"
+SLICE_PREFETCH = 2
+
+
 def query_contact_ids(org, query, *, group=None):
     """
     Returns the contact ids for the given query
     """
+    return [contact_id for batch in iter_contact_id_batches(org, query, group=group) for contact_id in batch]
+
+
+def count_contacts(org, query, *, group=None) -> int:
+    """
+    Returns the number of contacts matching the given query
+    """
+    return _get_contact_search(org, query, group=group).count()
+
+
+def iter_contact_id_batches(org, query, *, group=None, batch_size=ID_BATCH_SIZE, slices=1):
+    """
+    Iterates over the contact ids for the given query in batches, ordered by id. Each batch is fetched as the page of
+    results after the last id of the previous batch, so memory usage is bounded by the batch size and callers can start
+    using results before the search has completed.
+
+    If slices is more than one, the results are instead fetched by that many sliced scrolls in parallel, and batches
+    are yielded as they arrive so are not ordered by id.
+    """
+    if slices > 1:
+        yield from _iter_sliced_id_batches(_get_contact_search(org, query, group=group), slices, batch_size)
+        return
+
+    search = _get_contact_search(org, query, group=group).sort("id").extra(size=batch_size)
+    last_id = None
+
+    while True:
+        page = search.extra(search_after=[last_id]) if last_id is not None else search
+        batch = [int(r.id) for r in page.execute()]
+
+        if batch:
+            yield batch
+
+        if len(batch) < batch_size:
+            return
+
+        last_id = batch[-1]
+
+
+def _iter_sliced_id_batches(search, num_slices: int, batch_size: int):
+    """
+    Scrolls each slice of the given search in its own thread, passing batches of ids back through a shared queue so
+    that no slice waits on the consumption of another and lets its scroll expire. Threads stop early if we do.
+    """
+    q = Queue(SLICE_PREFETCH * num_slices)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except Full:  # pragma: no cover
+                pass
+        return False
+
+    def scroll_slice(slice_id: int):
+        sliced = search.extra(slice={"id": slice_id, "max": num_slices}).params(size=batch_size, scroll=SLICE_SCROLL)
+
+        try:
+            for batch in chunk_list((int(r.id) for r in sliced.scan()), batch_size):
+                if not put(batch):
+                    return
+
+            put(None)  # signals that this slice is done
+        except Exception as e:
+            put(e)
+
+    executor = ThreadPoolExecutor(max_workers=num_slices)
+    try:
+        for slice_id in range(num_slices):
+            executor.submit(scroll_slice, slice_id)
+
+        remaining = num_slices
+        while remaining:
+            item = q.get()
+            if item is None:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False)
+
+
+def _get_contact_search(org, query, *, group=None):
     parsed = parse_query(org, query, group=group)
-    results = (
+
+    return (
         es_Search(index="contacts").source(include=["id"]).params(routing=org.id).using(ES).query(parsed.elastic_query)
     )
 
-    return [int(r.id) for r in results.scan()]
-
 
 def get_last_modified():
     """
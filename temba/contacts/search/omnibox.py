@@ -96,8 +96,9 @@ def omnibox_mixed_search(org, query, types):
         try:
             search_results = search_contacts(org, query, group=org.cached_active_contacts_group, sort="name")
             contacts = IDSliceQuerySet(Contact, search_results.contact_ids, 0, len(search_results.contact_ids))
-            results += list(contacts[:per_type_limit])
-            Contact.bulk_cache_initialize(org, contacts=results)
+            contacts = list(contacts[:per_type_limit])
+            Contact.bulk_cache_initialize(org, contacts)
+            results += contacts
 
         except SearchException:
             pass
@@ -125,7 +126,10 @@ def omnibox_serialize(org, groups, contacts, json_encode=False):
     """
     Shortcut for proper way to serialize a queryset of groups and contacts for omnibox component
     """
-    serialized = omnibox_results_to_dict(org, list(groups) + list(contacts), version="2")
+    contacts = list(contacts)
+    Contact.bulk_cache_initialize(org, contacts)
+
+    serialized = omnibox_results_to_dict(org, list(groups) + contacts, version="2")
 
     if json_encode:
         return [json.dumps(_) for _ in serialized]
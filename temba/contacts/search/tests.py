@@ -1,5 +1,7 @@
+from unittest.mock import patch
+
 from temba.mailroom import MailroomException
-from temba.tests import TembaTest, mock_mailroom
+from temba.tests import ESMockWithScroll, ESMockWithScrollMultiple, TembaTest, mock_mailroom
 
 from . import SearchException, elastic
 
@@ -107,3 +109,67 @@ class TestElastic(TembaTest):
         with self.assertRaises(SearchException):
             mr_mocks.error("bad field <> error")
             elastic.query_contact_ids(self.org, "bad_field <> error")
+
+    @mock_mailroom
+    def test_iter_contact_id_batches(self, mr_mocks):
+        def hit(contact_id):
+            return {"_type": "_doc", "_index": "dummy_index", "_source": {"id": contact_id}, "sort": [contact_id]}
+
+        mr_mocks.parse_query("name ~ bob", elastic_query={"match": {"name": "bob"}})
+
+        # pages are fetched after the last id of the previous page until we get a page which isn't full
+        with ESMockWithScrollMultiple(data=[[hit(1), hit(2)], [hit(3), hit(4)], []]):
+            batches = list(elastic.iter_contact_id_batches(self.org, "name ~ bob", batch_size=2))
+            bodies = [c[1]["body"] for c in elastic.ES.search.call_args_list]
+
+        self.assertEqual([[1, 2], [3, 4]], batches)
+
+        self.assertEqual(3, len(bodies))
+        self.assertEqual(["id"], bodies[0]["sort"])
+        self.assertNotIn("search_after", bodies[0])
+        self.assertEqual([2], bodies[1]["search_after"])
+        self.assertEqual([4], bodies[2]["search_after"])
+
+        with ESMockWithScroll(data=[hit(5), hit(6), hit(7)]):
+            self.assertEqual([5, 6, 7], elastic.query_contact_ids(self.org, "name ~ bob"))
+            self.assertEqual(3, elastic.count_contacts(self.org, "name ~ bob"))
+
+    @mock_mailroom
+    def test_iter_contact_id_batches_sliced(self, mr_mocks):
+        def response(hits):
+            return {
+                "_shards": {"failed": 0, "successful": 10, "total": 10},
+                "timed_out": False,
+                "took": 1,
+                "_scroll_id": "1",
+                "hits": {"hits": hits},
+            }
+
+        def hit(contact_id):
+            return {"_type": "_doc", "_index": "dummy_index", "_source": {"id": contact_id}}
+
+        # slice 0 gets odd ids and slice 1 gets even ids, with all hits returned by the first page of each scroll
+        slice_ids = {0: [1, 3, 5], 1: [2, 4]}
+
+        def search(body, **kwargs):
+            return response([hit(i) for i in slice_ids[body["slice"]["id"]]])
+
+        mr_mocks.parse_query("name ~ bob", elastic_query={"match": {"name": "bob"}})
+
+        with patch("temba.contacts.search.elastic.ES") as mock_es:
+            mock_es.search.side_effect = search
+            mock_es.scroll.return_value = response([])
+
+            # batches from different slices can arrive in any order but still include every id
+            batches = list(elastic.iter_contact_id_batches(self.org, "name ~ bob", batch_size=2, slices=2))
+            self.assertEqual([1, 2, 3, 4, 5], sorted(i for b in batches for i in b))
+            self.assertEqual([[1, 3], [2, 4], [5]], sorted(batches))
+
+            slices = sorted(c[1]["body"]["slice"]["id"] for c in mock_es.search.call_args_list)
+            self.assertEqual([0, 1], slices)
+
+            # errors in a slice are raised to the consumer
+            mock_es.search.side_effect = ValueError("boom")
+
+            with self.assertRaises(ValueError):
+                list(elastic.iter_contact_id_batches(self.org, "name ~ bob", slices=2))
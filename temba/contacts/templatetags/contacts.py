@@ -77,7 +77,7 @@ MISSING_VALUE = "--"
 
 @register.filter
 def contact_field(contact, arg):
-    field = ContactField.get_by_key(contact.org, arg.lower())
+    field = ContactField.get_by_key_cached(contact.org, arg.lower())
     if field is None:
         return MISSING_VALUE
 
@@ -4,6 +4,7 @@ import time
 import uuid
 from datetime import date, datetime, timedelta
 from decimal import Decimal
+from functools import partial
 from unittest.mock import PropertyMock, call, patch
 
 import iso8601
@@ -25,11 +26,12 @@ from temba.airtime.models import AirtimeTransfer
 from temba.campaigns.models import Campaign, CampaignEvent, EventFire
 from temba.channels.models import Channel, ChannelEvent, ChannelLog
 from temba.contacts.search import SearchException, SearchResults, search_contacts
-from temba.contacts.views import ContactListView
+from temba.contacts.views import HISTORY_INCLUDE_EVENTS, ContactListView
 from temba.flows.models import Flow, FlowStart
 from temba.ivr.models import IVRCall
 from temba.locations.models import AdminBoundary
 from temba.mailroom import MailroomException, modifiers
+from temba.mailroom.events import get_event_time
 from temba.msgs.models import Broadcast, Label, Msg, SystemLabel
 from temba.orgs.models import Org
 from temba.schedules.models import Schedule
@@ -46,10 +48,12 @@ from temba.tests.engine import MockSessionWriter
 from temba.triggers.models import Trigger
 from temba.utils import json
 from temba.utils.dates import datetime_to_str, datetime_to_timestamp
+from temba.utils.models import KeysetIterator
 
 from .models import (
     URN,
     Contact,
+    ContactExportPlan,
     ContactField,
     ContactGroup,
     ContactGroupCount,
@@ -126,6 +130,15 @@ class ContactCRUDLTest(CRUDLTestMixin, TembaTest):
             ],
         )
 
+        # each contact gets its own list of the user groups it belongs to, in the same order
+        unsatisfied.contacts.add(joe)
+        survey_audience.contacts.add(joe)
+
+        response = self.client.get(list_url)
+        frank_row, joe_row = response.context["object_list"]
+        self.assertEqual([], frank_row.list_groups)
+        self.assertEqual(["Survey Audience", "Unsatisfied Customers"], [g["label"] for g in joe_row.list_groups])
+
         mr_mocks.contact_search("age = 18", contacts=[frank], allow_as_group=True)
 
         response = self.client.get(list_url + "?search=age+%3D+18")
@@ -1675,6 +1688,33 @@ class ContactTest(TembaTest):
             self.assertIsNone(self.frank.get_field_value(nick))
             self.assertIsNone(self.billy.get_field_value(nick))
 
+        # give joe's preferred URN a channel and put him and frank in a group
+        joe_twitter = self.joe.get_urn(URN.TWITTER_SCHEME)
+        joe_twitter.channel = self.channel
+        joe_twitter.save(update_fields=("channel",))
+        group = self.create_group("Testers", [self.joe, self.frank])
+
+        all = [Contact.objects.get(id=c.id) for c in (self.joe, self.frank, self.billy)]
+
+        # URNs, channels, group memberships and field values are loaded with a fixed number of queries
+        with self.assertNumQueries(3):
+            Contact.bulk_cache_initialize(self.org, all, groups=True, fields=[age, nick])
+
+        joe, frank, billy = all
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.channel, joe.get_urn().channel)
+            self.assertIn(group.id, joe.get_group_ids())
+            self.assertIn(group.id, frank.get_group_ids())
+            self.assertNotIn(group.id, billy.get_group_ids())
+            self.assertEqual(Decimal(32), joe.get_field_value(age))
+            self.assertEqual("Joey", joe.get_field_value(nick))
+            self.assertIsNone(frank.get_field_value(age))
+            self.assertEqual("32", joe.get_field_display(age))
+
+        # without a cache, group ids are fetched
+        self.assertEqual(self.joe.get_group_ids(), joe.get_group_ids())
+
     @mock_mailroom
     def test_omnibox(self, mr_mocks):
         # add a group with members and an empty group
@@ -2037,13 +2077,27 @@ class ContactTest(TembaTest):
 
         # fetch our contact history
         self.login(self.admin)
-        with self.assertNumQueries(49):
+        with self.assertNumQueries(50):
             response = self.client.get(url + "?limit=100")
 
         # history should include all messages in the last 90 days, the channel event, the call, and the flow run
         history = response.context["events"]
         self.assertEqual(95, len(history))
 
+        # iterating over all history in small pages gives the same items in the same order as fetching it in one go
+        def history_keys(items):
+            return [(type(i).__name__, get_event_time(i)) for i in items]
+
+        history_after, history_before = self.joe.created_on - timedelta(hours=1), timezone.now()
+        self.assertEqual(
+            history_keys(self.joe.get_history(history_after, history_before, HISTORY_INCLUDE_EVENTS, 1000)),
+            history_keys(self.joe.iter_history(history_after, history_before, HISTORY_INCLUDE_EVENTS, page_size=3)),
+        )
+
+        # and taking the first few items only fetches the first page of each type
+        with self.assertNumQueries(10):
+            self.assertEqual(3, len(self.joe.get_history(history_after, history_before, HISTORY_INCLUDE_EVENTS, 3)))
+
         def assertHistoryEvent(item, expected_type, msg_text=None):
             self.assertEqual(expected_type, item["type"])
             self.assertTrue(iso8601.parse_date(item["created_on"]))
@@ -2200,6 +2254,37 @@ class ContactTest(TembaTest):
         response = self.client.get(reverse("contacts.contact_history", args=[self.other_org_contact.uuid]))
         self.assertLoginRedirect(response)
 
+    def test_history_paging(self):
+        ann = self.create_contact("Ann", phone="+250788000001")
+        url = reverse("contacts.contact_history", args=[ann.uuid])
+
+        # several items at exactly the same time which will be split across pages
+        same_time = timezone.now() - timedelta(minutes=5)
+        for i in range(5):
+            self.create_incoming_msg(ann, f"Message {i}", created_on=same_time)
+
+        def fetch_page(before, skip=0):
+            response = self.fetch_protected(url + f"?limit=2&before={before}&skip={skip}", self.admin)
+            return [e["msg"]["text"] for e in response.context["events"]], response.context
+
+        texts, context = fetch_page(datetime_to_timestamp(timezone.now()))
+        self.assertEqual(["Message 4", "Message 3"], texts)
+        self.assertEqual(datetime_to_timestamp(same_time), context["next_before"])
+        self.assertEqual(2, context["next_skip"])
+        self.assertTrue(context["has_older"])
+
+        texts, context = fetch_page(context["next_before"], context["next_skip"])
+        self.assertEqual(["Message 2", "Message 1"], texts)
+        self.assertEqual(datetime_to_timestamp(same_time), context["next_before"])
+        self.assertEqual(4, context["next_skip"])
+        self.assertTrue(context["has_older"])
+
+        # last page has the remaining item, and there's nothing older
+        texts, context = fetch_page(context["next_before"], context["next_skip"])
+        self.assertEqual(["Message 0"], texts)
+        self.assertEqual(0, context["next_skip"])
+        self.assertFalse(context["has_older"])
+
     def test_history_session_events(self):
         flow = self.get_flow("color_v13")
         nodes = flow.get_definition()["nodes"]
@@ -4091,6 +4176,99 @@ class ContactFieldTest(TembaTest):
             )
             assertImportExportedFile()
 
+    def test_contact_export_batches(self):
+        bob = self.create_contact("Bob", phone="+250788000001")
+        ann = self.create_contact("Ann", phone="+250788000002")
+        cat = self.create_contact("Cat", phone="+250788000003")
+        group = self.create_group("Export", [bob, ann, cat])
+
+        export = ExportContactsTask.create(self.org, self.admin, group=group)
+
+        with patch("temba.contacts.models.KeysetIterator", partial(KeysetIterator, batch_size=2)):
+            total, batches = export._get_contact_batches(group)
+            self.assertEqual(3, total)
+
+            # contacts are paged by id and sorted by name within each batch
+            self.assertEqual([ann, bob], next(batches))
+
+            # so a contact renamed during the export is still exported once
+            cat.name = "Aaron"
+            cat.save(update_fields=("name",))
+
+            self.assertEqual([[cat]], list(batches))
+
+    def test_contact_export_plan(self):
+        self.setUpLocations()
+
+        state = ContactField.get_or_create(self.org, self.admin, "state", "State", value_type=ContactField.TYPE_STATE)
+        district = ContactField.get_or_create(
+            self.org, self.admin, "district", "District", value_type=ContactField.TYPE_DISTRICT
+        )
+        age = ContactField.get_or_create(self.org, self.admin, "age", "Age", value_type=ContactField.TYPE_NUMBER)
+        joined = ContactField.get_or_create(
+            self.org, self.admin, "joined", "Joined", value_type=ContactField.TYPE_DATETIME
+        )
+        nickname = ContactField.get_or_create(self.org, self.admin, "nickname", "Nickname")
+
+        contact1 = self.create_contact("Ann", urns=["tel:+250788000001", "twitter:ann", "tel:+250788000002"])
+        contact1.fields = {
+            str(state.uuid): {"text": "Kigali City", "state": self.state1.path},
+            str(district.uuid): {"text": "Gatsibo", "district": self.district1.path},
+            str(age.uuid): {"text": "17.0", "number": "17.0"},
+            str(joined.uuid): {"text": "2015-12-20", "datetime": "2015-12-20T08:30:00.000000+02:00"},
+            str(nickname.uuid): {"text": "=Annie"},
+        }
+        contact2 = self.create_contact("", phone="+250788000003")
+        contact2.fields = {str(state.uuid): {"text": "Nowhere", "state": "Rwanda > Nowhere"}}
+
+        export = ExportContactsTask.create(self.org, self.admin)
+        fields = [
+            dict(key=ContactField.KEY_NAME, urn_scheme=None),
+            dict(key=None, urn_scheme="tel", position=0),
+            dict(key=None, urn_scheme="tel", position=1),
+            dict(key=None, urn_scheme="twitter", position=0),
+        ] + [dict(key=f.key, urn_scheme=None, field=f) for f in (state, district, age, joined, nickname)]
+
+        plan = ContactExportPlan(export, fields)
+        contacts = [contact1, contact2]
+        Contact.bulk_cache_initialize(self.org, contacts)
+
+        # locations are resolved from the index of the org's country, which is loaded on first use
+        with self.assertNumQueries(2):
+            plan.resolve_locations(contacts)
+
+        # and not looked up again for later batches
+        with self.assertNumQueries(0):
+            plan.resolve_locations(contacts)
+
+        tel1, tel2 = [u for u in contact1.get_urns() if u.scheme == "tel"]
+        twitter = [u for u in contact1.get_urns() if u.scheme == "twitter"][0]
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [
+                    "Ann",
+                    tel1.get_display(org=self.org, formatted=False),
+                    tel2.get_display(org=self.org, formatted=False),
+                    twitter.get_display(org=self.org, formatted=False),
+                    "Kigali City",
+                    "Gatsibo",
+                    "17",
+                    self.org.format_datetime(contact1.get_field_value(joined)),
+                    "'=Annie",
+                ],
+                plan.get_values(contact1),
+            )
+            self.assertEqual(
+                ["", contact2.get_urns()[0].get_display(org=self.org, formatted=False), "", "", "", "", "", "", ""],
+                plan.get_values(contact2),
+            )
+
+        # values match what we'd get from the contact one field at a time
+        values = plan.get_values(contact1)
+        for i, field in enumerate((state, district, age, joined), start=4):
+            self.assertEqual(contact1.get_field_display(field), values[i])
+
     def test_prepare_sort_field_struct(self):
         ward = ContactField.get_or_create(self.org, self.admin, "ward", "Home Ward", value_type=ContactField.TYPE_WARD)
         district = ContactField.get_or_create(
@@ -3,7 +3,6 @@ from collections import OrderedDict
 from datetime import timedelta
 from typing import Dict, List
 
-import iso8601
 from smartmin.views import (
     SmartCreateView,
     SmartCRUDL,
@@ -37,9 +36,9 @@ from temba.archives.models import Archive
 from temba.channels.models import Channel
 from temba.contacts.templatetags.contacts import MISSING_VALUE
 from temba.flows.models import Flow, FlowStart
-from temba.mailroom.events import Event
+from temba.mailroom.events import Event, get_event_time
 from temba.msgs.views import SendMessageForm
-from temba.orgs.models import Org
+from temba.orgs.models import Org, OrgCache
 from temba.orgs.views import ModalMixin, OrgObjPermsMixin, OrgPermsMixin
 from temba.tickets.models import Ticket
 from temba.utils import analytics, json, languages, on_transaction_commit
@@ -306,11 +305,7 @@ class ContactListView(OrgPermsMixin, BulkActionMixin, SmartListView):
                 return Contact.objects.none()
         else:
             # if user search is not defined, use DB to select contacts
-            qs = (
-                group.contacts.filter(org=self.request.user.get_org())
-                .order_by("-id")
-                .prefetch_related("org", "all_groups")
-            )
+            qs = group.contacts.filter(org=self.request.user.get_org()).order_by("-id")
             patch_queryset_count(qs, group.get_member_count)
             return qs
 
@@ -332,12 +327,22 @@ class ContactListView(OrgPermsMixin, BulkActionMixin, SmartListView):
             ),
         ]
 
-        # resolve the paginated object list so we can initialize a cache of URNs and fields
+        # resolve the paginated object list so we can initialize a cache of URNs, groups and fields
         contacts = context["object_list"]
-        Contact.bulk_cache_initialize(org, contacts)
+        contact_fields = self.get_contact_fields(org)
+        Contact.bulk_cache_initialize(org, contacts, groups=True, fields=contact_fields)
+
+        groups = self.get_user_groups(org)
+
+        # give each contact its own list of user groups (in the same order) so the template doesn't check every group
+        group_positions = {g["pk"]: i for i, g in enumerate(groups)}
+        for contact in contacts:
+            positions = sorted(group_positions[g_id] for g_id in contact.get_group_ids() if g_id in group_positions)
+            contact.list_groups = [groups[p] for p in positions]
 
         context["contacts"] = contacts
-        context["groups"] = self.get_user_groups(org)
+        context["contact_fields"] = contact_fields
+        context["groups"] = groups
         context["folders"] = folders
         context["has_contacts"] = contacts or org.has_contacts()
         context["search_error"] = self.search_error
@@ -354,6 +359,12 @@ class ContactListView(OrgPermsMixin, BulkActionMixin, SmartListView):
 
         return context
 
+    def get_contact_fields(self, org):
+        """
+        Gets the contact fields which are shown as columns
+        """
+        return ()
+
     def get_user_groups(self, org):
         groups = ContactGroup.get_user_groups(org, ready_only=False).select_related("org").order_by(Upper("name"))
         group_counts = ContactGroupCount.get_totals(groups)
@@ -715,6 +726,14 @@ class ContactCRUDL(SmartCRUDL):
                 contact.tickets.filter(status=Ticket.STATUS_OPEN).select_related("ticketer").order_by("-opened_on")
             )
 
+            # load our contact's URNs and field values
+            fields = list(
+                ContactField.user_fields.active_for_org(org=contact.org).order_by(
+                    "-show_in_table", "-priority", "label", "pk"
+                )
+            )
+            Contact.bulk_cache_initialize(contact.org, [contact], fields=fields)
+
             # divide contact's URNs into those we can send to, and those we can't
             sendable_schemes = contact.org.get_schemes(Channel.ROLE_SEND)
 
@@ -729,15 +748,8 @@ class ContactCRUDL(SmartCRUDL):
             context["contact_urns"] = urns
             context["has_sendable_urn"] = has_sendable_urn
 
-            # load our contacts values
-            Contact.bulk_cache_initialize(contact.org, [contact])
-
             # lookup all of our contact fields
             all_contact_fields = []
-            fields = ContactField.user_fields.active_for_org(org=contact.org).order_by(
-                "-show_in_table", "-priority", "label", "pk"
-            )
-
             for field in fields:
                 value = contact.get_field_value(field)
 
@@ -889,6 +901,10 @@ class ContactCRUDL(SmartCRUDL):
             after = int(self.request.GET.get("after", 0))
             limit = int(self.request.GET.get("limit", 50))
 
+            # together with before, this is a keyset cursor as it's the number of items at exactly that time which were
+            # on the previous page, and which we skip so those which weren't are neither lost nor repeated
+            skip = int(self.request.GET.get("skip", 0))
+
             # if we want an expanding window, or just all the recent activity
             recent_only = False
             if not before:
@@ -904,28 +920,48 @@ class ContactCRUDL(SmartCRUDL):
 
             # keep looking further back until we get at least 20 items
             history = []
-            fetch_before = before
+            fetch_before = before + timedelta(microseconds=1) if skip else before
             while True:
-                history += contact.get_history(after, fetch_before, HISTORY_INCLUDE_EVENTS, limit)
-                if recent_only or len(history) >= 20 or after == contact_creation:
+                history += contact.get_history(after, fetch_before, HISTORY_INCLUDE_EVENTS, limit + skip)
+                if recent_only or len(history) - skip >= 20 or after == contact_creation:
                     break
                 else:
                     fetch_before = after
                     after = max(after - timedelta(days=90), contact_creation)
 
+            # items at exactly the before time come first, so the ones already shown are the first of those
+            history = history[skip:]
+
             # render as events
             events = [Event.from_history_item(contact.org, self.request.user, i) for i in history]
 
+            next_skip = 0
             if len(events) >= limit:
-                after = iso8601.parse_date(events[-1]["created_on"])
+                after = get_event_time(history[-1])
+
+                # the next page starts with any other items at the time of our last item
+                for item in reversed(history):
+                    if get_event_time(item) != after:
+                        break
+                    next_skip += 1
+
+                if next_skip == len(history) and after == before:
+                    next_skip += skip
 
             # check if there are more pages to fetch
             context["has_older"] = False
             if not recent_only and before > contact.created_on:
-                context["has_older"] = bool(contact.get_history(contact_creation, after, HISTORY_INCLUDE_EVENTS, 1))
+                older = contact.get_history(
+                    contact_creation,
+                    after + timedelta(microseconds=1) if next_skip else after,
+                    HISTORY_INCLUDE_EVENTS,
+                    next_skip + 1,
+                )
+                context["has_older"] = len(older) > next_skip
 
             context["recent_only"] = recent_only
             context["next_before"] = datetime_to_timestamp(after)
+            context["next_skip"] = next_skip
             context["next_after"] = datetime_to_timestamp(max(after - timedelta(days=90), contact_creation))
             context["start_date"] = contact.org.get_delete_date(archive_type=Archive.TYPE_MSG)
             context["events"] = events
@@ -936,6 +972,7 @@ class ContactCRUDL(SmartCRUDL):
                 "has_older": context["has_older"],
                 "recent_only": context["recent_only"],
                 "next_before": context["next_before"],
+                "next_skip": context["next_skip"],
                 "next_after": context["next_after"],
                 "start_date": context["start_date"],
                 "events": context["events"],
@@ -1036,14 +1073,8 @@ class ContactCRUDL(SmartCRUDL):
                 )
             return links
 
-        def get_context_data(self, *args, **kwargs):
-            context = super().get_context_data(*args, **kwargs)
-            org = self.request.user.get_org()
-
-            context["contact_fields"] = ContactField.user_fields.active_for_org(org=org).order_by(
-                "-show_in_table", "-priority", "pk"
-            )[0:6]
-            return context
+        def get_contact_fields(self, org):
+            return ContactField.user_fields.active_for_org(org=org).order_by("-show_in_table", "-priority", "pk")[0:6]
 
     class Blocked(ContactListView):
         title = _("Blocked Contacts")
@@ -1145,13 +1176,12 @@ class ContactCRUDL(SmartCRUDL):
         def get_context_data(self, *args, **kwargs):
             context = super().get_context_data(*args, **kwargs)
 
-            group = self.derive_group()
-            org = self.request.user.get_org()
-
-            context["current_group"] = group
-            context["contact_fields"] = ContactField.user_fields.active_for_org(org=org).order_by("-priority", "pk")
+            context["current_group"] = self.derive_group()
             return context
 
+        def get_contact_fields(self, org):
+            return ContactField.user_fields.active_for_org(org=org).order_by("-priority", "pk")
+
         @classmethod
         def derive_url_pattern(cls, path, action):
             return r"^%s/%s/(?P<group>[^/]+)/$" % (path, action)
@@ -1780,6 +1810,8 @@ class ContactFieldCRUDL(SmartCRUDL):
                             priority=priority
                         )
 
+                OrgCache.fields.local.invalidate(self.request.user.get_org().id)
+
                 return HttpResponse('{"status":"OK"}', status=200, content_type="application/json")
 
             except Exception as e:
@@ -1,7 +1,6 @@
 import logging
 import time
-from array import array
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from datetime import timedelta
 from typing import Dict
 
@@ -34,15 +33,18 @@ from temba.orgs.models import Org
 from temba.templates.models import Template
 from temba.tickets.models import Ticketer
 from temba.utils import analytics, chunk_list, json, on_transaction_commit
-from temba.utils.export import BaseExportAssetStore, BaseExportTask
+from temba.utils.cache import get_cacheable_many
+from temba.utils.export import STREAMING_EXPORTERS, BaseExportAssetStore, BaseExportTask, ExportCheckpoints
 from temba.utils.models import (
     JSONAsTextField,
     JSONField,
+    KeysetIterator,
     RequireUpdateFieldsMixin,
     SquashableModel,
     TembaModel,
     generate_uuid,
 )
+from temba.utils.s3 import select_in
 from temba.utils.uuid import uuid4
 
 from . import legacy
@@ -68,6 +70,9 @@ class FlowVersionConflictException(FlowException):
 FLOW_LOCK_TTL = 60  # 1 minute
 FLOW_LOCK_KEY = "org:%d:lock:flow:%d:definition"
 
+FLOW_RUN_STATS_TTL = 30  # 30 seconds
+FLOW_RUN_STATS_KEY = "flow:%d:run_stats"
+
 
 class Flow(TembaModel):
     CONTACT_CREATION = "contact_creation"
@@ -656,7 +661,25 @@ class Flow(TembaModel):
         self.save_revision(user, definition)
 
     def get_run_stats(self):
-        totals_by_exit = FlowRunCount.get_totals(self)
+        return self._get_run_stats(FlowRunCount.get_totals(self))
+
+    @classmethod
+    def get_run_stats_many(cls, flows) -> dict:
+        """
+        Gets the run stats of all the given flows, keyed by flow. Totals for flows which aren't cached are fetched in a
+        single query, and stats are cached for FLOW_RUN_STATS_TTL seconds so may be slightly out of date.
+        """
+        flows_by_key = {FLOW_RUN_STATS_KEY % f.id: f for f in flows}
+
+        def calculate(keys):
+            totals = FlowRunCount.get_totals_many([flows_by_key[k] for k in keys])
+            return {k: (cls._get_run_stats(totals[flows_by_key[k]]), FLOW_RUN_STATS_TTL) for k in keys}
+
+        stats = get_cacheable_many(list(flows_by_key.keys()), calculate)
+        return {flows_by_key[k]: v for k, v in stats.items()}
+
+    @staticmethod
+    def _get_run_stats(totals_by_exit: dict) -> dict:
         total_runs = sum(totals_by_exit.values())
         completed = totals_by_exit.get(FlowRun.EXIT_TYPE_COMPLETED, 0)
 
@@ -1638,6 +1661,8 @@ class FlowNodeCount(SquashableModel):
     """
 
     SQUASH_OVER = ("node_uuid",)
+    SQUASH_CARRY = ("flow_id",)
+    SQUASH_BATCHED = True
 
     flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="node_counts")
 
@@ -1674,6 +1699,7 @@ class FlowRunCount(SquashableModel):
     """
 
     SQUASH_OVER = ("flow_id", "exit_type")
+    SQUASH_BATCHED = True
 
     flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="exit_counts")
 
@@ -1717,6 +1743,20 @@ class FlowRunCount(SquashableModel):
         totals = list(cls.objects.filter(flow=flow).values_list("exit_type").annotate(replies=Sum("count")))
         return {t[0]: t[1] for t in totals}
 
+    @classmethod
+    def get_totals_many(cls, flows):
+        """
+        Gets the totals by exit type of all the given flows in a single query, keyed by flow
+        """
+        totals = cls.objects.filter(flow__in=flows).values_list("flow_id", "exit_type").annotate(replies=Sum("count"))
+
+        totals_by_flow = {f: {} for f in flows}
+        flows_by_id = {f.id: f for f in flows}
+        for flow_id, exit_type, count in totals:
+            totals_by_flow[flows_by_id[flow_id]][exit_type] = count
+
+        return totals_by_flow
+
     def __str__(self):  # pragma: needs cover
         return "RunCount[%d:%s:%d]" % (self.flow_id, self.exit_type, self.count)
 
@@ -1724,6 +1764,57 @@ class FlowRunCount(SquashableModel):
         index_together = ("flow", "exit_type")
 
 
+class ExportContactCache:
+    """
+    LRU cache of the contacts of a results export. Contacts with runs in many batches are loaded once rather than for
+    each batch, and no more than the maximum number are kept in memory.
+    """
+
+    def __init__(self, org, max_size: int, *, groups: bool, fields):
+        self.org = org
+        self.max_size = max_size
+        self.groups = groups
+        self.fields = fields
+        self.hits = 0
+        self.misses = 0
+
+        self._contacts = OrderedDict()
+
+    def get_many(self, uuids) -> Dict[str, Contact]:
+        """
+        Gets the contacts with the given UUIDs, loading those which aren't cached in bulk
+        """
+        found, missing = {}, []
+        for uuid in uuids:
+            contact = self._contacts.get(uuid)
+            if contact:
+                self._contacts.move_to_end(uuid)
+                found[uuid] = contact
+            else:
+                missing.append(uuid)
+
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if missing:
+            contacts = list(Contact.objects.filter(org=self.org, uuid__in=missing))
+            Contact.bulk_cache_initialize(self.org, contacts, groups=self.groups, fields=self.fields)
+
+            for contact in contacts:
+                found[str(contact.uuid)] = contact
+                self._contacts[str(contact.uuid)] = contact
+
+            while len(self._contacts) > self.max_size:
+                self._contacts.popitem(last=False)
+
+        return found
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
 class ExportFlowResultsTask(BaseExportTask):
     """
     Container for managing our export requests
@@ -1739,22 +1830,38 @@ class ExportFlowResultsTask(BaseExportTask):
     RESPONDED_ONLY = "responded_only"
     EXTRA_URNS = "extra_urns"
     FLOWS = "flows"
+    EXPORT_FORMAT = "export_format"
 
     MAX_GROUP_MEMBERSHIPS_COLS = 25
     MAX_CONTACT_FIELDS_COLS = 10
 
+    # the maximum number of contacts kept in memory across batches of runs
+    CONTACT_CACHE_SIZE = 10000
+
     flows = models.ManyToManyField(Flow, related_name="exports", help_text=_("The flows to export"))
 
     config = JSONAsTextField(null=True, default=dict, help_text=_("Any configuration options for this flow export"))
 
     @classmethod
-    def create(cls, org, user, flows, contact_fields, responded_only, include_msgs, extra_urns, group_memberships):
+    def create(
+        cls,
+        org,
+        user,
+        flows,
+        contact_fields,
+        responded_only,
+        include_msgs,
+        extra_urns,
+        group_memberships,
+        export_format=BaseExportTask.FORMAT_XLSX,
+    ):
         config = {
             ExportFlowResultsTask.INCLUDE_MSGS: include_msgs,
             ExportFlowResultsTask.CONTACT_FIELDS: [c.id for c in contact_fields],
             ExportFlowResultsTask.RESPONDED_ONLY: responded_only,
             ExportFlowResultsTask.EXTRA_URNS: extra_urns,
             ExportFlowResultsTask.GROUP_MEMBERSHIPS: [g.id for g in group_memberships],
+            ExportFlowResultsTask.EXPORT_FORMAT: export_format,
         }
 
         export = cls.objects.create(org=org, created_by=user, modified_by=user, config=config)
@@ -1827,11 +1934,14 @@ class ExportFlowResultsTask(BaseExportTask):
         contact_field_ids = config.get(ExportFlowResultsTask.CONTACT_FIELDS, [])
         extra_urns = config.get(ExportFlowResultsTask.EXTRA_URNS, [])
         group_memberships = config.get(ExportFlowResultsTask.GROUP_MEMBERSHIPS, [])
+        export_format = config.get(ExportFlowResultsTask.EXPORT_FORMAT, ExportFlowResultsTask.FORMAT_XLSX)
 
-        contact_fields = ContactField.user_fields.active_for_org(org=self.org).filter(id__in=contact_field_ids)
+        contact_fields = list(ContactField.user_fields.active_for_org(org=self.org).filter(id__in=contact_field_ids))
 
-        groups = ContactGroup.user_groups.filter(
-            org=self.org, id__in=group_memberships, status=ContactGroup.STATUS_READY, is_active=True
+        groups = list(
+            ContactGroup.user_groups.filter(
+                org=self.org, id__in=group_memberships, status=ContactGroup.STATUS_READY, is_active=True
+            )
         )
 
         # get all result saving nodes across all flows being exported
@@ -1859,38 +1969,63 @@ class ExportFlowResultsTask(BaseExportTask):
             extra_urn_columns, groups, contact_fields, result_fields, show_submitted_by=show_submitted_by
         )
 
-        book = XLSXBook()
-        book.num_runs_sheets = 0
-        book.num_msgs_sheets = 0
+        book, exporter, checkpoints = None, None, None
+
+        if export_format == ExportFlowResultsTask.FORMAT_XLSX:
+            book = XLSXBook()
+            book.num_runs_sheets = 0
+            book.num_msgs_sheets = 0
 
-        # the current sheets
-        book.current_runs_sheet = self._add_runs_sheet(book, runs_columns)
-        book.current_msgs_sheet = None
+            # the current sheets
+            book.current_runs_sheet = self._add_runs_sheet(book, runs_columns)
+            book.current_msgs_sheet = None
+        else:
+            # streaming formats are a single table of runs written straight to disk, so messages aren't included, and
+            # save checkpoints as they go so that if this export is interrupted it can resume from the last one
+            checkpoints = ExportCheckpoints(self)
+            exporter = STREAMING_EXPORTERS[export_format](self, runs_columns, header=checkpoints.cursor is None)
+
+            if checkpoints.cursor:
+                logger.info(
+                    f"Results export #{self.id} for org #{self.org.id}: resuming after {checkpoints.num_rows} rows"
+                )
+
+        # contacts often have runs in many batches so are cached across batches rather than loaded for each one
+        contact_cache = ExportContactCache(
+            self.org, self.CONTACT_CACHE_SIZE, groups=bool(groups), fields=contact_fields
+        )
 
         # for tracking performance
         total_runs_exported = 0
         temp_runs_exported = 0
         start = time.time()
 
-        for batch in self._get_run_batches(flows, responded_only):
-            self._write_runs(
-                book,
-                batch,
-                include_msgs,
-                extra_urn_columns,
-                groups,
-                contact_fields,
-                show_submitted_by,
-                runs_columns,
-                result_fields,
-            )
+        cursor = checkpoints.cursor if checkpoints else None
+
+        for batch, batch_cursor in self._get_run_batches(flows, responded_only, cursor):
+            contacts_by_uuid = contact_cache.get_many({r["contact"]["uuid"] for r in batch})
+
+            for run in batch:
+                contact = contacts_by_uuid.get(run["contact"]["uuid"])
+                row = self._get_run_row(
+                    run, contact, extra_urn_columns, groups, contact_fields, show_submitted_by, result_fields
+                )
+
+                if book:
+                    self._write_run(book, run, contact, row, runs_columns, include_msgs)
+                else:
+                    exporter.write_row(row)
+
+            if checkpoints and checkpoints.is_due(exporter):
+                checkpoints.save(exporter, batch_cursor)
 
             total_runs_exported += len(batch)
 
             if (total_runs_exported - temp_runs_exported) > ExportFlowResultsTask.LOG_PROGRESS_PER_ROWS:
                 mins = (time.time() - start) / 60
                 logger.info(
-                    f"Results export #{self.id} for org #{self.org.id}: exported {total_runs_exported} in {mins:.1f} mins"
+                    f"Results export #{self.id} for org #{self.org.id}: exported {total_runs_exported} in {mins:.1f} mins "
+                    f"(contact cache hit ratio {contact_cache.hit_ratio:.2f})"
                 )
 
                 temp_runs_exported = total_runs_exported
@@ -1898,12 +2033,36 @@ class ExportFlowResultsTask(BaseExportTask):
                 self.modified_on = timezone.now()
                 self.save(update_fields=["modified_on"])
 
+        if exporter:
+            return checkpoints.assemble(exporter)
+
         temp = NamedTemporaryFile(delete=True)
         book.finalize(to_file=temp)
         temp.flush()
         return temp, "xlsx"
 
-    def _get_run_batches(self, flows, responded_only):
+    def _get_run_batches(self, flows, responded_only, cursor=None):
+        """
+        Generates batches of runs in archive format, each with a cursor from which the export can be resumed after
+        that batch. The cursor records how many archived records have been read, the id of the last run that existed
+        when the export started, and once we're exporting runs from the database, the id of the last run exported.
+        """
+        runs = FlowRun.objects.filter(flow__in=flows)
+        if responded_only:
+            runs = runs.filter(responded=True)
+
+        # runs are paged by id rather than modified_on which changes as runs are updated, and those created after the
+        # export started are excluded, so a run is never exported twice however long the export takes
+        if not cursor:
+            cursor = {"archived": 0, "max_id": runs.aggregate(Max("id"))["id__max"] or 0, "after": None}
+
+        num_archived = cursor["archived"]
+        max_id = cursor["max_id"]
+        after = (cursor["after"],) if cursor["after"] else None
+
+        def make_cursor():
+            return {"archived": num_archived, "max_id": max_id, "after": after[0] if after else None}
+
         logger.info(f"Results export #{self.id} for org #{self.org.id}: fetching runs from archives to export...")
 
         # firstly get runs from archives
@@ -1915,121 +2074,117 @@ class ExportFlowResultsTask(BaseExportTask):
             if earliest_created_on is None or flow.created_on < earliest_created_on:
                 earliest_created_on = flow.created_on
 
-        records = Archive.iter_all_records(self.org, Archive.TYPE_FLOWRUN, after=earliest_created_on)
-        flow_uuids = {str(flow.uuid) for flow in flows}
+        # filter by flow and responded in S3 Select so only matching runs are downloaded
+        expression = select_in("s.flow.uuid", sorted(str(flow.uuid) for flow in flows))
+        if responded_only:
+            expression += " AND s.responded = TRUE"
+
+        records = Archive.iter_all_records(
+            self.org, Archive.TYPE_FLOWRUN, after=earliest_created_on, expression=expression
+        )
         seen = set()
 
+        # archives are read even when resuming an export, as we need the ids of all archived runs to skip them in the
+        # database, but records that were exported before this export was interrupted aren't exported again
+        num_to_skip = num_archived
+
         for record_batch in chunk_list(records, 1000):
-            matching = []
-            for record in record_batch:
-                if record["flow"]["uuid"] in flow_uuids and (not responded_only or record["responded"]):
-                    seen.add(record["id"])
-                    matching.append(record)
+            seen.update(record["id"] for record in record_batch)
+
+            if num_to_skip:
+                record_batch, num_to_skip = record_batch[num_to_skip:], max(num_to_skip - len(record_batch), 0)
+                if not record_batch:
+                    continue
+
+            num_archived += len(record_batch)
 
-            yield matching
+            yield record_batch, make_cursor()
 
         # secondly get runs from database
-        runs = FlowRun.objects.filter(flow__in=flows).order_by("modified_on")
-        if responded_only:
-            runs = runs.filter(responded=True)
-        run_ids = array(str("l"), runs.values_list("id", flat=True))
+        runs = runs.filter(id__lte=max_id)
 
         logger.info(
-            f"Results export #{self.id} for org #{self.org.id}: found {len(run_ids)} runs in database to export"
+            f"Results export #{self.id} for org #{self.org.id}: found {runs.count()} runs in database to export"
         )
 
-        for id_batch in chunk_list(run_ids, 1000):
-            run_batch = (
-                FlowRun.objects.filter(id__in=id_batch).select_related("contact", "flow").order_by("modified_on", "pk")
-            )
+        run_batches = KeysetIterator(runs, keys=("id",), after=after, select_related=("contact", "flow"))
+        for run_batch in run_batches:
+            after = run_batches.last_key
 
             # convert this batch of runs to same format as records in our archives
-            yield [run.as_archive_json() for run in run_batch if run.id not in seen]
+            yield [run.as_archive_json() for run in run_batch if run.id not in seen], make_cursor()
 
-    def _write_runs(
-        self,
-        book,
-        runs,
-        include_msgs,
-        extra_urn_columns,
-        groups,
-        contact_fields,
-        show_submitted_by,
-        runs_columns,
-        result_fields,
-    ):
+    def _get_run_row(self, run, contact, extra_urn_columns, groups, contact_fields, show_submitted_by, result_fields):
         """
-        Writes a batch of run JSON blobs to the export
+        Gets the row of values for the given run JSON blob
         """
-        # get all the contacts referenced in this batch
-        contact_uuids = {r["contact"]["uuid"] for r in runs}
-        contacts = Contact.objects.filter(org=self.org, uuid__in=contact_uuids).prefetch_related("all_groups")
-        contacts_by_uuid = {str(c.uuid): c for c in contacts}
+        # get this run's results by node name(ruleset label)
+        run_values = run["values"]
+        if isinstance(run_values, list):
+            results_by_key = {key: result for item in run_values for key, result in item.items()}
+        else:
+            results_by_key = {key: result for key, result in run_values.items()}
+
+        # generate contact info columns
+        contact_values = [
+            str(contact.uuid),
+            f"{contact.id:010d}" if self.org.is_anon else contact.get_urn_display(org=self.org, formatted=False),
+        ]
 
-        for run in runs:
-            contact = contacts_by_uuid.get(run["contact"]["uuid"])
+        for extra_urn_column in extra_urn_columns:
+            urn_display = contact.get_urn_display(org=self.org, formatted=False, scheme=extra_urn_column["scheme"])
+            contact_values.append(urn_display)
 
-            # get this run's results by node name(ruleset label)
-            run_values = run["values"]
-            if isinstance(run_values, list):
-                results_by_key = {key: result for item in run_values for key, result in item.items()}
-            else:
-                results_by_key = {key: result for key, result in run_values.items()}
-
-            # generate contact info columns
-            contact_values = [
-                contact.uuid,
-                f"{contact.id:010d}" if self.org.is_anon else contact.get_urn_display(org=self.org, formatted=False),
-            ]
-
-            for extra_urn_column in extra_urn_columns:
-                urn_display = contact.get_urn_display(org=self.org, formatted=False, scheme=extra_urn_column["scheme"])
-                contact_values.append(urn_display)
-
-            contact_values.append(self.prepare_value(contact.name))
-            contact_groups_ids = [g.id for g in contact.all_groups.all()]
-            for gr in groups:
-                contact_values.append(gr.id in contact_groups_ids)
-
-            for cf in contact_fields:
-                field_value = contact.get_field_display(cf)
-                contact_values.append(self.prepare_value(field_value))
-
-            # generate result columns for each ruleset
-            result_values = []
-            for n, result_field in enumerate(result_fields):
-                node_result = {}
-                # check the result by ruleset label if the flow is the same
-                if result_field["flow_uuid"] == run["flow"]["uuid"]:
-                    node_result = results_by_key.get(result_field["key"], {})
-                node_category = node_result.get("category", "")
-                node_value = node_result.get("value", "")
-                node_input = node_result.get("input", "")
-                result_values += [node_category, node_value, node_input]
-
-            if book.current_runs_sheet.num_rows >= self.MAX_EXCEL_ROWS:  # pragma: no cover
-                book.current_runs_sheet = self._add_runs_sheet(book, runs_columns)
-
-            # build the whole row
-            runs_sheet_row = []
-
-            if show_submitted_by:
-                runs_sheet_row.append(run.get("submitted_by") or "")
-
-            runs_sheet_row += contact_values
-            runs_sheet_row += [
-                iso8601.parse_date(run["created_on"]),
-                iso8601.parse_date(run["modified_on"]),
-                iso8601.parse_date(run["exited_on"]) if run["exited_on"] else None,
-                run["uuid"],
-            ]
-            runs_sheet_row += result_values
-
-            self.append_row(book.current_runs_sheet, runs_sheet_row)
-
-            # write out any message associated with this run
-            if include_msgs and not self.org.is_anon:
-                self._write_run_messages(book, run, contact)
+        contact_values.append(self.prepare_value(contact.name))
+        contact_groups_ids = contact.get_group_ids()
+        for gr in groups:
+            contact_values.append(gr.id in contact_groups_ids)
+
+        for cf in contact_fields:
+            field_value = contact.get_field_display(cf)
+            contact_values.append(self.prepare_value(field_value))
+
+        # generate result columns for each ruleset
+        result_values = []
+        for n, result_field in enumerate(result_fields):
+            node_result = {}
+            # check the result by ruleset label if the flow is the same
+            if result_field["flow_uuid"] == run["flow"]["uuid"]:
+                node_result = results_by_key.get(result_field["key"], {})
+            node_category = node_result.get("category", "")
+            node_value = node_result.get("value", "")
+            node_input = node_result.get("input", "")
+            result_values += [node_category, node_value, node_input]
+
+        # build the whole row
+        runs_sheet_row = []
+
+        if show_submitted_by:
+            runs_sheet_row.append(run.get("submitted_by") or "")
+
+        runs_sheet_row += contact_values
+        runs_sheet_row += [
+            iso8601.parse_date(run["created_on"]),
+            iso8601.parse_date(run["modified_on"]),
+            iso8601.parse_date(run["exited_on"]) if run["exited_on"] else None,
+            run["uuid"],
+        ]
+        runs_sheet_row += result_values
+
+        return runs_sheet_row
+
+    def _write_run(self, book, run, contact, row, runs_columns, include_msgs):
+        """
+        Writes the row of a run JSON blob to the workbook, followed by its messages if they're included
+        """
+        if book.current_runs_sheet.num_rows >= self.MAX_EXCEL_ROWS:  # pragma: no cover
+            book.current_runs_sheet = self._add_runs_sheet(book, runs_columns)
+
+        self.append_row(book.current_runs_sheet, row)
+
+        # write out any message associated with this run
+        if include_msgs and not self.org.is_anon:
+            self._write_run_messages(book, run, contact)
 
     def _write_run_messages(self, book, run, contact):
         """
@@ -2080,7 +2235,7 @@ class ResultsExportAssetStore(BaseExportAssetStore):
     key = "results_export"
     directory = "results_exports"
     permission = "flows.flow_export_results"
-    extensions = ("xlsx",)
+    extensions = ("xlsx", "csv", "jsonl.gz")
 
 
 class FlowStart(models.Model):
@@ -2250,6 +2405,7 @@ class FlowStartCount(SquashableModel):
     """
 
     SQUASH_OVER = ("start_id",)
+    SQUASH_BATCHED = True
 
     start = models.ForeignKey(FlowStart, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
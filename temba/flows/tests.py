@@ -1,3 +1,4 @@
+import csv
 import datetime
 import io
 import os
@@ -33,10 +34,12 @@ from temba.tests.s3 import MockS3Client
 from temba.tickets.models import Ticketer
 from temba.triggers.models import Trigger
 from temba.utils import json
+from temba.utils.export import ExportCheckpoints
 from temba.utils.uuid import uuid4
 
 from .checks import mailroom_url
 from .models import (
+    ExportContactCache,
     ExportFlowResultsTask,
     Flow,
     FlowCategoryCount,
@@ -897,6 +900,80 @@ class FlowTest(TembaTest):
         squash_flowcounts()
         self.assertEqual(max_id, FlowRunCount.objects.all().order_by("-id").first().id)
 
+        FlowRunCount.objects.create(flow=flow, count=2, exit_type=None)
+        FlowRunCount.objects.create(flow=flow2, count=-3, exit_type="I")
+
+        # squashing one set at a time gives the same results
+        self.assertEqual(FlowRunCount.squash(batched=False), 2)
+        self.assertEqual(FlowRunCount.objects.all().count(), 3)
+        self.assertEqual(FlowRunCount.get_totals(flow2), {"I": 6})
+        self.assertEqual(FlowRunCount.get_totals(flow), {None: 5, "E": 3})
+
+        FlowNodeCount.objects.create(flow=flow, node_uuid="57b50d33-2b5a-4726-82de-9848c61eff6e", count=4)
+        FlowNodeCount.objects.create(flow=flow, node_uuid="57b50d33-2b5a-4726-82de-9848c61eff6e", count=-1)
+
+        # batched squashing carries over the flow of each node
+        self.assertEqual(FlowNodeCount.squash(), 1)
+        self.assertEqual(FlowNodeCount.get_totals(flow), {"57b50d33-2b5a-4726-82de-9848c61eff6e": 3})
+
+    def test_get_run_stats_many(self):
+        flow1 = self.get_flow("favorites")
+        flow2 = self.get_flow("pick_a_number")
+        flow3 = self.create_flow()
+
+        FlowRunCount.objects.create(flow=flow1, count=2, exit_type=None)
+        FlowRunCount.objects.create(flow=flow1, count=1, exit_type="C")
+        FlowRunCount.objects.create(flow=flow1, count=1, exit_type="C")
+        FlowRunCount.objects.create(flow=flow2, count=3, exit_type="E")
+
+        self.assertEqual(
+            {flow1: {None: 2, "C": 2}, flow2: {"E": 3}, flow3: {}}, FlowRunCount.get_totals_many([flow1, flow2, flow3])
+        )
+
+        # totals for all flows are fetched in one query
+        with self.assertNumQueries(1):
+            stats = Flow.get_run_stats_many([flow1, flow2, flow3])
+
+        self.assertEqual(
+            {
+                flow1: flow1.get_run_stats(),
+                flow2: flow2.get_run_stats(),
+                flow3: {
+                    "total": 0,
+                    "active": 0,
+                    "completed": 0,
+                    "expired": 0,
+                    "interrupted": 0,
+                    "failed": 0,
+                    "completion": 0,
+                },
+            },
+            stats,
+        )
+        self.assertEqual(
+            {"total": 4, "active": 2, "completed": 2, "expired": 0, "interrupted": 0, "failed": 0, "completion": 50},
+            stats[flow1],
+        )
+
+        # stats are cached briefly so new counts aren't seen straight away
+        FlowRunCount.objects.create(flow=flow2, count=1, exit_type=None)
+
+        with self.assertNumQueries(0):
+            stats = Flow.get_run_stats_many([flow1, flow2])
+
+        self.assertEqual(3, stats[flow2]["total"])
+
+        # but flows which aren't cached are fetched
+        flow4 = self.get_flow("color")
+
+        with self.assertNumQueries(1):
+            stats = Flow.get_run_stats_many([flow2, flow4])
+
+        self.assertEqual(3, stats[flow2]["total"])
+        self.assertEqual(0, stats[flow4]["total"])
+
+        self.assertEqual({}, Flow.get_run_stats_many([]))
+
     def test_category_counts(self):
         def assertCount(counts, result_key, category_name, truth):
             found = False
@@ -3824,7 +3901,7 @@ class ExportFlowResultsTest(TembaTest):
                 # make sure that we trigger logger
                 log_info_threshold.return_value = 1
 
-                with self.assertNumQueries(44):
+                with self.assertNumQueries(42):
                     workbook = self._export(flow, group_memberships=[devs])
 
                 self.assertEqual(len(captured_logger.output), 3)
@@ -4064,7 +4141,7 @@ class ExportFlowResultsTest(TembaTest):
         )
 
         # test without msgs or unresponded
-        with self.assertNumQueries(42):
+        with self.assertNumQueries(41):
             workbook = self._export(flow, include_msgs=False, responded_only=True, group_memberships=(devs,))
 
         tz = self.org.timezone
@@ -4130,7 +4207,7 @@ class ExportFlowResultsTest(TembaTest):
         )
 
         # test export with a contact field
-        with self.assertNumQueries(44):
+        with self.assertNumQueries(43):
             workbook = self._export(
                 flow,
                 include_msgs=False,
@@ -4284,6 +4361,216 @@ class ExportFlowResultsTest(TembaTest):
                 self.org.timezone,
             )
 
+    def test_export_results_csv(self):
+        flow = self.get_flow("color_v13")
+        flow_nodes = flow.get_definition()["nodes"]
+        color_prompt = flow_nodes[0]
+        color_split = flow_nodes[4]
+
+        age = self.create_field("age", "Age")
+        devs = self.create_group("Devs", [self.contact])
+        self.contact.modify(self.admin, self.contact.update_fields({age: "36"}))
+
+        msg_in = self.create_incoming_msg(self.contact, "orange")
+        run1 = (
+            MockSessionWriter(self.contact, flow)
+            .visit(color_prompt)
+            .send_msg("What is your favorite color?", self.channel)
+            .visit(color_split)
+            .wait()
+            .resume(msg=msg_in)
+            .set_result("Color", "orange", "Orange", "orange")
+            .complete()
+            .save()
+        ).session.runs.get()
+
+        self.login(self.admin)
+        form = {
+            "flows": [flow.id],
+            "responded_only": True,
+            "contact_fields": [age.id],
+            "group_memberships": [devs.id],
+            "export_format": "csv",
+        }
+
+        # messages can't be included in a CSV export
+        response = self.client.post(reverse("flows.flow_export_results"), {**form, "include_msgs": True})
+        self.assertFormError(response, "form", None, "Messages can only be included in Excel exports.")
+
+        response = self.client.post(reverse("flows.flow_export_results"), form)
+        self.assertEqual(302, response.status_code)
+
+        task = ExportFlowResultsTask.objects.order_by("-id").first()
+        self.assertEqual("csv", task.config["export_format"])
+        self.assertEqual(ExportFlowResultsTask.STATUS_COMPLETE, task.status)
+
+        filename = f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/results_exports/{task.uuid}.csv"
+        with open(filename, encoding="utf-8", newline="") as f:
+            rows = list(csv.reader(f))
+
+        self.assertEqual(
+            [
+                "Contact UUID",
+                "URN",
+                "Name",
+                "Group:Devs",
+                "Field:Age",
+                "Started",
+                "Modified",
+                "Exited",
+                "Run UUID",
+                "Color (Category) - Colors",
+                "Color (Value) - Colors",
+                "Color (Text) - Colors",
+            ],
+            rows[0],
+        )
+        self.assertEqual(2, len(rows))
+        self.assertEqual([str(self.contact.uuid), "+250788382382", "Eric", "True", "36"], rows[1][:5])
+        self.assertEqual([str(run1.uuid), "Orange", "orange", "orange"], rows[1][8:])
+
+    @patch("temba.utils.email.send_temba_email")
+    def test_export_results_csv_resume(self, mock_send_temba_email):
+        self.clear_storage()
+
+        flow = self.get_flow("color_v13")
+        color_prompt = flow.get_definition()["nodes"][0]
+
+        runs = []
+        for contact in (self.contact, self.contact2, self.contact3):
+            runs.append(
+                (
+                    MockSessionWriter(contact, flow)
+                    .visit(color_prompt)
+                    .send_msg("What is your favorite color?", self.channel)
+                    .complete()
+                    .save()
+                ).session.runs.get()
+            )
+
+        # the first run has been archived but not yet deleted from the database
+        mock_s3 = MockS3Client()
+        self.create_archive(
+            Archive.TYPE_FLOWRUN, "D", runs[0].modified_on.date(), [runs[0].as_archive_json()], s3=mock_s3
+        )
+
+        def create_export():
+            return ExportFlowResultsTask.create(
+                self.org, self.admin, [flow], [], False, False, [], [], export_format=ExportFlowResultsTask.FORMAT_CSV
+            )
+
+        get_run_row = ExportFlowResultsTask._get_run_row
+        calls = []
+
+        def get_run_row_then_die(export, run, *args):
+            calls.append(run)
+            if len(calls) > 1:
+                raise ValueError("worker killed")
+            return get_run_row(export, run, *args)
+
+        with patch("temba.archives.models.Archive.s3_client", return_value=mock_s3):
+            with patch.object(ExportFlowResultsTask, "CHECKPOINT_PER_ROWS", 1):
+                task = create_export()
+
+                # interrupt the export after the archived run has been checkpointed
+                with patch.object(ExportFlowResultsTask, "_get_run_row", get_run_row_then_die):
+                    with self.assertRaises(ValueError):
+                        task.perform()
+
+                # as it has a checkpoint, it's left to be resumed rather than marked as failed
+                task.refresh_from_db()
+                self.assertEqual(ExportFlowResultsTask.STATUS_PROCESSING, task.status)
+
+                checkpoints = ExportCheckpoints(task)
+                self.assertEqual(1, checkpoints.num_rows)
+                self.assertEqual({"archived": 1, "max_id": runs[2].id, "after": None}, checkpoints.cursor)
+                self.assertEqual(1, checkpoints.state["failures"])
+
+                # when requeued it resumes from the checkpoint, still skipping the archived run in the database
+                task.perform()
+
+                task.refresh_from_db()
+                self.assertEqual(ExportFlowResultsTask.STATUS_COMPLETE, task.status)
+                self.assertIsNone(ExportCheckpoints(task).cursor)
+
+                filename = f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/results_exports/{task.uuid}.csv"
+                with open(filename, encoding="utf-8", newline="") as f:
+                    rows = list(csv.reader(f))
+
+                self.assertEqual("Contact UUID", rows[0][0])
+                self.assertEqual([str(r.uuid) for r in runs], [r[6] for r in rows[1:]])
+
+                # an export which keeps failing is eventually marked as failed and its checkpoints removed
+                task = create_export()
+
+                with patch.object(ExportFlowResultsTask, "CHECKPOINT_MAX_RESUMES", 1):
+                    for n in range(2):
+                        calls.clear()
+                        with patch.object(ExportFlowResultsTask, "_get_run_row", get_run_row_then_die):
+                            with self.assertRaises(ValueError):
+                                task.perform()
+
+                task.refresh_from_db()
+                self.assertEqual(ExportFlowResultsTask.STATUS_FAILED, task.status)
+                self.assertIsNone(ExportCheckpoints(task).cursor)
+
+    def test_export_results_run_batches(self):
+        flow = self.get_flow("color_v13")
+        color_prompt = flow.get_definition()["nodes"][0]
+
+        def create_run(contact):
+            return (
+                MockSessionWriter(contact, flow)
+                .visit(color_prompt)
+                .send_msg("What is your favorite color?", self.channel)
+                .complete()
+                .save()
+            ).session.runs.get()
+
+        run1 = create_run(self.contact)
+        run2 = create_run(self.contact2)
+
+        task = ExportFlowResultsTask.create(self.org, self.admin, [flow], [], False, False, [], [])
+        batches = task._get_run_batches([flow], False)
+
+        batch, cursor = next(batches)
+        self.assertEqual([str(run1.uuid), str(run2.uuid)], [r["uuid"] for r in batch])
+        self.assertEqual({"archived": 0, "max_id": run2.id, "after": run2.id}, cursor)
+
+        # runs which are updated or created after the export started aren't exported again or at all
+        run1.modified_on = timezone.now()
+        run1.save(update_fields=("modified_on",))
+        create_run(self.contact3)
+
+        self.assertEqual([], list(batches))
+        self.assertEqual([], list(task._get_run_batches([flow], False, cursor)))
+
+    def test_contact_cache(self):
+        cache = ExportContactCache(self.org, 2, groups=True, fields=())
+        uuid1, uuid2, uuid3 = str(self.contact.uuid), str(self.contact2.uuid), str(self.contact3.uuid)
+
+        # contacts are loaded in bulk: contacts, URNs and group memberships
+        with self.assertNumQueries(3):
+            contacts = cache.get_many({uuid1, uuid2})
+
+        self.assertEqual({uuid1: self.contact, uuid2: self.contact2}, contacts)
+        self.assertEqual("+250788382382", contacts[uuid1].get_urn().path)
+
+        # cached contacts aren't loaded again
+        with self.assertNumQueries(0):
+            self.assertEqual({uuid1: self.contact}, cache.get_many({uuid1}))
+
+        # loading another contact evicts the least recently used
+        with self.assertNumQueries(3):
+            self.assertEqual({uuid1: self.contact, uuid3: self.contact3}, cache.get_many([uuid1, uuid3]))
+
+        with self.assertNumQueries(3):
+            self.assertEqual({uuid2: self.contact2}, cache.get_many({uuid2}))
+
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(4, cache.misses)
+        self.assertEqual(1 / 3, cache.hit_ratio)
+
     def test_msg_with_attachments(self):
         flow = self.get_flow("color_v13")
         flow_nodes = flow.get_definition()["nodes"]
@@ -4360,7 +4647,7 @@ class ExportFlowResultsTest(TembaTest):
 
         contact1_run1, contact2_run1, contact3_run1, contact1_run2, contact2_run2 = FlowRun.objects.order_by("id")
 
-        with self.assertNumQueries(52):
+        with self.assertNumQueries(49):
             workbook = self._export(flow)
 
         tz = self.org.timezone
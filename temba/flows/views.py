@@ -1413,6 +1413,14 @@ class FlowCRUDL(SmartCRUDL):
                 help_text=_("Export all messages sent and received in this flow"),
                 widget=CheckboxWidget(),
             )
+            export_format = forms.ChoiceField(
+                choices=ExportFlowResultsTask.FORMAT_CHOICES,
+                required=False,
+                initial=ExportFlowResultsTask.FORMAT_XLSX,
+                label=_("Format"),
+                help_text=_("CSV and JSON lines are recommended for very large exports but can't include messages"),
+                widget=SelectWidget(),
+            )
 
             def __init__(self, user, *args, **kwargs):
                 super().__init__(*args, **kwargs)
@@ -1454,6 +1462,11 @@ class FlowCRUDL(SmartCRUDL):
                         )
                     )
 
+                export_format = cleaned_data.get(ExportFlowResultsTask.EXPORT_FORMAT)
+                is_streaming = export_format and export_format != ExportFlowResultsTask.FORMAT_XLSX
+                if is_streaming and cleaned_data.get(ExportFlowResultsTask.INCLUDE_MSGS):
+                    raise forms.ValidationError(_("Messages can only be included in Excel exports."))
+
                 return cleaned_data
 
         form_class = ExportForm
@@ -1502,6 +1515,8 @@ class FlowCRUDL(SmartCRUDL):
                     responded_only=form.cleaned_data[ExportFlowResultsTask.RESPONDED_ONLY],
                     extra_urns=form.cleaned_data[ExportFlowResultsTask.EXTRA_URNS],
                     group_memberships=form.cleaned_data[ExportFlowResultsTask.GROUP_MEMBERSHIPS],
+                    export_format=form.cleaned_data[ExportFlowResultsTask.EXPORT_FORMAT]
+                    or ExportFlowResultsTask.FORMAT_XLSX,
                 )
                 on_transaction_commit(lambda: export_flow_results_task.delay(export.pk))
 
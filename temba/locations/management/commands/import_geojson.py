@@ -221,3 +221,4 @@ WHERE NOT (abs.osm_id = ANY(%s)))
         if country:
             self.stdout.write(self.style.SUCCESS((f" ** updating paths for all of {country.name}")))
             country.update_path()
+            AdminBoundary.invalidate_path_index(country.id)
@@ -5,9 +5,11 @@ from mptt.models import MPTTModel, TreeForeignKey
 from smartmin.models import SmartModel
 
 from django.contrib.gis.db import models
-from django.db.models import F, Value
+from django.db.models import F, Q, Value
 from django.db.models.functions import Concat
 
+from temba.utils.cache import get_local_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -152,6 +154,10 @@ class AdminBoundary(MPTTModel, models.Model):
 
     @classmethod
     def get_by_path(cls, org, path):
+        # orgs with a country use the shared index of that country's boundaries
+        if org.country_id:
+            return cls.get_path_index(org).get(path)
+
         cache = getattr(org, "_abs", {})
 
         if not cache:
@@ -164,6 +170,38 @@ class AdminBoundary(MPTTModel, models.Model):
 
         return boundary
 
+    @classmethod
+    def get_path_index(cls, org):
+        """
+        Gets a mapping of path to boundary for all boundaries in the given org's country. The index is loaded on first
+        use and kept in the process-local cache, so the returned boundaries are shared and shouldn't be modified.
+        """
+        if not org.country_id:
+            return {}
+
+        return get_local_cache("locations:boundaries").get(
+            org.country_id, lambda: cls._load_path_index(org.country_id)
+        )
+
+    @classmethod
+    def _load_path_index(cls, country_id):
+        country = cls.objects.filter(id=country_id).first()
+        if not country:
+            return {}
+
+        # match on the padded separator so a country isn't confused with another whose name it prefixes
+        boundaries = cls.objects.filter(
+            Q(id=country.id) | Q(path__startswith=country.path + cls.PADDED_PATH_SEPARATOR)
+        )
+        return {b.path: b for b in boundaries}
+
+    @classmethod
+    def invalidate_path_index(cls, country_id):
+        """
+        Invalidates the index of the given country's boundaries in all processes
+        """
+        get_local_cache("locations:boundaries").invalidate(country_id)
+
     def __str__(self):
         return "%s" % self.name
 
@@ -9,6 +9,7 @@ from django.core.management import call_command
 from django.test.utils import captured_stdout
 from django.urls import reverse
 
+from temba.orgs.models import Org
 from temba.tests import TembaTest
 from temba.utils import json
 
@@ -316,6 +317,43 @@ class LocationTest(TembaTest):
         # path should not be defined when calling AdminBoundary.create
         self.assertRaises(TypeError, AdminBoundary.create, osm_id="-1", name="Null Island", level=0, path="some path")
 
+    def test_get_by_path(self):
+        self.setUpLocations()
+
+        # a country whose name is a prefix of ours shouldn't be included in our index
+        AdminBoundary.create(osm_id="-1", name="Rwand", level=0)
+
+        # the index of our country's boundaries is loaded once
+        with self.assertNumQueries(2):
+            self.assertEqual(self.state1, AdminBoundary.get_by_path(self.org, "Rwanda > Kigali City"))
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.ward1, AdminBoundary.get_by_path(self.org, "Rwanda > Eastern Province > Gatsibo > Kageyo")
+            )
+            self.assertIsNone(AdminBoundary.get_by_path(self.org, "Rwanda > Nowhere"))
+            self.assertIsNone(AdminBoundary.get_by_path(self.org, "Rwand"))
+
+        self.assertEqual(10, len(AdminBoundary.get_path_index(self.org)))
+
+        # and shared by other instances of orgs with the same country
+        with self.assertNumQueries(0):
+            self.assertEqual(self.country, AdminBoundary.get_by_path(Org.objects.get(id=self.org.id), "Rwanda"))
+
+        # until it's invalidated
+        self.state1.update(path="Rwanda > Kigali")
+        AdminBoundary.invalidate_path_index(self.country.id)
+
+        self.assertIsNone(AdminBoundary.get_by_path(self.org, "Rwanda > Kigali City"))
+        self.assertEqual(self.state1, AdminBoundary.get_by_path(self.org, "Rwanda > Kigali"))
+
+        # orgs without a country look up paths directly
+        self.org.country = None
+        self.org.save(update_fields=("country",))
+
+        self.assertEqual({}, AdminBoundary.get_path_index(self.org))
+        self.assertEqual(self.state2, AdminBoundary.get_by_path(self.org, "Rwanda > Eastern Province"))
+        self.assertIsNone(AdminBoundary.get_by_path(self.org, "Rwanda > Kigali City"))
+
 
 class ImportGeoJSONtest(TembaTest):
     data_geojson_level_0 = """{
@@ -590,6 +628,13 @@ class ImportGeoJSONtest(TembaTest):
 
         self.assertOSMIDs({"R1000", "R2000"})
 
+        # load an index of the country's boundaries with a path that the update will fix
+        self.org.country = AdminBoundary.objects.get(osm_id="R1000")
+        self.org.save(update_fields=("country",))
+        AdminBoundary.objects.filter(osm_id="R2000").update(path="Granica > Old")
+
+        self.assertEqual({"Granica", "Granica > Old"}, set(AdminBoundary.get_path_index(self.org).keys()))
+
         # update features
         geojson_data = [self.data_geojson_level_0, self.data_geojson_level_1]
 
@@ -601,6 +646,9 @@ class ImportGeoJSONtest(TembaTest):
             with captured_stdout() as captured_output:
                 call_command("import_geojson", "admin_level_0_simplified.json", "admin_level_1_simplified.json")
 
+        # the index of the country's boundaries has been refreshed
+        self.assertEqual({"Granica", "Granica > Međa 2"}, set(AdminBoundary.get_path_index(self.org).keys()))
+
         self.assertEqual(
             captured_output.getvalue(),
             "=== parsing admin_level_0_simplified.json\n ** updating Granica (R1000)\n ** removing unseen boundaries (R1000)\n=== parsing admin_level_1_simplified.json\n ** updating Međa 2 (R2000)\n ** removing unseen boundaries (R2000)\nOther unseen boundaries removed: 0\n ** updating paths for all of Granica\n",
@@ -1,16 +1,25 @@
 import logging
+import os
+import threading
+import time
 from typing import Dict, List, NamedTuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from django.conf import settings
 
-from temba.utils import json
+from temba.utils import analytics, json
 
 from .modifiers import Modifier
 
 logger = logging.getLogger(__name__)
 
+# pooled HTTP session shared by all clients in this process, created on first use
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
 
 class MailroomException(Exception):
     """
@@ -59,6 +68,23 @@ class MailroomClient:
 
     default_headers = {"User-Agent": "Temba"}
 
+    # endpoints which don't modify anything and so can safely be retried
+    idempotent_endpoints = {
+        "",
+        "expression/migrate",
+        "flow/migrate",
+        "flow/inspect",
+        "flow/change_language",
+        "flow/clone",
+        "po/export",
+        "contact/search",
+        "contact/parse_query",
+    }
+
+    # status codes from a proxy in front of mailroom which mean an idempotent request can be retried
+    retry_statuses = {502, 503, 504}
+    retry_backoff = 0.25
+
     def __init__(self, base_url, auth_token):
         self.base_url = base_url
         self.headers = self.default_headers.copy()
@@ -198,8 +224,7 @@ class MailroomClient:
         else:
             kwargs = dict(json=payload)
 
-        req_fn = requests.post if post else requests.get
-        response = req_fn("%s/mr/%s" % (self.base_url, endpoint), headers=self.headers, **kwargs)
+        response = self._send(endpoint, post, kwargs)
 
         return_val = response.json() if returns_json else response.content
 
@@ -217,6 +242,52 @@ class MailroomClient:
 
         return return_val
 
+    def _send(self, endpoint, post, kwargs):
+        """
+        Sends a request using the pooled session, retrying idempotent requests which fail to connect or get a gateway
+        error, and recording the latency of each attempt which gets a response. Read timeouts aren't retried as that
+        would block the caller for several times the already long read timeout.
+        """
+        session = get_session()
+        req_fn = session.post if post else session.get
+        url = "%s/mr/%s" % (self.base_url, endpoint)
+        retries = settings.MAILROOM_RETRIES if endpoint in self.idempotent_endpoints else 0
+        metric = "temba.mailroom_latency_%s" % (endpoint.replace("/", "_") or "version")
+
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                response = req_fn(url, headers=self.headers, timeout=settings.MAILROOM_TIMEOUT, **kwargs)
+            except requests.ConnectionError:  # includes connect timeouts
+                if attempt == retries:
+                    raise
+            else:
+                analytics.gauge(metric, time.perf_counter() - start)
+
+                if response.status_code not in self.retry_statuses or attempt == retries:
+                    return response
+
+            logger.warning(f"retrying failed mailroom request to {endpoint}", extra={"attempt": attempt + 1})
+            time.sleep(self.retry_backoff * 2 ** attempt)
+
+
+def get_session() -> requests.Session:
+    """
+    Gets the pooled HTTP session used for requests to mailroom, creating it if necessary. A new session is created in
+    forked processes so that they don't share connections with their parent.
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.MAILROOM_POOL_SIZE)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session_pid = os.getpid()
+
+        return _session
+
 
 def get_client() -> MailroomClient:
     return MailroomClient(settings.MAILROOM_URL, settings.MAILROOM_AUTH_TOKEN)
@@ -1,11 +1,13 @@
 import time
+from collections import defaultdict
 from enum import Enum
 
 from django_redis import get_redis_connection
 
+from django.conf import settings
 from django.utils import timezone
 
-from temba.utils import json
+from temba.utils import chunk_list, json
 
 HIGH_PRIORITY = -10000000
 DEFAULT_PRIORITY = 0
@@ -18,6 +20,11 @@ CONTACT_QUEUE = "c:%d:%d"
 BATCH_QUEUE = "batch"
 HANDLER_QUEUE = "handler"
 
+# Redis lists of contact ids for starts and broadcasts with too many contacts to include in their tasks
+CONTACT_IDS_KEY = "%s:%d:contact_ids"
+CONTACT_IDS_CHUNK_SIZE = 10000
+CONTACT_IDS_EXPIRE = 60 * 60 * 24 * 7  # 7 days
+
 
 class HandlerTask(Enum):
     CONTACT_EVENT = "handle_contact_event"
@@ -42,7 +49,35 @@ def queue_msg_handling(msg):
     Queues the passed in message for handling in mailroom
     """
 
-    msg_task = {
+    queue_msg_handling_many([msg])
+
+
+def queue_msg_handling_many(msgs):
+    """
+    Queues the passed in messages for handling in mailroom in a single round-trip to Redis
+    """
+
+    _queue_handler_tasks([(msg.org_id, msg.contact_id, ContactEvent.MSG, _create_msg_task(msg)) for msg in msgs])
+
+
+def queue_mo_miss_event(event):
+    """
+    Queues the passed in channel event to mailroom for handling
+    """
+
+    queue_mo_miss_events_many([event])
+
+
+def queue_mo_miss_events_many(events):
+    """
+    Queues the passed in channel events to mailroom for handling in a single round-trip to Redis
+    """
+
+    _queue_handler_tasks([(e.org_id, e.contact_id, ContactEvent.MO_MISS, _create_mo_miss_task(e)) for e in events])
+
+
+def _create_msg_task(msg):
+    return {
         "org_id": msg.org_id,
         "channel_id": msg.channel_id,
         "contact_id": msg.contact_id,
@@ -56,15 +91,9 @@ def queue_msg_handling(msg):
         "new_contact": False,  # only used by courier
     }
 
-    _queue_handler_task(msg.org_id, msg.contact_id, ContactEvent.MSG, msg_task)
-
-
-def queue_mo_miss_event(event):
-    """
-    Queues the passed in channel event to mailroom for handling
-    """
 
-    event_task = {
+def _create_mo_miss_task(event):
+    return {
         "id": event.id,
         "event_type": ContactEvent.MO_MISS.value,
         "org_id": event.org_id,
@@ -76,8 +105,6 @@ def queue_mo_miss_event(event):
         "new_contact": False,  # only used by courier
     }
 
-    _queue_handler_task(event.org_id, event.contact_id, ContactEvent.MO_MISS, event_task)
-
 
 def queue_broadcast(broadcast):
     """
@@ -89,15 +116,39 @@ def queue_broadcast(broadcast):
         "template_state": broadcast.get_template_state(),
         "base_language": broadcast.base_language,
         "urns": broadcast.raw_urns or [],
-        "contact_ids": list(broadcast.contacts.values_list("id", flat=True)),
         "group_ids": list(broadcast.groups.values_list("id", flat=True)),
         "broadcast_id": broadcast.id,
         "org_id": broadcast.org_id,
     }
+    task.update(_get_contact_ids_payload("broadcast", broadcast.id, broadcast.contacts.all()))
 
     _queue_batch_task(broadcast.org_id, BatchTask.SEND_BROADCAST, task, HIGH_PRIORITY)
 
 
+def _get_contact_ids_payload(kind: str, obj_id: int, contacts) -> dict:
+    """
+    Gets the contact ids part of the task payload for a start or broadcast. If there are more contacts than can be
+    included in the task, their ids are pushed in chunks onto a Redis list and the task references that list instead.
+    """
+
+    contact_ids = contacts.values_list("id", flat=True)
+    max_inline = settings.MAILROOM_INLINE_CONTACT_IDS_MAX
+
+    if max_inline is None or contact_ids.count() <= max_inline:
+        return {"contact_ids": list(contact_ids)}
+
+    key = CONTACT_IDS_KEY % (kind, obj_id)
+    r = get_redis_connection("default")
+    r.delete(key)
+
+    for chunk in chunk_list(contact_ids.iterator(), CONTACT_IDS_CHUNK_SIZE):
+        r.rpush(key, *chunk)
+
+    r.expire(key, CONTACT_IDS_EXPIRE)
+
+    return {"contact_ids": [], "contact_ids_key": key}
+
+
 def queue_populate_dynamic_group(group):
     """
     Queues a task to populate the contacts for a dynamic group
@@ -132,7 +183,6 @@ def queue_flow_start(start):
         "created_by": start.created_by.username,
         "flow_id": start.flow_id,
         "flow_type": start.flow.flow_type,
-        "contact_ids": list(start.contacts.values_list("id", flat=True)),
         "group_ids": list(start.groups.values_list("id", flat=True)),
         "urns": start.urns or [],
         "query": start.query,
@@ -140,6 +190,7 @@ def queue_flow_start(start):
         "include_active": start.include_active,
         "extra": start.extra,
     }
+    task.update(_get_contact_ids_payload("start", start.id, start.contacts.all()))
 
     _queue_batch_task(org_id, BatchTask.START_FLOW, task, HIGH_PRIORITY)
 
@@ -181,29 +232,48 @@ def _queue_batch_task(org_id, task_type, task, priority):
     Adds the passed in task to the mailroom batch queue
     """
 
+    _queue_batch_tasks([(org_id, task_type, task, priority)])
+
+
+def _queue_batch_tasks(tasks):
+    """
+    Adds the passed in tasks, as tuples of org id, task type, task and priority, to the mailroom batch queue
+    """
+
+    if not tasks:
+        return
+
     r = get_redis_connection("default")
     pipe = r.pipeline()
-    _queue_task(pipe, org_id, BATCH_QUEUE, task_type, task, priority)
+    for org_id, task_type, task, priority in tasks:
+        _queue_task(pipe, org_id, BATCH_QUEUE, task_type, task, priority)
     pipe.execute()
 
 
-def _queue_handler_task(org_id, contact_id, task_type, task):
+def _queue_handler_tasks(tasks):
     """
-    Adds the passed in task to the contact's queue for mailroom to process
+    Adds the passed in tasks, as tuples of org id, contact id, task type and task, to their contacts' queues for
+    mailroom to process. Tasks for the same contact are pushed together and followed by a single contact event.
     """
 
-    contact_queue = CONTACT_QUEUE % (org_id, contact_id)
-    contact_task = _create_mailroom_task(org_id, task_type, task)
+    if not tasks:
+        return
+
+    tasks_by_contact = defaultdict(list)
+    for org_id, contact_id, task_type, task in tasks:
+        tasks_by_contact[(org_id, contact_id)].append(json.dumps(_create_mailroom_task(org_id, task_type, task)))
 
     r = get_redis_connection("default")
     pipe = r.pipeline()
 
-    # push our concrete task to the contact's queue
-    pipe.rpush(contact_queue, json.dumps(contact_task))
+    for (org_id, contact_id), contact_tasks in tasks_by_contact.items():
+        # push our concrete tasks to the contact's queue
+        pipe.rpush(CONTACT_QUEUE % (org_id, contact_id), *contact_tasks)
+
+        # then push a contact handling event to the org queue
+        event_task = {"contact_id": contact_id}
+        _queue_task(pipe, org_id, HANDLER_QUEUE, HandlerTask.CONTACT_EVENT, event_task, HIGH_PRIORITY)
 
-    # then push a contact handling event to the org queue
-    event_task = {"contact_id": contact_id}
-    _queue_task(pipe, org_id, HANDLER_QUEUE, HandlerTask.CONTACT_EVENT, event_task, HIGH_PRIORITY)
     pipe.execute()
 
 
@@ -1,5 +1,6 @@
-from unittest.mock import patch
+from unittest.mock import call, patch
 
+import requests
 from django_redis import get_redis_connection
 
 from django.conf import settings
@@ -9,26 +10,26 @@ from django.utils import timezone
 from temba.campaigns.models import Campaign, CampaignEvent, EventFire
 from temba.channels.models import ChannelEvent, ChannelLog
 from temba.flows.models import FlowRun, FlowStart
-from temba.mailroom.client import ContactSpec, MailroomException, get_client
+from temba.mailroom.client import ContactSpec, MailroomException, get_client, get_session
 from temba.msgs.models import Broadcast, Msg
 from temba.tests import MockResponse, TembaTest, matchers, mock_mailroom
 from temba.tests.engine import MockSessionWriter
 from temba.utils import json
 
-from . import modifiers, queue_interrupt
+from . import modifiers, queue_interrupt, queue_msg_handling_many
 from .events import Event
 
 
 class MailroomClientTest(TembaTest):
     def test_version(self):
-        with patch("requests.get") as mock_get:
+        with patch("requests.Session.get") as mock_get:
             mock_get.return_value = MockResponse(200, '{"version": "5.3.4"}')
             version = get_client().version()
 
         self.assertEqual("5.3.4", version)
 
     def test_expression_migrate(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"migrated": "@fields.age"}')
             migrated = get_client().expression_migrate("@contact.age")
 
@@ -37,6 +38,7 @@ class MailroomClientTest(TembaTest):
             mock_post.assert_called_once_with(
                 "http://localhost:8090/mr/expression/migrate",
                 headers={"User-Agent": "Temba"},
+                timeout=(5, 60),
                 json={"expression": "@contact.age"},
             )
 
@@ -47,7 +49,7 @@ class MailroomClientTest(TembaTest):
             self.assertEqual("@(bad)", migrated)
 
     def test_flow_migrate(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"name": "Migrated!"}')
             migrated = get_client().flow_migrate({"nodes": []}, to_version="13.1.0")
 
@@ -56,11 +58,12 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/flow/migrate",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             json={"flow": {"nodes": []}, "to_version": "13.1.0"},
         )
 
     def test_flow_change_language(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"language": "spa"}')
             migrated = get_client().flow_change_language({"nodes": []}, language="spa")
 
@@ -69,11 +72,12 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/flow/change_language",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             json={"flow": {"nodes": []}, "language": "spa"},
         )
 
     def test_contact_modify(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(
                 200,
                 """{
@@ -122,6 +126,7 @@ class MailroomClientTest(TembaTest):
             mock_post.assert_called_once_with(
                 "http://localhost:8090/mr/contact/modify",
                 headers={"User-Agent": "Temba"},
+                timeout=(5, 60),
                 json={
                     "org_id": 1,
                     "user_id": 1,
@@ -142,7 +147,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_po_export(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, 'msgid "Red"\nmsgstr "Rojo"\n\n')
             response = get_client().po_export(self.org.id, [123, 234], "spa")
 
@@ -151,11 +156,12 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/po/export",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             json={"org_id": self.org.id, "flow_ids": [123, 234], "language": "spa", "exclude_arguments": False},
         )
 
     def test_po_import(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"flows": []}')
             response = get_client().po_import(self.org.id, [123, 234], "spa", b'msgid "Red"\nmsgstr "Rojo"\n\n')
 
@@ -164,11 +170,12 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/po/import",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             data={"org_id": self.org.id, "flow_ids": [123, 234], "language": "spa"},
             files={"po": b'msgid "Red"\nmsgstr "Rojo"\n\n'},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_parse_query(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"query":"name ~ \\"frank\\"","fields":["name"]}')
         response = get_client().parse_query(self.org.id, "frank")
@@ -177,6 +184,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/parse_query",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             json={"query": "frank", "org_id": self.org.id, "group_uuid": ""},
         )
 
@@ -185,7 +193,7 @@ class MailroomClientTest(TembaTest):
         with self.assertRaises(MailroomException):
             get_client().parse_query(1, "age > 10")
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_create(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"contact": {"id": 1234, "name": "", "language": ""}}')
 
@@ -198,6 +206,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/create",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -224,6 +233,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/create",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -237,7 +247,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_resolve(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"contact": {"id": 1234}, "urn": {"id": 2345}}')
 
@@ -248,10 +258,11 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/resolve",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             json={"org_id": self.org.id, "channel_id": 345, "urn": "tel:+1234567890"},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_search(self, mock_post):
         mock_post.return_value = MockResponse(
             200,
@@ -271,6 +282,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/search",
             headers={"User-Agent": "Temba"},
+            timeout=(5, 60),
             json={
                 "query": "frank",
                 "org_id": 1,
@@ -287,7 +299,7 @@ class MailroomClientTest(TembaTest):
             get_client().contact_search(1, "2752dbbc-723f-4007-8bc5-b3720835d3a9", "age > 10", "-created_on")
 
     def test_ticket_close(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_close(1, [123, 345])
 
@@ -295,11 +307,12 @@ class MailroomClientTest(TembaTest):
             mock_post.assert_called_once_with(
                 "http://localhost:8090/mr/ticket/close",
                 headers={"User-Agent": "Temba"},
+                timeout=(5, 60),
                 json={"org_id": 1, "ticket_ids": [123, 345]},
             )
 
     def test_ticket_reopen(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_reopen(1, [123, 345])
 
@@ -307,12 +320,13 @@ class MailroomClientTest(TembaTest):
             mock_post.assert_called_once_with(
                 "http://localhost:8090/mr/ticket/reopen",
                 headers={"User-Agent": "Temba"},
+                timeout=(5, 60),
                 json={"org_id": 1, "ticket_ids": [123, 345]},
             )
 
     @override_settings(TESTING=False)
     def test_inspect_with_org(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"dependencies":[]}')
 
             get_client().flow_inspect(self.org.id, {"nodes": []})
@@ -320,13 +334,14 @@ class MailroomClientTest(TembaTest):
             mock_post.assert_called_once_with(
                 "http://localhost:8090/mr/flow/inspect",
                 headers={"User-Agent": "Temba"},
+                timeout=(5, 60),
                 json={"org_id": self.org.id, "flow": {"nodes": []}},
             )
 
     def test_request_failure(self):
         flow = self.get_flow("color")
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(400, '{"errors":["Bad request", "Doh!"]}')
 
             with self.assertRaises(MailroomException) as e:
@@ -337,6 +352,56 @@ class MailroomClientTest(TembaTest):
             {"endpoint": "flow/migrate", "request": matchers.Dict(), "response": {"errors": ["Bad request", "Doh!"]}},
         )
 
+    def test_retries(self):
+        with patch("requests.Session.post") as mock_post, patch("time.sleep") as mock_sleep:
+            # idempotent requests are retried after connection errors and gateway errors
+            mock_post.side_effect = [
+                requests.ConnectionError(),
+                MockResponse(503, "Service Unavailable"),
+                MockResponse(200, '{"name": "Migrated!"}'),
+            ]
+
+            self.assertEqual({"name": "Migrated!"}, get_client().flow_migrate({"nodes": []}))
+            self.assertEqual(3, mock_post.call_count)
+            mock_sleep.assert_has_calls([call(0.25), call(0.5)])
+
+            # but only up to the max number of retries
+            mock_post.reset_mock()
+            mock_post.side_effect = requests.ConnectTimeout()
+
+            with self.assertRaises(requests.ConnectTimeout):
+                get_client().flow_migrate({"nodes": []})
+
+            self.assertEqual(3, mock_post.call_count)
+
+            # read timeouts aren't retried
+            mock_post.reset_mock()
+            mock_post.side_effect = requests.ReadTimeout()
+
+            with self.assertRaises(requests.ReadTimeout):
+                get_client().flow_migrate({"nodes": []})
+
+            self.assertEqual(1, mock_post.call_count)
+
+            # and other requests aren't retried at all
+            mock_post.reset_mock()
+            mock_post.side_effect = requests.ConnectionError()
+
+            with self.assertRaises(requests.ConnectionError):
+                get_client().contact_resolve(self.org.id, self.channel.id, "tel:+1234567890")
+
+            self.assertEqual(1, mock_post.call_count)
+
+    def test_session(self):
+        # all clients share a pooled session
+        session = get_session()
+        self.assertIs(session, get_session())
+        self.assertEqual(10, session.get_adapter("http://localhost:8090").poolmanager.connection_pool_kw["maxsize"])
+
+        # unless they're in a forked process
+        with patch("os.getpid", return_value=-1):
+            self.assertIsNot(session, get_session())
+
     def test_empty_expression(self):
         # empty is as empty does
         self.assertEqual("", get_client().expression_migrate(""))
@@ -423,6 +488,35 @@ class MailroomQueueTest(TembaTest):
             },
         )
 
+    def test_queue_msg_handling_many(self):
+        jim = self.create_contact("Jim", phone="+12065551212")
+        bob = self.create_contact("Bob", phone="+12065551313")
+        msg1 = self.create_incoming_msg(jim, "Hello")
+        msg2 = self.create_incoming_msg(bob, "Hi")
+        msg3 = self.create_incoming_msg(jim, "Anyone there?")
+
+        with patch("temba.mailroom.queue.get_redis_connection") as mock_redis:
+            queue_msg_handling_many([])
+
+            self.assertEqual(0, mock_redis.call_count)
+
+        queue_msg_handling_many([msg1, msg2, msg3])
+
+        r = get_redis_connection()
+
+        # tasks for the same contact are pushed onto its queue in order
+        jim_tasks = [json.loads(t) for t in r.lrange(f"c:{self.org.id}:{jim.id}", 0, -1)]
+        self.assertEqual([msg1.id, msg3.id], [t["task"]["msg_id"] for t in jim_tasks])
+        self.assertEqual("msg_event", jim_tasks[0]["type"])
+
+        bob_tasks = [json.loads(t) for t in r.lrange(f"c:{self.org.id}:{bob.id}", 0, -1)]
+        self.assertEqual([msg2.id], [t["task"]["msg_id"] for t in bob_tasks])
+
+        # with a single handling event for each contact
+        self.assert_org_queued(self.org, "handler")
+        events = [json.loads(t) for t in r.zrange(f"handler:{self.org.id}", 0, -1)]
+        self.assertEqual({jim.id, bob.id}, {e["task"]["contact_id"] for e in events})
+
     def test_queue_broadcast(self):
         jim = self.create_contact("Jim", phone="+12065551212")
         bobs = self.create_group("Bobs", [self.create_contact("Bob", phone="+12065551313")])
@@ -505,6 +599,34 @@ class MailroomQueueTest(TembaTest):
             },
         )
 
+    @override_settings(MAILROOM_INLINE_CONTACT_IDS_MAX=2)
+    def test_queue_flow_start_with_many_contacts(self):
+        flow = self.get_flow("favorites")
+        contacts = [self.create_contact(f"Contact {i}", phone=f"+1206555100{i}") for i in range(3)]
+
+        with patch("temba.mailroom.queue.CONTACT_IDS_CHUNK_SIZE", 2):
+            start = FlowStart.create(flow, self.admin, contacts=contacts)
+            start.async_start()
+
+        # contact ids are written to a list which the task references
+        r = get_redis_connection()
+        key = f"start:{start.id}:contact_ids"
+        self.assertEqual({c.id for c in contacts}, {int(i) for i in r.lrange(key, 0, -1)})
+        self.assertGreater(r.ttl(key), 0)
+
+        task = json.loads(r.zrange(f"batch:{self.org.id}", 0, 1)[0])["task"]
+        self.assertEqual([], task["contact_ids"])
+        self.assertEqual(key, task["contact_ids_key"])
+
+        # but broadcasts with fewer contacts still include them in the task
+        bcast = Broadcast.create(self.org, self.admin, {"eng": "Hi"}, contacts=contacts[:2], base_language="eng")
+        bcast.send_async()
+
+        tasks = [json.loads(t)["task"] for t in r.zrange(f"batch:{self.org.id}", 0, -1)]
+        bcast_task = [t for t in tasks if t.get("broadcast_id") == bcast.id][0]
+        self.assertEqual({contacts[0].id, contacts[1].id}, set(bcast_task["contact_ids"]))
+        self.assertNotIn("contact_ids_key", bcast_task)
+
     def test_queue_contact_import_batch(self):
         imp = self.create_contact_import("media/test_imports/simple.xlsx")
         imp.start()
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.10 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("msgs", "0145_auto_20210101_1559"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exportmessagestask",
+            name="export_format",
+            field=models.CharField(
+                choices=[("xlsx", "Excel Spreadsheet"), ("csv", "CSV"), ("jsonl", "JSON Lines (gzipped)")],
+                default="xlsx",
+                max_length=5,
+            ),
+        ),
+    ]
@@ -1,6 +1,7 @@
+import itertools
 import logging
 import time
-from array import array
+from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Dict, List
 
@@ -26,9 +27,10 @@ from temba.channels.models import Channel, ChannelEvent, ChannelLog
 from temba.contacts.models import URN, Contact, ContactGroup, ContactURN
 from temba.orgs.models import Language, Org, TopUp
 from temba.schedules.models import Schedule
-from temba.utils import chunk_list, extract_constants, on_transaction_commit
-from temba.utils.export import BaseExportAssetStore, BaseExportTask
-from temba.utils.models import JSONAsTextField, SquashableModel, TembaModel, TranslatableField
+from temba.utils import chunk_list, extract_constants, json, on_transaction_commit
+from temba.utils.export import STREAMING_EXPORTERS, BaseExportAssetStore, BaseExportTask, ExportCheckpoints
+from temba.utils.models import JSONAsTextField, KeysetIterator, SquashableModel, TembaModel, TranslatableField
+from temba.utils.s3 import select_in, select_literal
 from temba.utils.text import clean_string
 from temba.utils.uuid import uuid4
 
@@ -705,6 +707,16 @@ class Msg(models.Model):
         """
         Resends this message by creating a clone and triggering a send of that clone
         """
+        cloned = self._clone_for_resend()
+
+        # send our message
+        self.org.trigger_send([cloned])
+        return cloned
+
+    def _clone_for_resend(self):
+        """
+        Creates a pending clone of this message to be sent in its place, and marks this message as resent
+        """
         now = timezone.now()
         (topup_id, amount) = self.org.decrement_credit()  # costs 1 credit to resend message
 
@@ -732,8 +744,6 @@ class Msg(models.Model):
         self.topup = None
         self.save()
 
-        # send our message
-        self.org.trigger_send([cloned])
         return cloned
 
     def as_task_json(self):
@@ -776,6 +786,20 @@ class Msg(models.Model):
 
     @classmethod
     def create_relayer_incoming(cls, org, channel, urn, text, received_on, attachments=None):
+        msg, created = cls.get_or_create_relayer_incoming(org, channel, urn, text, received_on, attachments)
+
+        # pass off handling of the message after we commit
+        if created:
+            on_transaction_commit(lambda: msg.handle())
+
+        return msg
+
+    @classmethod
+    def get_or_create_relayer_incoming(cls, org, channel, urn, text, received_on, attachments=None):
+        """
+        Gets or creates an incoming message from a relayer, returning a tuple of the message and whether it was
+        created. New messages aren't queued for handling so callers can queue them together.
+        """
         contact, contact_urn = Contact.resolve(channel, urn)
 
         # we limit our text message length and remove any invalid chars
@@ -787,7 +811,7 @@ class Msg(models.Model):
         # don't create duplicate messages
         existing = Msg.objects.filter(text=text, sent_on=received_on, contact=contact, direction="I").first()
         if existing:
-            return existing
+            return existing, False
 
         msg = Msg.objects.create(
             org=org,
@@ -804,10 +828,7 @@ class Msg(models.Model):
             status=PENDING,
         )
 
-        # pass off handling of the message after we commit
-        on_transaction_commit(lambda: msg.handle())
-
-        return msg
+        return msg, True
 
     def archive(self):
         """
@@ -883,8 +904,13 @@ class Msg(models.Model):
 
     @classmethod
     def apply_action_resend(cls, user, msgs):
+        cloned_by_org = defaultdict(list)
         for msg in msgs:
-            msg.resend()
+            cloned_by_org[msg.org].append(msg._clone_for_resend())
+
+        # trigger sending of all the clones together rather than one at a time
+        for org, cloned in cloned_by_org.items():
+            org.trigger_send(cloned)
 
 
 class BroadcastMsgCount(SquashableModel):
@@ -893,6 +919,7 @@ class BroadcastMsgCount(SquashableModel):
     """
 
     SQUASH_OVER = ("broadcast_id",)
+    SQUASH_BATCHED = True
 
     broadcast = models.ForeignKey(Broadcast, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
@@ -1019,6 +1046,7 @@ class SystemLabelCount(SquashableModel):
     """
 
     SQUASH_OVER = ("org_id", "label_type", "is_archived")
+    SQUASH_BATCHED = True
 
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="system_labels")
 
@@ -1257,6 +1285,7 @@ class LabelCount(SquashableModel):
     """
 
     SQUASH_OVER = ("label_id", "is_archived")
+    SQUASH_BATCHED = True
 
     label = models.ForeignKey(Label, on_delete=models.PROTECT, related_name="counts")
 
@@ -1292,46 +1321,12 @@ class LabelCount(SquashableModel):
         return {l: counts_by_label_id.get(l.id, 0) for l in labels}
 
 
-class MsgIterator:
-    """
-    Queryset wrapper to chunk queries and reduce in-memory footprint
-    """
-
-    def __init__(self, ids, order_by=None, select_related=None, prefetch_related=None, max_obj_num=1000):
-        self._ids = ids
-        self._order_by = order_by
-        self._select_related = select_related
-        self._prefetch_related = prefetch_related
-        self._generator = self._setup()
-        self.max_obj_num = max_obj_num
-
-    def _setup(self):
-        for i in range(0, len(self._ids), self.max_obj_num):
-            chunk_queryset = Msg.objects.filter(id__in=self._ids[i : i + self.max_obj_num])
-
-            if self._order_by:
-                chunk_queryset = chunk_queryset.order_by(*self._order_by)
-
-            if self._select_related:
-                chunk_queryset = chunk_queryset.select_related(*self._select_related)
-
-            if self._prefetch_related:
-                chunk_queryset = chunk_queryset.prefetch_related(*self._prefetch_related)
-
-            yield chunk_queryset
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return next(self._generator)
-
-
 class ExportMessagesTask(BaseExportTask):
     """
     Wrapper for handling exports of raw messages. This will export all selected messages in
     an Excel spreadsheet, adding sheets as necessary to fall within the guidelines of Excel 97
-    (the library we depend on requires this) which has column and row size limits.
+    (the library we depend on requires this) which has column and row size limits. Alternatively messages can be
+    exported as CSV or gzipped JSON lines, which are streamed to disk batch by batch so memory usage stays flat.
 
     When the export is done, we store the file on the server and send an e-mail notice with a
     link to download the results.
@@ -1341,6 +1336,21 @@ class ExportMessagesTask(BaseExportTask):
     email_subject = "Your messages export from %s is ready"
     email_template = "msgs/email/msg_export_download"
 
+    # keys used for each column when exporting to JSON lines
+    JSONL_KEYS = (
+        "created_on",
+        "contact_uuid",
+        "contact_name",
+        "urn",
+        "urn_scheme",
+        "direction",
+        "text",
+        "attachments",
+        "status",
+        "channel",
+        "labels",
+    )
+
     groups = models.ManyToManyField(ContactGroup)
 
     label = models.ForeignKey(Label, on_delete=models.PROTECT, null=True)
@@ -1351,8 +1361,22 @@ class ExportMessagesTask(BaseExportTask):
 
     end_date = models.DateField(null=True, blank=True, help_text=_("The date for the newest message to export"))
 
+    export_format = models.CharField(
+        max_length=5, choices=BaseExportTask.FORMAT_CHOICES, default=BaseExportTask.FORMAT_XLSX
+    )
+
     @classmethod
-    def create(cls, org, user, system_label=None, label=None, groups=(), start_date=None, end_date=None):
+    def create(
+        cls,
+        org,
+        user,
+        system_label=None,
+        label=None,
+        groups=(),
+        start_date=None,
+        end_date=None,
+        export_format=BaseExportTask.FORMAT_XLSX,
+    ):
         if label and system_label:  # pragma: no cover
             raise ValueError("Can't specify both label and system label")
 
@@ -1362,6 +1386,7 @@ class ExportMessagesTask(BaseExportTask):
             label=label,
             start_date=start_date,
             end_date=end_date,
+            export_format=export_format,
             created_by=user,
             modified_by=user,
         )
@@ -1376,11 +1401,8 @@ class ExportMessagesTask(BaseExportTask):
         self.append_row(sheet, book.headers)
         return sheet
 
-    def write_export(self):
-        book = XLSXBook()
-        book.num_msgs_sheets = 0
-
-        book.headers = [
+    def _get_headers(self):
+        return [
             "Date",
             "Contact UUID",
             "Name",
@@ -1394,8 +1416,44 @@ class ExportMessagesTask(BaseExportTask):
             "Labels",
         ]
 
-        book.current_msgs_sheet = self._add_msgs_sheet(book)
+    def write_export(self):
+        if self.export_format == self.FORMAT_XLSX:
+            book = XLSXBook()
+            book.num_msgs_sheets = 0
+            book.headers = self._get_headers()
+            book.current_msgs_sheet = self._add_msgs_sheet(book)
+
+            self._export_batches(lambda batch, cursor: self._write_msgs(book, batch))
+
+            temp = NamedTemporaryFile(delete=True, suffix=".xlsx", mode="wb+")
+            book.finalize(to_file=temp)
+            temp.flush()
+            return temp, "xlsx"
+        else:
+            # streaming formats write rows straight to the temp file as each batch arrives, saving checkpoints as they
+            # go so that if this export is interrupted it can resume from the last one when requeued
+            exporter_class = STREAMING_EXPORTERS[self.export_format]
+            columns = self.JSONL_KEYS if self.export_format == self.FORMAT_JSONL else self._get_headers()
+            checkpoints = ExportCheckpoints(self)
+            exporter = exporter_class(self, columns, header=checkpoints.cursor is None)
+
+            if checkpoints.cursor:
+                logger.info(
+                    f"Msgs export #{self.id} for org #{self.org.id}: resuming after {checkpoints.num_rows} rows"
+                )
 
+            def write_batch(batch, cursor):
+                for row in self._get_msg_rows(batch):
+                    exporter.write_row(row)
+
+                if checkpoints.is_due(exporter):
+                    checkpoints.save(exporter, cursor)
+
+            self._export_batches(write_batch, cursor=checkpoints.cursor)
+
+            return checkpoints.assemble(exporter)
+
+    def _export_batches(self, write_batch, cursor=None):
         total_msgs_exported = 0
         temp_msgs_exported = 0
 
@@ -1415,8 +1473,10 @@ class ExportMessagesTask(BaseExportTask):
         if self.end_date:
             end_date = tz.localize(datetime.combine(self.end_date, datetime.max.time()))
 
-        for batch in self._get_msg_batches(self.system_label, self.label, start_date, end_date, contact_uuids):
-            self._write_msgs(book, batch)
+        for batch, batch_cursor in self._get_msg_batches(
+            self.system_label, self.label, start_date, end_date, contact_uuids, cursor
+        ):
+            write_batch(batch, batch_cursor)
 
             total_msgs_exported += len(batch)
 
@@ -1431,53 +1491,68 @@ class ExportMessagesTask(BaseExportTask):
                 self.modified_on = timezone.now()
                 self.save(update_fields=["modified_on"])
 
-        temp = NamedTemporaryFile(delete=True, suffix=".xlsx", mode="wb+")
-        book.finalize(to_file=temp)
-        temp.flush()
-        return temp, "xlsx"
+    def _get_msg_batches(self, system_label, label, start_date, end_date, group_contacts, cursor=None):
+        """
+        Generates batches of msgs in archive format, each with a cursor from which the export can be resumed after
+        that batch. The cursor records how many archived records have been read, and once we're exporting msgs from the
+        database, the key of the last msg exported.
+        """
+        from temba.archives.models import Archive
 
-    def _get_msg_batches(self, system_label, label, start_date, end_date, group_contacts):
-        logger.info(f"Msgs export #{self.id} for org #{self.org.id}: fetching msgs from archives to export...")
+        cursor = cursor or {"archived": 0, "after": None}
+        num_archived = cursor["archived"]
+        after = (iso8601.parse_date(cursor["after"][0]), cursor["after"][1]) if cursor["after"] else None
 
-        # firstly get msgs from archives
-        from temba.archives.models import Archive
+        # msgs created before the end of the latest archive are exported from archives rather than the database. This
+        # is based on the archives themselves rather than their records as those are filtered.
+        archived_until = Archive.get_archived_until(self.org, Archive.TYPE_MSG, start_date, end_date)
 
-        records = Archive.iter_all_records(self.org, Archive.TYPE_MSG, start_date, end_date)
-        last_created_on = None
+        def make_cursor():
+            return {
+                "archived": num_archived,
+                "after": [json.encode_datetime(after[0], micros=True), after[1]] if after else None,
+            }
 
-        for record_batch in chunk_list(records, 1000):
-            matching = []
-            for record in record_batch:
-                created_on = iso8601.parse_date(record["created_on"])
-                if last_created_on is None or last_created_on < created_on:
-                    last_created_on = created_on
+        # firstly get msgs from archives, unless we're resuming an export that had already got past them
+        if not after:
+            logger.info(f"Msgs export #{self.id} for org #{self.org.id}: fetching msgs from archives to export...")
 
-                if group_contacts and record["contact"]["uuid"] not in group_contacts:
-                    continue
+            # filter by date, direction, type, status and visibility in S3 Select, leaving only labels and groups
+            visibility = "visible"
+            conditions = []
+            if system_label:
+                visibility, direction, msg_type, statuses = SystemLabel.get_archive_attributes(system_label)
 
-                visibility = "visible"
-                if system_label:
-                    visibility, direction, msg_type, statuses = SystemLabel.get_archive_attributes(system_label)
+                conditions.append(f"s.direction = {select_literal(direction)}")
+                if msg_type:
+                    conditions.append(f"s.type = {select_literal(msg_type)}")
+                if statuses:
+                    conditions.append(select_in("s.status", statuses))
 
-                    if record["direction"] != direction:
-                        continue
+            conditions.append(f"s.visibility = {select_literal(visibility)}")
 
-                    if msg_type and record["type"] != msg_type:
-                        continue
+            records = Archive.iter_all_records(
+                self.org, Archive.TYPE_MSG, start_date, end_date, expression=" AND ".join(conditions)
+            )
 
-                    if statuses and record["status"] not in statuses:
-                        continue
+            # skip over any records that were exported before this export was interrupted
+            records = itertools.islice(records, num_archived, None)
 
-                elif label:
-                    record_labels = [l["uuid"] for l in record["labels"]]
-                    if label and label.uuid not in record_labels:
+            for record_batch in chunk_list(records, 1000):
+                matching = []
+                for record in record_batch:
+                    if group_contacts and record["contact"]["uuid"] not in group_contacts:
                         continue
 
-                if record["visibility"] != visibility:
-                    continue
+                    if label and not system_label:
+                        record_labels = [l["uuid"] for l in record["labels"]]
+                        if label.uuid not in record_labels:
+                            continue
+
+                    matching.append(record)
 
-                matching.append(record)
-            yield matching
+                num_archived += len(record_batch)
+                yield matching, make_cursor()
 
         if system_label:
             messages = SystemLabel.get_queryset(self.org, system_label)
@@ -1493,29 +1568,40 @@ class ExportMessagesTask(BaseExportTask):
             messages = messages.filter(created_on__lte=end_date)
 
         if self.groups.all():
-            messages = messages.filter(contact__all_groups__in=self.groups.all())
+            messages = messages.filter(contact__in=Contact.objects.filter(all_groups__in=self.groups.all()))
 
-        messages = messages.order_by("created_on")
-        if last_created_on:
-            messages = messages.filter(created_on__gt=last_created_on)
-
-        all_message_ids = array(str("l"), messages.values_list("id", flat=True))
+        if archived_until:
+            messages = messages.filter(created_on__gte=archived_until)
 
         logger.info(
-            f"Msgs export #{self.id} for org #{self.org.id}: found {len(all_message_ids)} msgs in database to export"
+            f"Msgs export #{self.id} for org #{self.org.id}: found {messages.count()} msgs in database to export"
         )
 
         prefetch = Prefetch("labels", queryset=Label.label_objects.order_by("name"))
-        for msg_batch in MsgIterator(
-            all_message_ids,
-            order_by=["" "created_on"],
-            select_related=["contact", "contact_urn", "channel"],
-            prefetch_related=[prefetch],
-        ):
+        msg_batches = KeysetIterator(
+            messages,
+            keys=("created_on", "id"),
+            after=after,
+            select_related=("contact", "contact_urn", "channel"),
+            prefetch_related=(prefetch,),
+        )
+        for msg_batch in msg_batches:
+            after = msg_batches.last_key
+
             # convert this batch of msgs to same format as records in our archives
-            yield [msg.as_archive_json() for msg in msg_batch]
+            yield [msg.as_archive_json() for msg in msg_batch], make_cursor()
 
     def _write_msgs(self, book, msgs):
+        for row in self._get_msg_rows(msgs):
+            if book.current_msgs_sheet.num_rows >= self.MAX_EXCEL_ROWS:  # pragma: no cover
+                book.current_msgs_sheet = self._add_msgs_sheet(book)
+
+            self.append_row(book.current_msgs_sheet, row)
+
+    def _get_msg_rows(self, msgs):
+        """
+        Generates the row values for the given batch of msgs in archive format
+        """
         # get all the contacts referenced in this batch
         contact_uuids = {m["contact"]["uuid"] for m in msgs}
         contacts = Contact.objects.filter(org=self.org, uuid__in=contact_uuids)
@@ -1535,25 +1621,19 @@ class ExportMessagesTask(BaseExportTask):
             else:
                 urn_path = ""
 
-            if book.current_msgs_sheet.num_rows >= self.MAX_EXCEL_ROWS:  # pragma: no cover
-                book.current_msgs_sheet = self._add_msgs_sheet(book)
-
-            self.append_row(
-                book.current_msgs_sheet,
-                [
-                    iso8601.parse_date(msg["created_on"]),
-                    msg["contact"]["uuid"],
-                    msg["contact"].get("name", ""),
-                    urn_path,
-                    urn_scheme,
-                    msg["direction"].upper() if msg["direction"] else None,
-                    msg["text"],
-                    ", ".join(attachment["url"] for attachment in msg["attachments"]),
-                    msg["status"],
-                    msg["channel"]["name"] if msg["channel"] else "",
-                    ", ".join(msg_label["name"] for msg_label in msg["labels"]),
-                ],
-            )
+            yield [
+                iso8601.parse_date(msg["created_on"]),
+                msg["contact"]["uuid"],
+                msg["contact"].get("name", ""),
+                urn_path,
+                urn_scheme,
+                msg["direction"].upper() if msg["direction"] else None,
+                msg["text"],
+                ", ".join(attachment["url"] for attachment in msg["attachments"]),
+                msg["status"],
+                msg["channel"]["name"] if msg["channel"] else "",
+                ", ".join(msg_label["name"] for msg_label in msg["labels"]),
+            ]
 
 
 @register_asset_store
@@ -1562,4 +1642,4 @@ class MessageExportAssetStore(BaseExportAssetStore):
     key = "message_export"
     directory = "message_exports"
     permission = "msgs.msg_export"
-    extensions = ("xlsx",)
+    extensions = ("xlsx", "csv", "jsonl.gz")
@@ -1,3 +1,6 @@
+import csv
+import gzip
+import io
 from datetime import datetime, timedelta
 from unittest.mock import PropertyMock, patch
 
@@ -5,6 +8,7 @@ import pytz
 from openpyxl import load_workbook
 
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.urls import reverse
 from django.utils import timezone
 
@@ -32,6 +36,7 @@ from temba.msgs.models import (
     ExportMessagesTask,
     Label,
     LabelCount,
+    MessageExportAssetStore,
     Msg,
     SystemLabel,
     SystemLabelCount,
@@ -41,6 +46,8 @@ from temba.schedules.models import Schedule
 from temba.tests import AnonymousOrg, TembaTest
 from temba.tests.engine import MockSessionWriter
 from temba.tests.s3 import MockS3Client
+from temba.utils import json
+from temba.utils.export import ExportCheckpoints
 from temba.utils.uuid import uuid4
 
 from .tasks import retry_errored_messages, squash_msgcounts
@@ -1666,6 +1673,154 @@ class MsgTest(TembaTest):
         self.assertEqual(302, response.status_code)
         self.assertEqual("/msg/inbox/", response.url)
 
+    @patch("temba.utils.email.send_temba_email")
+    def test_message_export_streaming(self, mock_send_temba_email):
+        self.clear_storage()
+        self.login(self.admin)
+
+        msg1 = self.create_incoming_msg(self.joe, "hello, 1", created_on=datetime(2017, 1, 1, 10, tzinfo=pytz.UTC))
+        msg2 = self.create_outgoing_msg(
+            self.joe, "=hello 2", status=SENT, created_on=datetime(2017, 1, 2, 10, tzinfo=pytz.UTC)
+        )
+
+        def request_export(export_format):
+            response = self.client.post(
+                reverse("msgs.msg_export") + "?l=I", {"export_all": 1, "export_format": export_format}
+            )
+            self.assertEqual(response.status_code, 302)
+            task = ExportMessagesTask.objects.order_by("-id").first()
+            self.assertEqual(export_format, task.export_format)
+            self.assertEqual(ExportMessagesTask.STATUS_COMPLETE, task.status)
+            return task
+
+        task = request_export("csv")
+        filename = f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/message_exports/{task.uuid}.csv"
+        with open(filename, encoding="utf-8", newline="") as f:
+            rows = list(csv.reader(f))
+
+        self.assertEqual(
+            [
+                "Date",
+                "Contact UUID",
+                "Name",
+                "URN",
+                "URN Type",
+                "Direction",
+                "Text",
+                "Attachments",
+                "Status",
+                "Channel",
+                "Labels",
+            ],
+            rows[0],
+        )
+        self.assertEqual(3, len(rows))
+        self.assertEqual([str(self.joe.uuid), "Joe Blow", "123", "tel", "IN", "hello, 1"], rows[1][1:7])
+        self.assertEqual([str(self.joe.uuid), "Joe Blow", "123", "tel", "OUT", "'=hello 2"], rows[2][1:7])
+
+        task = request_export("jsonl")
+        filename = f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/message_exports/{task.uuid}.jsonl.gz"
+        with gzip.open(filename, "rt", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+
+        self.assertEqual(2, len(records))
+        self.assertEqual(
+            {
+                "created_on": json.encode_datetime(msg1.created_on),
+                "contact_uuid": str(self.joe.uuid),
+                "contact_name": "Joe Blow",
+                "urn": "123",
+                "urn_scheme": "tel",
+                "direction": "IN",
+                "text": "hello, 1",
+                "attachments": "",
+                "status": "handled",
+                "channel": "Test Channel",
+                "labels": "",
+            },
+            records[0],
+        )
+        self.assertEqual("=hello 2", records[1]["text"])
+        self.assertEqual(json.encode_datetime(msg2.created_on), records[1]["created_on"])
+
+        # download filenames use the full compound extension
+        org, url, filename = MessageExportAssetStore().resolve(self.admin, task.id)
+        self.assertTrue(filename.endswith(".jsonl.gz"))
+
+    @patch("temba.utils.email.send_temba_email")
+    def test_message_export_resume(self, mock_send_temba_email):
+        self.clear_storage()
+
+        self.org.created_on = timezone.now() - timedelta(days=2)
+        self.org.save(update_fields=("created_on",))
+
+        msg1 = self.create_incoming_msg(self.joe, "hello 1", created_on=timezone.now() - timedelta(days=1))
+        self.create_incoming_msg(self.joe, "hello 2")
+        self.create_incoming_msg(self.joe, "hello 3")
+
+        # msg1 has been archived so will come in its own batch before those from the database
+        mock_s3 = MockS3Client()
+        self.create_archive(Archive.TYPE_MSG, "D", msg1.created_on.date(), [msg1.as_archive_json()], s3=mock_s3)
+        msg1.release()
+
+        task = ExportMessagesTask.create(self.org, self.admin, system_label="I", export_format="csv")
+        get_msg_rows = ExportMessagesTask._get_msg_rows
+        calls = []
+
+        def get_msg_rows_then_die(export, msgs):
+            calls.append(msgs)
+            if len(calls) > 1:
+                raise ValueError("worker killed")
+            return get_msg_rows(export, msgs)
+
+        with patch("temba.archives.models.Archive.s3_client", return_value=mock_s3):
+            with patch.object(ExportMessagesTask, "CHECKPOINT_PER_ROWS", 1):
+                # interrupt the export after the first batch has been checkpointed
+                with patch.object(ExportMessagesTask, "_get_msg_rows", get_msg_rows_then_die):
+                    with self.assertRaises(ValueError):
+                        task.write_export()
+
+                checkpoints = ExportCheckpoints(task)
+                self.assertEqual(1, checkpoints.num_rows)
+                self.assertEqual(["0.csv"], checkpoints.state["parts"])
+                self.assertEqual(1, checkpoints.cursor["archived"])
+                self.assertIsNone(checkpoints.cursor["after"])
+
+                # when requeued it resumes from the checkpoint rather than re-exporting msg1
+                calls.clear()
+                with patch.object(ExportMessagesTask, "_get_msg_rows", get_msg_rows_then_die):
+                    with patch.object(ExportMessagesTask, "CHECKPOINT_PER_ROWS", 10):
+                        temp_file, extension = task.write_export()
+
+            self.assertEqual(1, len(calls))
+            self.assertEqual(["hello 2", "hello 3"], [m["text"] for m in calls[0]])
+
+            rows = list(csv.reader(io.TextIOWrapper(temp_file, encoding="utf-8", newline="")))
+            self.assertEqual("Date", rows[0][0])
+            self.assertEqual(["hello 1", "hello 2", "hello 3"], [r[6] for r in rows[1:]])
+
+            # checkpoints are removed once the export completes
+            task.perform()
+
+        self.assertIsNone(ExportCheckpoints(task).cursor)
+        self.assertFalse(default_storage.exists(MessageExportAssetStore().derive_checkpoint_path(task, "0.csv")))
+
+    def test_message_export_overlapping_groups(self):
+        self.clear_storage()
+
+        self.create_incoming_msg(self.joe, "hello 1")
+        self.create_incoming_msg(self.joe, "hello 2")
+        self.create_incoming_msg(self.kevin, "hello 3")
+
+        # joe is in both groups but his msgs should only be exported once
+        task = ExportMessagesTask.create(
+            self.org, self.admin, system_label="I", groups=(self.just_joe, self.joe_and_frank), export_format="csv"
+        )
+        temp_file, extension = task.write_export()
+
+        rows = list(csv.reader(io.TextIOWrapper(temp_file, encoding="utf-8", newline="")))
+        self.assertEqual(["hello 1", "hello 2"], [r[6] for r in rows[1:]])
+
     def test_big_ids(self):
         # create an incoming message with big id
         msg = Msg.objects.create(
@@ -478,6 +478,15 @@ class ExportForm(Form):
         ),
     )
 
+    export_format = forms.ChoiceField(
+        choices=ExportMessagesTask.FORMAT_CHOICES,
+        required=False,
+        initial=ExportMessagesTask.FORMAT_XLSX,
+        label=_("Format"),
+        help_text=_("CSV and JSON lines are recommended for very large exports"),
+        widget=SelectWidget(),
+    )
+
     def __init__(self, user, label, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = user
@@ -544,6 +553,7 @@ class MsgCRUDL(SmartCRUDL):
             groups = form.cleaned_data["groups"]
             start_date = form.cleaned_data["start_date"]
             end_date = form.cleaned_data["end_date"]
+            export_format = form.cleaned_data["export_format"] or ExportMessagesTask.FORMAT_XLSX
 
             system_label, label = (None, None) if export_all else self.derive_label()
 
@@ -568,6 +578,7 @@ class MsgCRUDL(SmartCRUDL):
                     groups=groups,
                     start_date=start_date,
                     end_date=end_date,
+                    export_format=export_format,
                 )
 
                 on_transaction_commit(lambda: export_messages_task.delay(export.id))
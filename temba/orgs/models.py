@@ -3,6 +3,7 @@ import itertools
 import logging
 import operator
 import os
+import time
 from collections import defaultdict
 from datetime import timedelta
 from decimal import Decimal
@@ -28,6 +29,8 @@ from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
 from django.db import models, transaction
 from django.db.models import Count, F, Prefetch, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.text import slugify
@@ -37,8 +40,14 @@ from temba import mailroom
 from temba.archives.models import Archive
 from temba.bundles import get_brand_bundles, get_bundle_map
 from temba.locations.models import AdminBoundary
-from temba.utils import chunk_list, json, languages
-from temba.utils.cache import get_cacheable_attr, get_cacheable_result, incrby_existing
+from temba.utils import analytics, chunk_list, json, languages, on_transaction_commit
+from temba.utils.cache import (
+    get_cacheable_many,
+    get_cacheable_result,
+    get_local_cache,
+    get_local_cache_stats,
+    incrby_existing,
+)
 from temba.utils.dates import datetime_to_str
 from temba.utils.email import send_template_email
 from temba.utils.models import JSONAsTextField, JSONField, SquashableModel
@@ -62,6 +71,9 @@ ORG_LOW_CREDIT_THRESHOLD_CACHE_KEY = "org:%d:cache:low_credits_threshold"
 ORG_LOCK_TTL = 60  # 1 minute
 ORG_CREDITS_CACHE_TTL = 7 * 24 * 60 * 60  # 1 week
 
+ORG_CACHE_REPORT_INTERVAL = 60  # seconds between reports of local cache hit ratios from each process
+_org_cache_reported_on = None
+
 
 class OrgRole(Enum):
     ADMINISTRATOR = ("A", _("Administrator"), _("Administrators"), "Administrators", "administrators", "org_admins")
@@ -123,6 +135,41 @@ class OrgCache(Enum):
 
     display = 1
     credits = 2
+    languages = 3
+    fields = 4
+
+    @property
+    def local(self):
+        """
+        Gets the process-local tier of this cache type, keyed by org id
+        """
+        OrgCache.report_hit_ratios()
+
+        return get_local_cache("org:%s" % self.name)
+
+    @classmethod
+    def get_hit_ratios(cls):
+        """
+        Gets the local tier hit ratio of each cache type which has been used in this process
+        """
+        stats = get_local_cache_stats()
+        return {c.name: stats[f"org:{c.name}"]["hit_ratio"] for c in cls if f"org:{c.name}" in stats}
+
+    @classmethod
+    def report_hit_ratios(cls):
+        """
+        Reports the local tier hit ratios of this process to analytics, at most once every ORG_CACHE_REPORT_INTERVAL
+        """
+        global _org_cache_reported_on
+
+        now = time.monotonic()
+        if _org_cache_reported_on is not None and now - _org_cache_reported_on < ORG_CACHE_REPORT_INTERVAL:
+            return
+
+        _org_cache_reported_on = now
+
+        for name, hit_ratio in cls.get_hit_ratios().items():
+            analytics.gauge("temba.org_cache_hit_ratio_%s" % name, hit_ratio)
 
 
 class Org(SmartModel):
@@ -919,7 +966,7 @@ class Org(SmartModel):
         return None
 
     def get_language_codes(self):
-        return get_cacheable_attr(self, "_language_codes", lambda: {l.iso_code for l in self.languages.all()})
+        return OrgCache.languages.local.get(self.id, lambda: frozenset(l.iso_code for l in self.languages.all()))
 
     def set_languages(self, user, iso_codes, primary):
         """
@@ -945,9 +992,6 @@ class Org(SmartModel):
         # remove any languages that are not in the new list
         self.languages.exclude(iso_code__in=iso_codes).delete()
 
-        if hasattr(self, "_language_codes"):  # invalidate language cache if set
-            delattr(self, "_language_codes")
-
     def get_datetime_formats(self):
         format_date = Org.DATE_FORMATS_PYTHON.get(self.date_format)
         format_datetime = format_date + " %H:%M"
@@ -1159,7 +1203,24 @@ class Org(SmartModel):
         """
         Gets the number of credits remaining for this org
         """
-        return self.get_credits_total() - self.get_credits_used()
+        return Org.get_credits_remaining_many([self])[self]
+
+    @classmethod
+    def get_credits_remaining_many(cls, orgs):
+        """
+        Gets the number of credits remaining for each of the given orgs, fetching all cached values in one round-trip
+        """
+        calculators = {}
+        for org in orgs:
+            calculators[ORG_CREDITS_TOTAL_CACHE_KEY % org.id] = org._calculate_credits_total
+            calculators[ORG_CREDITS_USED_CACHE_KEY % org.id] = org._calculate_credits_used
+
+        values = get_cacheable_many(list(calculators.keys()), lambda keys: {k: calculators[k]() for k in keys})
+
+        return {
+            org: int(values[ORG_CREDITS_TOTAL_CACHE_KEY % org.id]) - int(values[ORG_CREDITS_USED_CACHE_KEY % org.id])
+            for org in orgs
+        }
 
     def select_most_recent_topup(self, amount):
         """
@@ -2159,6 +2220,13 @@ class Language(SmartModel):
         return "%s" % self.name
 
 
+@receiver((post_save, post_delete), sender=Language)
+def invalidate_language_cache(sender, instance, **kwargs):
+    # wait for the change to be committed, otherwise other processes could reload the old languages before it is
+    org_id = instance.org_id
+    on_transaction_commit(lambda: OrgCache.languages.local.invalidate(org_id))
+
+
 class Invitation(SmartModel):
     """
     An Invitation to an e-mail address to join an Org with specific roles.
@@ -2468,6 +2536,8 @@ class TopUpCredits(SquashableModel):
     """
 
     SQUASH_OVER = ("topup_id",)
+    SQUASH_FIELD = "used"
+    SQUASH_BATCHED = True
 
     topup = models.ForeignKey(
         TopUp, on_delete=models.PROTECT, help_text=_("The topup these credits are being used against")
@@ -51,7 +51,7 @@ from temba.utils import dict_to_struct, json, languages
 from temba.utils.email import link_components
 
 from .context_processors import GroupPermWrapper
-from .models import CreditAlert, Invitation, Language, Org, OrgRole, TopUp, TopUpCredits
+from .models import CreditAlert, Invitation, Language, Org, OrgCache, OrgRole, TopUp, TopUpCredits
 from .tasks import resume_failed_tasks, squash_topupcredits
 
 
@@ -910,6 +910,31 @@ class OrgTest(TembaTest):
         self.assertEqual(self.org.primary_language.name, "Kinyarwanda")
         self.assertEqual(self.org.get_language_codes(), {"eng", "kin"})
 
+        # language codes are cached in process until a language is changed
+        with self.assertNumQueries(0):
+            self.assertEqual(self.org.get_language_codes(), {"eng", "kin"})
+
+        Language.create(self.org, self.admin, "French", "fra")
+        self.assertEqual(self.org.get_language_codes(), {"eng", "kin", "fra"})
+
+        # but not until that change has been committed
+        with override_settings(CELERY_ALWAYS_EAGER=False):
+            Language.create(self.org, self.admin, "Spanish", "spa")
+
+        self.assertEqual(self.org.get_language_codes(), {"eng", "kin", "fra"})
+
+        self.assertIn("languages", OrgCache.get_hit_ratios())
+
+        # hit ratios are reported to analytics, but at most once per interval
+        with patch("temba.orgs.models._org_cache_reported_on", None):
+            with patch("temba.utils.analytics.gauge") as mock_gauge:
+                self.org.get_language_codes()
+                self.org.get_language_codes()
+
+                reported = sorted(c[0][0] for c in mock_gauge.call_args_list)
+                self.assertIn("temba.org_cache_hit_ratio_languages", reported)
+                self.assertEqual(sorted(f"temba.org_cache_hit_ratio_{n}" for n in OrgCache.get_hit_ratios()), reported)
+
     def test_channel_prefixes(self):
         mtn = Channel.create(self.org, self.admin, "RW", "KN", "MTN", "5050", {"matching_prefixes": ["25078"]})
         tigo = Channel.create(self.org, self.admin, "RW", "KN", "Tigo", "5050", {"matching_prefixes": ["25072"]})
@@ -1964,7 +1964,7 @@ class OrgCRUDL(SmartCRUDL):
             return ContactGroupCount.total_for_org(obj)
 
         def get_credits(self, obj):
-            credits = obj.get_credits_remaining()
+            credits = self.credits_remaining[obj]
             return mark_safe(f'<div class="edit-org"><div class="num-credits">{format(credits, ",d")}</div></div>')
 
         def get_name(self, obj):
@@ -1996,6 +1996,10 @@ class OrgCRUDL(SmartCRUDL):
         def get_context_data(self, **kwargs):
             context = super().get_context_data(**kwargs)
             context["searches"] = ["Nyaruka"]
+
+            if "credits" in self.derive_fields():
+                self.credits_remaining = Org.get_credits_remaining_many(context["object_list"])
+
             return context
 
         def get_created_by(self, obj):  # pragma: needs cover
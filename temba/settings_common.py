@@ -84,6 +84,13 @@ AWS_BUCKET_DOMAIN = AWS_STORAGE_BUCKET_NAME + ".s3.amazonaws.com"
 # bucket where archives files are stored
 ARCHIVE_BUCKET = "dl-temba-archives"
 
+# number of archive files to download ahead when iterating over records across archives
+ARCHIVE_PREFETCH_SIZE = 4
+
+# local directory to cache decompressed archive files in (disabled if empty) and the maximum size of that cache
+ARCHIVE_CACHE_DIR = None
+ARCHIVE_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
 # -----------------------------------------------------------------------------------
 # On Unix systems, a value of None will cause Django to use the same
 # timezone as the operating system.
@@ -974,6 +981,10 @@ CELERYBEAT_SCHEDULE = {
     "update-org-activity": {"task": "update_org_activity_task", "schedule": crontab(hour=3, minute=5)},
 }
 
+# maximum number of entries and TTL in seconds of each process-local cache
+LOCAL_CACHE_MAX_SIZE = 1000
+LOCAL_CACHE_TTL = 60
+
 # Mapping of task name to task function path, used when CELERY_ALWAYS_EAGER is set to True
 CELERY_TASK_MAP = {"send_msg_task": "temba.channels.tasks.send_msg_task"}
 
@@ -1033,13 +1044,18 @@ REST_FRAMEWORK = {
     },
     "PAGE_SIZE": 250,
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
-    "DEFAULT_RENDERER_CLASSES": ("temba.api.support.DocumentationRenderer", "rest_framework.renderers.JSONRenderer"),
+    "DEFAULT_RENDERER_CLASSES": ("temba.api.support.DocumentationRenderer", "temba.api.support.FastJSONRenderer"),
     "EXCEPTION_HANDLER": "temba.api.support.temba_exception_handler",
     "UNICODE_JSON": False,
     "STRICT_JSON": False,
 }
 REST_HANDLE_EXCEPTIONS = not TESTING
 
+# whether API responses are rendered with orjson, which is an optional dependency that must be installed to enable
+# this. Output is the same except that floats which Python writes with an exponent (e.g. 1e-05) may be written
+# differently (e.g. 0.00001), and NaN and Infinity are written as null.
+API_ORJSON_RENDERING = False
+
 # -----------------------------------------------------------------------------------
 # Django Compressor configuration
 # -----------------------------------------------------------------------------------
@@ -1251,6 +1267,13 @@ FLOW_SESSION_TRIM_DAYS = 7
 # -----------------------------------------------------------------------------------
 MAILROOM_URL = None
 MAILROOM_AUTH_TOKEN = None
+MAILROOM_POOL_SIZE = 10  # max connections kept open to mailroom per process
+MAILROOM_TIMEOUT = (5, 60)  # connect and read timeouts in seconds
+MAILROOM_RETRIES = 2  # max retries of idempotent requests
+
+# starts and broadcasts with more contacts than this have their contact ids written to a Redis list which their tasks
+# reference, rather than including them in the task itself. Requires a version of mailroom which reads those lists.
+MAILROOM_INLINE_CONTACT_IDS_MAX = None
 
 # To allow manage fields to support up to 1000 fields
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 4000
@@ -1262,6 +1285,9 @@ MACHINE_HOSTNAME = socket.gethostname().split(".")[0]
 # ElasticSearch configuration (URL RFC-1738)
 ELASTICSEARCH_URL = os.environ.get("ELASTICSEARCH_URL", "http://localhost:9200")
 
+# number of sliced scrolls used in parallel to fetch the contact ids of search based exports, 1 to use a single cursor
+ELASTICSEARCH_EXPORT_SLICES = 1
+
 
 # Maximum active objects are org can have
 MAX_ACTIVE_CONTACTFIELDS_PER_ORG = 250
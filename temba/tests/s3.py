@@ -1,8 +1,22 @@
 import gzip
 import io
+import os
 from typing import Dict, List
 
 from temba.utils import chunk_list, json
+from temba.utils.s3 import SelectExpression
+
+
+def select_records(zstream, expression: str) -> List[Dict]:
+    """
+    Reads the records from a decompressed JSONL stream which match the where clause of the given S3 Select query
+    """
+    prefix = "SELECT * FROM s3object s WHERE "
+    assert expression.startswith(prefix), f"unsupported S3 Select query: {expression}"
+
+    where = SelectExpression(expression[len(prefix) :])
+    records = (json.loads(line.decode("utf-8")) for line in zstream)
+    return [r for r in records if where.matches(r)]
 
 
 class MockEventStream:
@@ -63,18 +77,54 @@ class MockS3Client:
 
         return dict(Contents=matches)
 
-    def select_object_content(self, Bucket, Key, **kwargs):
+    def select_object_content(self, Bucket, Key, Expression, **kwargs):
         stream = self.objects[(Bucket, Key)]
         stream.seek(0)
-        zstream = gzip.GzipFile(fileobj=stream)
 
-        records = []
-        while True:
-            line = zstream.readline()
-            if not line:
-                break
+        return {"Payload": MockEventStream(select_records(gzip.GzipFile(fileobj=stream), Expression))}
+
+
+class LocalS3Client(MockS3Client):
+    """
+    A stand-in for the boto S3 client which stores objects as files under a local directory, so that each call to
+    get_object returns its own file handle and the client can be shared safely between threads.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def put_jsonl(self, bucket: str, key: str, records: List[Dict]):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with gzip.open(path, "wb") as gz:
+            for record in records:
+                gz.write(json.dumps(record).encode("utf-8"))
+                gz.write(b"\n")
+
+    def get_object(self, Bucket, Key, **kwargs):
+        return {"Bucket": Bucket, "Key": Key, "Body": open(self._path(Bucket, Key), "rb")}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        os.remove(self._path(Bucket, Key))
+        return {"DeleteMarker": False, "VersionId": "versionId", "RequestCharged": "requester"}
+
+    def list_objects_v2(self, Bucket, Prefix, **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        matches = []
+        for dir_path, dir_names, file_names in os.walk(bucket_root):
+            for file_name in file_names:
+                key = os.path.relpath(os.path.join(dir_path, file_name), bucket_root)
+                if key.startswith(Prefix):
+                    matches.append({"Key": key})
+
+        return dict(Contents=matches)
 
-            # unlike real S3 we don't actually filter any records by expression
-            records.append(json.loads(line.decode("utf-8")))
+    def select_object_content(self, Bucket, Key, Expression, **kwargs):
+        with gzip.open(self._path(Bucket, Key), "rb") as zstream:
+            records = select_records(zstream, Expression)
 
         return {"Payload": MockEventStream(records)}
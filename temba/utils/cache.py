@@ -1,9 +1,22 @@
+import threading
+import time
+from collections import OrderedDict
+
 from django_redis import get_redis_connection
 
+from django.conf import settings
 from django.utils.encoding import force_text
 
 from temba.utils import json
 
+# pub/sub channel on which local cache invalidations are sent to all processes
+LOCAL_CACHE_CHANNEL = "local_cache:invalidate"
+
+# the local caches in this process by name, and our subscription to invalidations
+_local_caches = {}
+_local_listener = None
+_local_lock = threading.Lock()
+
 
 def get_cacheable(cache_key, callable, r=None, force_dirty=False):
     """
@@ -30,6 +43,37 @@ def get_cacheable_result(cache_key, callable, r=None, force_dirty=False):
     return int(get_cacheable(cache_key, callable, r=r, force_dirty=force_dirty))
 
 
+def get_cacheable_many(cache_keys, calculate, r=None, force_dirty=False):
+    """
+    Gets the cached values of multiple keys in a single round-trip. Keys which aren't cached are passed together to
+    calculate, which should return a dict of key to (value, TTL) tuples, and those are written back in one pipeline.
+    """
+    if not cache_keys:
+        return {}
+
+    if not r:
+        r = get_redis_connection()
+
+    values = {}
+    if not force_dirty:
+        for key, cached in zip(cache_keys, r.mget(cache_keys)):
+            if cached is not None:
+                values[key] = json.loads(force_text(cached))
+
+    missing = [k for k in cache_keys if k not in values]
+    if missing:
+        calculated = calculate(missing)
+
+        with r.pipeline(transaction=False) as pipe:
+            for key in missing:
+                value, cache_ttl = calculated[key]
+                pipe.set(key, json.dumps(value), ex=cache_ttl or None)
+                values[key] = value
+            pipe.execute()
+
+    return values
+
+
 def get_cacheable_attr(obj, attr_name, calculate):
     """
     Gets the result of a method call, using the given object and attribute name
@@ -64,3 +108,116 @@ def incrby_existing(key, delta, r=None):
         "end"
     )
     r.eval(lua, 1, key, delta)
+
+
+class LocalCache:
+    """
+    Process-local LRU cache with a maximum size and TTL, which sits in front of the database or Redis for values which
+    are read often and change rarely. Invalidations are published via Redis so that they reach all processes.
+    """
+
+    def __init__(self, name, max_size, ttl):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, calculate):
+        """
+        Gets the value for the given key, calling calculate if it isn't cached or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            version = self._version
+
+        value = calculate()
+
+        with self._lock:
+            # don't store the value if there was an invalidation while we were calculating it
+            if version == self._version:
+                self._entries[key] = (value, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        return value
+
+    def invalidate(self, key):
+        """
+        Invalidates the given key in this process and publishes the invalidation to all other processes
+        """
+        self.discard(key)
+
+        get_redis_connection().publish(LOCAL_CACHE_CHANNEL, json.dumps({"cache": self.name, "key": key}))
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._version += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version += 1
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def get_local_cache(name):
+    """
+    Gets the local cache with the given name, creating it if necessary
+    """
+    with _local_lock:
+        cache = _local_caches.get(name)
+        if not cache:
+            cache = LocalCache(name, settings.LOCAL_CACHE_MAX_SIZE, settings.LOCAL_CACHE_TTL)
+            _local_caches[name] = cache
+
+        _subscribe_local_invalidations()
+
+    return cache
+
+
+def get_local_cache_stats():
+    """
+    Gets the hits, misses and hit ratio of each local cache in this process
+    """
+    return {
+        name: {"hits": c.hits, "misses": c.misses, "hit_ratio": c.hit_ratio}
+        for name, c in sorted(_local_caches.items())
+    }
+
+
+def _subscribe_local_invalidations():
+    """
+    Subscribes this process to local cache invalidations. This is done on first use rather than at startup so that
+    forked worker processes get their own subscriptions.
+    """
+    global _local_listener
+
+    if _local_listener is None or not _local_listener.is_alive():
+        pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{LOCAL_CACHE_CHANNEL: _on_local_invalidation})
+        _local_listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+def _on_local_invalidation(message):
+    invalidation = json.loads(force_text(message["data"]))
+    cache = _local_caches.get(invalidation["cache"])
+    if cache:
+        cache.discard(invalidation["key"])
@@ -1,12 +1,19 @@
+import csv
 import gc
+import gzip
+import io
 import logging
 import os
+import shutil
 import time
 from datetime import datetime, timedelta
 
 from xlsxlite.writer import XLSXBook
 
+from django.conf import settings
 from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.temp import NamedTemporaryFile
 from django.db import models
 from django.utils import timezone
@@ -14,7 +21,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from temba.assets.models import BaseAssetStore, get_asset_store
 
-from . import analytics
+from . import analytics, json
 from .email import send_template_email
 from .models import TembaModel
 from .text import clean_string
@@ -26,6 +33,13 @@ class BaseExportAssetStore(BaseAssetStore):
     def is_asset_ready(self, asset):
         return asset.status == BaseExportTask.STATUS_COMPLETE
 
+    def derive_checkpoint_path(self, asset, name):
+        """
+        Derives the storage path of a checkpoint file of an export, e.g. 'orgs/1/message_exports/asdf-asdf_parts/0.csv'
+        """
+        directory = os.path.join(settings.STORAGE_ROOT_DIR, str(asset.org_id), self.directory)
+        return f"{directory}/{asset.uuid}_parts/{name}"
+
 
 class BaseExportTask(TembaModel):
     """
@@ -42,6 +56,15 @@ class BaseExportTask(TembaModel):
     WIDTH_MEDIUM = 20
     WIDTH_LARGE = 100
 
+    FORMAT_XLSX = "xlsx"
+    FORMAT_CSV = "csv"
+    FORMAT_JSONL = "jsonl"
+    FORMAT_CHOICES = (
+        (FORMAT_XLSX, _("Excel Spreadsheet")),
+        (FORMAT_CSV, _("CSV")),
+        (FORMAT_JSONL, _("JSON Lines (gzipped)")),
+    )
+
     STATUS_PENDING = "P"
     STATUS_PROCESSING = "O"
     STATUS_COMPLETE = "C"
@@ -56,6 +79,12 @@ class BaseExportTask(TembaModel):
     # log progress after this number of exported objects have been exported
     LOG_PROGRESS_PER_ROWS = 10000
 
+    # streaming exports save a checkpoint after this number of rows have been written since the last one
+    CHECKPOINT_PER_ROWS = 100000
+
+    # an export which fails after saving checkpoints is left to be requeued and resumed up to this number of times
+    CHECKPOINT_MAX_RESUMES = 3
+
     org = models.ForeignKey(
         "orgs.Org", on_delete=models.PROTECT, related_name="%(class)ss", help_text=_("The organization of the user.")
     )
@@ -97,12 +126,20 @@ class BaseExportTask(TembaModel):
 
         except Exception as e:
             logger.error(f"Unable to perform export: {str(e)}", exc_info=True)
-            self.update_status(self.STATUS_FAILED)
-            print(f"Failed to complete {self.analytics_key} with ID {self.id}")
+
+            # if we have checkpoints then leave this export as processing so that it's resumed from them when requeued
+            checkpoints = ExportCheckpoints(self)
+            if checkpoints.num_rows and checkpoints.record_failure() <= self.CHECKPOINT_MAX_RESUMES:
+                print(f"Interrupted {self.analytics_key} with ID {self.id} after {checkpoints.num_rows} rows")
+            else:
+                self.update_status(self.STATUS_FAILED)
+                checkpoints.clear()
+                print(f"Failed to complete {self.analytics_key} with ID {self.id}")
 
             raise e  # log the error to sentry
         else:
             self.update_status(self.STATUS_COMPLETE)
+            ExportCheckpoints(self).clear()
             elapsed = time.time() - start
             print(f"Completed {self.analytics_key} with ID {self.id} in {elapsed:.1f} seconds")
             analytics.track(
@@ -219,3 +256,214 @@ class TableExporter(object):
         temp_file.flush()
 
         return temp_file, "xlsx"
+
+
+class StreamingExporter:
+    """
+    Base class for exporters which write each row straight to a temporary file rather than building the whole
+    workbook in memory, so memory usage stays flat regardless of the number of rows exported.
+    """
+
+    extension = None
+
+    def __init__(self, task, columns, header=True):
+        self.task = task
+        self.columns = columns
+        self.num_rows = 0
+
+        self._open(header)
+
+    def _open(self, header):
+        self.temp_file = NamedTemporaryFile(delete=True, suffix=f".{self.extension}", mode="wb+")
+
+    def write_row(self, values):
+        self._write(values)
+        self.num_rows += 1
+
+    def _write(self, values):  # pragma: no cover
+        pass
+
+    def cut_part(self):
+        """
+        Finishes the file written so far and returns it, and starts a new file for subsequent rows. Concatenating the
+        parts gives the same file as if it had been written in one go.
+        """
+        part, _ = self.save_file()
+        self._open(header=False)
+        return part
+
+    def save_file(self):
+        """
+        Flushes the temporary file and returns it along with the extension
+        """
+        self.temp_file.flush()
+        self.temp_file.seek(0)
+
+        return self.temp_file, self.extension
+
+
+class CSVExporter(StreamingExporter):
+    """
+    Streams rows to a UTF-8 encoded CSV file
+    """
+
+    extension = "csv"
+
+    def _open(self, header):
+        super()._open(header)
+
+        self.stream = io.TextIOWrapper(self.temp_file, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.stream)
+
+        if header:
+            self.writer.writerow(self.columns)
+
+    def _write(self, values):
+        self.writer.writerow([self.task.prepare_value(v) for v in values])
+
+    def save_file(self):
+        self.stream.flush()
+        self.stream.detach()  # so closing the wrapper doesn't close our temp file
+
+        return super().save_file()
+
+
+class JSONLExporter(StreamingExporter):
+    """
+    Streams rows as JSON objects, one per line, to a gzipped file. Columns are used as the keys of each object.
+    """
+
+    extension = "jsonl.gz"
+
+    def _open(self, header):
+        super()._open(header)
+
+        # each part is a complete gzip member, and concatenated members are themselves a valid gzip file
+        self.stream = gzip.GzipFile(fileobj=self.temp_file, mode="wb")
+
+    def _write(self, values):
+        record = {c: v for c, v in zip(self.columns, values)}
+        self.stream.write(json.dumps(record).encode("utf-8"))
+        self.stream.write(b"\n")
+
+    def save_file(self):
+        self.stream.close()  # writes gzip trailer but doesn't close the underlying file
+
+        return super().save_file()
+
+
+STREAMING_EXPORTERS = {BaseExportTask.FORMAT_CSV: CSVExporter, BaseExportTask.FORMAT_JSONL: JSONLExporter}
+
+
+class ExportCheckpoints:
+    """
+    Checkpoints of a streaming export, so that an export which is interrupted, e.g. by its worker being killed, can be
+    resumed when it is requeued rather than starting over. Each checkpoint saves the rows written since the previous
+    one as a part file in the asset store, along with a state file recording the parts saved so far and the cursor to
+    resume from, which is whatever the export needs to continue after the last row in those parts.
+    """
+
+    STATE_FILE = "state.json"
+
+    def __init__(self, task):
+        self.task = task
+        self.store = get_asset_store(model=task.__class__)
+
+        self.state = {"parts": [], "num_rows": 0, "cursor": None, "failures": 0}
+
+        state_path = self._path(self.STATE_FILE)
+        if default_storage.exists(state_path):
+            with default_storage.open(state_path) as f:
+                self.state = json.loads(f.read())
+
+        # rows already saved when we started, and the number written by this run's exporter as of the last checkpoint
+        self._resumed_rows = self.state["num_rows"]
+        self._exporter_rows = 0
+
+    @property
+    def cursor(self):
+        return self.state["cursor"]
+
+    @property
+    def num_rows(self) -> int:
+        return self.state["num_rows"]
+
+    def _path(self, name):
+        return self.store.derive_checkpoint_path(self.task, name)
+
+    def is_due(self, exporter) -> bool:
+        """
+        Whether enough rows have been written by the given exporter since the last checkpoint to save a new one
+        """
+        return exporter.num_rows - self._exporter_rows >= self.task.CHECKPOINT_PER_ROWS
+
+    def save(self, exporter, cursor):
+        """
+        Saves the rows written by the given exporter since the last checkpoint as a new part
+        """
+        name = f"{len(self.state['parts'])}.{exporter.extension}"
+        part = exporter.cut_part()
+
+        self._save_file(name, File(part))
+        part.close()
+
+        self._exporter_rows = exporter.num_rows
+        self.state = {
+            "parts": self.state["parts"] + [name],
+            "num_rows": self._resumed_rows + exporter.num_rows,
+            "cursor": cursor,
+            "failures": self.state.get("failures", 0),
+        }
+
+        # the state is only updated once its part is saved, so a checkpoint is never partially applied
+        self._save_file(self.STATE_FILE, ContentFile(json.dumps(self.state).encode("utf-8")))
+
+        logger.info(f"Saved checkpoint {name} of {self.task.analytics_key} #{self.task.id} at {self.num_rows} rows")
+
+    def record_failure(self) -> int:
+        """
+        Records that the export failed after its last checkpoint, returning how many times that has now happened
+        """
+        self.state["failures"] = self.state.get("failures", 0) + 1
+        self._save_file(self.STATE_FILE, ContentFile(json.dumps(self.state).encode("utf-8")))
+
+        return self.state["failures"]
+
+    def _save_file(self, name, content):
+        """
+        Saves a checkpoint file, replacing any existing file with that name, e.g. a part saved by a previous run that
+        was interrupted before its state was updated, as otherwise storage would save it under a different name
+        """
+        path = self._path(name)
+        default_storage.delete(path)
+        default_storage.save(path, content)
+
+    def assemble(self, exporter):
+        """
+        Assembles the final file from the saved parts followed by whatever the exporter has written since
+        """
+        last, extension = exporter.save_file()
+
+        if not self.state["parts"]:
+            return last, extension
+
+        temp_file = NamedTemporaryFile(delete=True, suffix=f".{extension}", mode="wb+")
+        for name in self.state["parts"]:
+            with default_storage.open(self._path(name)) as part:
+                shutil.copyfileobj(part, temp_file)
+
+        shutil.copyfileobj(last, temp_file)
+        last.close()
+
+        temp_file.flush()
+        temp_file.seek(0)
+        return temp_file, extension
+
+    def clear(self):
+        """
+        Removes all checkpoint files of this export
+        """
+        for name in self.state["parts"] + [self.STATE_FILE]:
+            default_storage.delete(self._path(name))
+
+        self.state = {"parts": [], "num_rows": 0, "cursor": None, "failures": 0}
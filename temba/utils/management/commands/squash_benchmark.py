@@ -0,0 +1,66 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from temba.utils.models import SquashableModel
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks batched squashing against squashing one set at a time, using copies of existing count rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("models", nargs="*", metavar="MODEL", help="squashable models, e.g. flows.FlowPathCount")
+        parser.add_argument(
+            "--copies", type=int, action="store", dest="copies", default=3, help="unsquashed copies of each row"
+        )
+
+    def handle(self, models, copies, *args, **options):
+        if models:
+            classes = [apps.get_model(m) for m in models]
+        else:
+            classes = [m for m in apps.get_models() if issubclass(m, SquashableModel)]
+
+        for model in classes:
+            if not issubclass(model, SquashableModel):
+                raise CommandError(f"{model.__name__} is not a squashable model")
+
+            times = {}
+            for batched in (False, True):
+                times[batched] = self.run_squash(model, copies, batched)
+
+            (per_set_sets, per_set_time), (batched_sets, batched_time) = times[False], times[True]
+
+            self.stdout.write(
+                f"{model.__name__}: per-set {per_set_sets} sets in {per_set_time:.3f}s, "
+                f"batched {batched_sets} sets in {batched_time:.3f}s "
+                f"({per_set_time / batched_time if batched_time else 0:.1f}x)"
+            )
+
+    def run_squash(self, model, copies: int, batched: bool):
+        """
+        Inserts copies of existing rows as unsquashed deltas, squashes them and then rolls everything back
+        """
+        with transaction.atomic():
+            self.add_deltas(model, copies)
+
+            start = time.perf_counter()
+            num_sets = model.squash(batched=batched)
+            time_taken = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+
+        return num_sets, time_taken
+
+    def add_deltas(self, model, copies: int):
+        cols = [model._meta.get_field(f).column for f in model.SQUASH_OVER + model.SQUASH_CARRY]
+        cols = ", ".join(f'"{c}"' for c in cols + [model.SQUASH_FIELD])
+        table = model._meta.db_table
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table}({cols}, "is_squashed") '
+                f"SELECT {cols}, FALSE FROM {table}, generate_series(1, %s)",
+                (copies,),
+            )
@@ -1,6 +1,8 @@
+import operator
 import time
 import types
 from collections import OrderedDict
+from functools import reduce
 
 from smartmin.models import SmartModel
 
@@ -8,10 +10,11 @@ from django.contrib.postgres.fields import HStoreField, JSONField as DjangoJSONF
 from django.core import checks
 from django.core.exceptions import ValidationError
 from django.db import connection, models
+from django.db.models import Q
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
-from temba.utils import json, uuid
+from temba.utils import analytics, json, uuid
 
 
 def generate_uuid():
@@ -106,6 +109,97 @@ class IDSliceQuerySet(models.query.RawQuerySet):
         return IDSliceQuerySet(self.model, ids, offset=0, total=len(ids))
 
 
+class KeysetIterator:
+    """
+    Iterates over a queryset in batches using keyset pagination, i.e. each batch is fetched as the rows which come
+    after the last key of the previous batch in the given ordering, e.g. (created_on, id). Unlike materializing all
+    matching ids up front, memory usage is bounded by the batch size and each query is cheap regardless of how deep
+    into the results we are.
+
+    Keys must be fields of the model and unique when taken together, so the last key should normally be id. Keys can
+    be prefixed with - to iterate in descending order. Nullable keys are supported and are assumed to sort as they do
+    by default in PostgreSQL, i.e. last when ascending and first when descending.
+    """
+
+    def __init__(
+        self, queryset, keys=("created_on", "id"), batch_size=1000, after=None, select_related=(), prefetch_related=()
+    ):
+        self.queryset = queryset
+        self.keys = tuple(keys)
+        self.batch_size = batch_size
+        self.select_related = select_related
+        self.prefetch_related = prefetch_related
+
+        # the key of the last object returned, which can be used to resume iteration from that point
+        self.last_key = tuple(after) if after else None
+
+    def get_key(self, obj) -> tuple:
+        return tuple(getattr(obj, k.lstrip("-")) for k in self.keys)
+
+    def _is_nullable(self, key: str) -> bool:
+        return self.queryset.model._meta.get_field(key).null
+
+    def _after(self, values):
+        """
+        Builds a filter for rows whose keys come after the given key values
+        """
+        terms = []
+        equal_so_far = []
+
+        for key, value in zip(self.keys, values):
+            descending = key.startswith("-")
+            key = key.lstrip("-")
+
+            if value is not None:
+                # nulls sort first when descending so never come after a value
+                if descending:
+                    after = Q(**{f"{key}__lt": value})
+                else:
+                    after = Q(**{f"{key}__gt": value})
+                    if self._is_nullable(key):
+                        after |= Q(**{f"{key}__isnull": True})
+
+                terms.append(reduce(operator.and_, equal_so_far + [after]))
+
+            # but every value comes after null when descending
+            elif descending:
+                terms.append(reduce(operator.and_, equal_so_far + [Q(**{f"{key}__isnull": False})]))
+
+            equal_so_far.append(Q(**{f"{key}__isnull": True}) if value is None else Q(**{key: value}))
+
+        condition = reduce(operator.or_, terms)
+
+        # give the planner a simple range it can use an index for
+        first_key = self.keys[0].lstrip("-")
+        if values[0] is not None and not self._is_nullable(first_key):
+            lookup = "lte" if self.keys[0].startswith("-") else "gte"
+            condition &= Q(**{f"{first_key}__{lookup}": values[0]})
+
+        return condition
+
+    def __iter__(self):
+        queryset = self.queryset.order_by(*self.keys)
+
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+
+        while True:
+            page = queryset.filter(self._after(self.last_key)) if self.last_key else queryset
+            batch = list(page[: self.batch_size])
+
+            if not batch:
+                return
+
+            self.last_key = self.get_key(batch[-1])
+
+            yield batch
+
+            if len(batch) < self.batch_size:
+                return
+
+
 def mapEStoDB(model, es_queryset, only_ids=False):  # pragma: no cover
     """
     Map ElasticSearch results to Django Model objects
@@ -290,6 +384,23 @@ class SquashableModel(models.Model):
 
     SQUASH_OVER = None
 
+    # the field which holds the delta values being squashed
+    SQUASH_FIELD = "count"
+
+    # other fields which are copied from the squashed rows to the new row, e.g. a flow_id which depends on a node_uuid
+    SQUASH_CARRY = ()
+
+    # maximum number of distinct sets squashed in each call to squash
+    SQUASH_LIMIT = 5000
+
+    # whether squash defaults to a single statement for all sets rather than get_squash_query for each set, which a
+    # model should only enable if its get_squash_query does nothing more than sum the rows of each set
+    SQUASH_BATCHED = False
+
+    # maximum number of rows removed by a batched squash, unsquashed rows first, with any other rows of its sets left
+    # for the next squash
+    SQUASH_BATCH_MAX_ROWS = 50000
+
     id = models.BigAutoField(auto_created=True, primary_key=True, verbose_name="ID")
 
     is_squashed = models.BooleanField(default=False, help_text=_("Whether this row was created by squashing"))
@@ -299,21 +410,82 @@ class SquashableModel(models.Model):
         return cls.objects.filter(is_squashed=False)
 
     @classmethod
-    def squash(cls):
+    def get_squash_batch_query(cls, limit):
+        """
+        Gets the query which squashes up to limit distinct sets in a single statement, by deleting up to
+        SQUASH_BATCH_MAX_ROWS rows for those sets and inserting one new row per set with the summed delta
+        """
+        over = [cls._meta.get_field(f) for f in cls.SQUASH_OVER]
+        carry = [cls._meta.get_field(f).column for f in cls.SQUASH_CARRY]
+
+        # nullable columns need a null-safe comparison so that null sets are matched
+        match = " AND ".join(
+            ('t."%(col)s" IS NOT DISTINCT FROM s."%(col)s"' if f.null else 't."%(col)s" = s."%(col)s"')
+            % {"col": f.column}
+            for f in over
+        )
+
+        sql = """
+        WITH sets AS (
+            SELECT DISTINCT %(over)s FROM %(table)s WHERE "is_squashed" = FALSE LIMIT %%s
+        ), capped AS (
+            SELECT t."id" FROM %(table)s t INNER JOIN sets s ON %(match)s ORDER BY t."is_squashed" LIMIT %%s
+        ), removed AS (
+            DELETE FROM %(table)s t USING capped c WHERE t."id" = c."id" RETURNING %(returning)s
+        )
+        INSERT INTO %(table)s(%(over)s%(carry)s, "%(field)s", "is_squashed")
+        SELECT %(over)s%(carry_agg)s, GREATEST(0, SUM("%(field)s")), TRUE FROM removed GROUP BY %(over)s;
+        """ % {
+            "table": cls._meta.db_table,
+            "over": ", ".join('"%s"' % f.column for f in over),
+            "carry": "".join(', "%s"' % c for c in carry),
+            "carry_agg": "".join(', MAX("%s")' % c for c in carry),
+            "field": cls.SQUASH_FIELD,
+            "match": match,
+            "returning": ", ".join('t."%s"' % c for c in [f.column for f in over] + carry + [cls.SQUASH_FIELD]),
+        }
+
+        return sql, (limit, cls.SQUASH_BATCH_MAX_ROWS)
+
+    @classmethod
+    def squash(cls, batched=None):
+        """
+        Squashes up to SQUASH_LIMIT distinct sets, either in a single statement or one statement per set, and returns
+        the number of sets squashed
+        """
+        if batched is None:
+            batched = cls.SQUASH_BATCHED
+
         start = time.time()
-        num_sets = 0
 
-        for distinct_set in cls.get_unsquashed().order_by(*cls.SQUASH_OVER).distinct(*cls.SQUASH_OVER)[:5000]:
-            with connection.cursor() as cursor:
-                sql, params = cls.get_squash_query(distinct_set)
+        with connection.cursor() as cursor:
+            if batched:
+                sql, params = cls.get_squash_batch_query(cls.SQUASH_LIMIT)
 
                 cursor.execute(sql, params)
 
-            num_sets += 1
+                num_sets = cursor.rowcount
+            else:
+                num_sets = 0
+
+                for distinct_set in (
+                    cls.get_unsquashed().order_by(*cls.SQUASH_OVER).distinct(*cls.SQUASH_OVER)[: cls.SQUASH_LIMIT]
+                ):
+                    sql, params = cls.get_squash_query(distinct_set)
+
+                    cursor.execute(sql, params)
+
+                    num_sets += 1
 
         time_taken = time.time() - start
+        rate = num_sets / time_taken if time_taken else 0
+
+        print("Squashed %d distinct sets of %s in %0.3fs (%d sets/s)" % (num_sets, cls.__name__, time_taken, rate))
+
+        if num_sets:
+            analytics.gauge("temba.squash_rate_%s" % cls.__name__.lower(), rate)
 
-        print("Squashed %d distinct sets of %s in %0.3fs" % (num_sets, cls.__name__, time_taken))
+        return num_sets
 
     class Meta:
         abstract = True
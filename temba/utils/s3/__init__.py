@@ -1 +1,2 @@
 from .s3 import *  # noqa
+from .select import SelectExpression, select_in, select_literal  # noqa
@@ -23,6 +23,13 @@ class EventStreamReader:
         self.buffer = bytearray()
 
     def __iter__(self) -> Iterable[Dict]:
+        for line in self.iter_lines():
+            yield json.loads(line.decode("utf-8"))
+
+    def iter_lines(self) -> Iterable[bytes]:
+        """
+        Iterates over the raw JSONL lines without decoding them
+        """
         for event in self.event_stream:
             if "Records" in event:
                 self.buffer.extend(event["Records"]["Payload"])
@@ -33,6 +40,7 @@ class EventStreamReader:
                 if not lines[-1].endswith(b"\n"):
                     self.buffer = bytearray(lines[-1])
                     lines = lines[:-1]
+                else:
+                    self.buffer = bytearray()
 
-                for line in lines:
-                    yield json.loads(line.decode("utf-8"))
+                yield from lines
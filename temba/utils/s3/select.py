@@ -0,0 +1,223 @@
+import re
+from datetime import datetime
+from typing import Any, Dict
+
+import iso8601
+
+TOKEN_REGEX = re.compile(
+    r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<number>-?\d+(?:\.\d+)?)|(?P<op><=|>=|<>|!=|=|<|>)"
+    r"|(?P<punct>[(),])|(?P<path>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*))"
+)
+
+KEYWORDS = {"AND", "OR", "NOT", "IN", "IS", "NULL", "TRUE", "FALSE", "CAST", "AS", "TIMESTAMP"}
+
+
+def select_literal(value) -> str:
+    """
+    Formats a Python value as a literal in an S3 Select SQL expression
+    """
+    if value is None:
+        return "NULL"
+    elif isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    elif isinstance(value, (int, float)):
+        return str(value)
+    elif isinstance(value, datetime):
+        return f"CAST('{value.isoformat()}' AS TIMESTAMP)"
+    else:
+        return "'" + str(value).replace("'", "''") + "'"
+
+
+def select_in(field: str, values) -> str:
+    """
+    Formats an IN condition for the given field and values
+    """
+    return f"{field} IN ({', '.join(select_literal(v) for v in values)})"
+
+
+class SelectExpression:
+    """
+    Evaluates the subset of S3 Select SQL that we generate against records locally, i.e. without S3. Supports field
+    paths like s.contact.uuid, string, number, boolean and null literals, CAST(... AS TIMESTAMP), comparisons, IN,
+    IS [NOT] NULL, NOT, AND, OR and parentheses.
+    """
+
+    class Error(Exception):
+        pass
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = self._tokenize(expression)
+        self.pos = 0
+        self.tree = self._parse_or()
+
+        if self.pos < len(self.tokens):
+            raise self.Error(f"unexpected token '{self.tokens[self.pos][1]}' in: {expression}")
+
+    def matches(self, record: Dict) -> bool:
+        return self._eval(self.tree, record) is True
+
+    @classmethod
+    def _tokenize(cls, expression: str):
+        tokens = []
+        pos = 0
+        expression = expression.rstrip()
+
+        while pos < len(expression):
+            match = TOKEN_REGEX.match(expression, pos)
+            if not match:
+                raise cls.Error(f"unable to parse at position {pos}: {expression}")
+
+            kind, text = match.lastgroup, match.group(match.lastgroup)
+            if kind == "path" and text.upper() in KEYWORDS:
+                kind, text = "keyword", text.upper()
+
+            tokens.append((kind, text))
+            pos = match.end()
+
+        return tokens
+
+    def _peek(self, kind: str = None, text: str = None) -> bool:
+        if self.pos >= len(self.tokens):
+            return False
+        token_kind, token_text = self.tokens[self.pos]
+        return (kind is None or token_kind == kind) and (text is None or token_text == text)
+
+    def _next(self, kind: str = None, text: str = None) -> str:
+        if not self._peek(kind, text):
+            found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else "end of expression"
+            raise self.Error(f"expected {text or kind} but found '{found}' in: {self.expression}")
+
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def _parse_or(self):
+        node = self._parse_and()
+        while self._peek("keyword", "OR"):
+            self._next()
+            node = ("or", node, self._parse_and())
+        return node
+
+    def _parse_and(self):
+        node = self._parse_not()
+        while self._peek("keyword", "AND"):
+            self._next()
+            node = ("and", node, self._parse_not())
+        return node
+
+    def _parse_not(self):
+        if self._peek("keyword", "NOT"):
+            self._next()
+            return ("not", self._parse_not())
+        return self._parse_comparison()
+
+    def _parse_comparison(self):
+        if self._peek("punct", "("):
+            self._next()
+            node = self._parse_or()
+            self._next("punct", ")")
+            return node
+
+        left = self._parse_operand()
+
+        if self._peek("op"):
+            op = self._next()
+            return ("cmp", op, left, self._parse_operand())
+        elif self._peek("keyword", "IN"):
+            self._next()
+            self._next("punct", "(")
+            values = [self._parse_operand()]
+            while self._peek("punct", ","):
+                self._next()
+                values.append(self._parse_operand())
+            self._next("punct", ")")
+            return ("in", left, values)
+        elif self._peek("keyword", "IS"):
+            self._next()
+            negated = self._peek("keyword", "NOT")
+            if negated:
+                self._next()
+            self._next("keyword", "NULL")
+            return ("not", ("isnull", left)) if negated else ("isnull", left)
+
+        return ("truthy", left)
+
+    def _parse_operand(self):
+        if self._peek("string"):
+            return ("literal", self._next()[1:-1].replace("''", "'"))
+        elif self._peek("number"):
+            text = self._next()
+            return ("literal", float(text) if "." in text else int(text))
+        elif self._peek("keyword", "TRUE") or self._peek("keyword", "FALSE"):
+            return ("literal", self._next() == "TRUE")
+        elif self._peek("keyword", "NULL"):
+            self._next()
+            return ("literal", None)
+        elif self._peek("keyword", "CAST"):
+            self._next()
+            self._next("punct", "(")
+            operand = self._parse_operand()
+            self._next("keyword", "AS")
+            self._next("keyword", "TIMESTAMP")
+            self._next("punct", ")")
+            return ("timestamp", operand)
+        elif self._peek("path"):
+            parts = self._next().split(".")
+            if len(parts) < 2 or parts[0] != "s":
+                raise self.Error(f"field paths must start with s. in: {self.expression}")
+            return ("path", parts[1:])
+
+        found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else "end of expression"
+        raise self.Error(f"expected operand but found '{found}' in: {self.expression}")
+
+    def _eval(self, node, record: Dict) -> Any:
+        kind = node[0]
+
+        if kind == "or":
+            return self._eval(node[1], record) is True or self._eval(node[2], record) is True
+        elif kind == "and":
+            return self._eval(node[1], record) is True and self._eval(node[2], record) is True
+        elif kind == "not":
+            return self._eval(node[1], record) is not True
+        elif kind == "isnull":
+            return self._eval(node[1], record) is None
+        elif kind == "truthy":
+            return self._eval(node[1], record) is True
+        elif kind == "in":
+            value = self._eval(node[1], record)
+            return value is not None and value in [self._eval(v, record) for v in node[2]]
+        elif kind == "cmp":
+            return self._compare(node[1], self._eval(node[2], record), self._eval(node[3], record))
+        elif kind == "literal":
+            return node[1]
+        elif kind == "timestamp":
+            value = self._eval(node[1], record)
+            return iso8601.parse_date(value) if isinstance(value, str) else value
+        elif kind == "path":
+            value = record
+            for part in node[1]:
+                value = value.get(part) if isinstance(value, dict) else None
+            return value
+
+    @staticmethod
+    def _compare(op: str, left, right) -> bool:
+        # like SQL, comparisons with null are never true
+        if left is None or right is None:
+            return False
+
+        if op == "=":
+            return left == right
+        elif op in ("!=", "<>"):
+            return left != right
+
+        try:
+            if op == "<":
+                return left < right
+            elif op == "<=":
+                return left <= right
+            elif op == ">":
+                return left > right
+            else:
+                return left >= right
+        except TypeError:  # values of different types can't be ordered
+            return False
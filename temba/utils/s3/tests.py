@@ -1,7 +1,12 @@
+from datetime import datetime
+
+import pytz
+
 from temba.tests import TembaTest
 from temba.tests.s3 import MockEventStream
 
 from .s3 import EventStreamReader
+from .select import SelectExpression, select_in, select_literal
 
 
 class EventStreamReaderTest(TembaTest):
@@ -25,3 +30,62 @@ class EventStreamReaderTest(TembaTest):
 
         buffer = EventStreamReader(stream)
         self.assertEqual([{"id": 1, "text": "Hi"}, {"id": 2, "text": "Hi"}, {"id": 3, "text": "Hi"}], list(buffer))
+
+        # payloads which end exactly on a record boundary
+        stream = MockEventStream(records=[{"id": 1}, {"id": 2}], max_payload_size=10)
+
+        buffer = EventStreamReader(stream)
+        self.assertEqual([{"id": 1}, {"id": 2}], list(buffer))
+
+        stream = MockEventStream(records=[{"id": 1}, {"id": 2}], max_payload_size=10)
+        self.assertEqual([b'{"id": 1}\n', b'{"id": 2}\n'], list(EventStreamReader(stream).iter_lines()))
+
+
+class SelectExpressionTest(TembaTest):
+    def test_literals(self):
+        self.assertEqual("NULL", select_literal(None))
+        self.assertEqual("TRUE", select_literal(True))
+        self.assertEqual("12", select_literal(12))
+        self.assertEqual("'it''s'", select_literal("it's"))
+        self.assertEqual(
+            "CAST('2020-08-01T10:00:00+00:00' AS TIMESTAMP)",
+            select_literal(datetime(2020, 8, 1, 10, 0, 0, 0, pytz.UTC)),
+        )
+        self.assertEqual("s.status IN ('sent', 'delivered')", select_in("s.status", ["sent", "delivered"]))
+
+    def test_matches(self):
+        record = {
+            "id": 12,
+            "direction": "in",
+            "status": "handled",
+            "contact": {"uuid": "6393abc0-283d-4c9b-a1b3-641a035c34bf", "name": "O'Neil"},
+            "responded": True,
+            "channel": None,
+            "created_on": "2020-08-01T10:00:00.123456+00:00",
+        }
+
+        def assert_matches(expression, expected):
+            self.assertEqual(expected, SelectExpression(expression).matches(record), f"mismatch for: {expression}")
+
+        assert_matches("s.direction = 'in'", True)
+        assert_matches("s.direction = 'out'", False)
+        assert_matches("s.direction != 'out'", True)
+        assert_matches("s.direction <> 'in'", False)
+        assert_matches("s.id > 10 AND s.id <= 12", True)
+        assert_matches("s.id < 10 OR s.status IN ('handled', 'sent')", True)
+        assert_matches("s.status IN ('sent', 'delivered')", False)
+        assert_matches("s.contact.uuid = '6393abc0-283d-4c9b-a1b3-641a035c34bf'", True)
+        assert_matches("s.contact.name = 'O''Neil'", True)
+        assert_matches("s.responded = TRUE", True)
+        assert_matches("s.responded", True)
+        assert_matches("NOT s.responded", False)
+        assert_matches("s.channel IS NULL AND s.status IS NOT NULL", True)
+        assert_matches("s.channel.name = 'Twilio'", False)  # nulls never compare
+        assert_matches("s.missing = 'x' OR NOT (s.id = 12 AND s.direction = 'in')", False)
+        assert_matches("CAST(s.created_on AS TIMESTAMP) >= CAST('2020-08-01T10:00:00Z' AS TIMESTAMP)", True)
+        assert_matches("CAST(s.created_on AS TIMESTAMP) < CAST('2020-08-01T12:00:00+02:00' AS TIMESTAMP)", False)
+        assert_matches("s.direction > 3", False)  # can't order different types
+
+        for invalid in ("s.direction =", "direction = 'in'", "s.id = 1 2", "s.id IN (1, 2", "s.id ~ 1"):
+            with self.assertRaises(SelectExpression.Error):
+                SelectExpression(invalid)
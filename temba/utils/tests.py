@@ -2,6 +2,7 @@ import copy
 import datetime
 import io
 import os
+import time
 from collections import OrderedDict
 from decimal import Decimal
 from types import SimpleNamespace
@@ -18,7 +19,7 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import checks
 from django.core.management import CommandError, call_command
-from django.db import connection, models
+from django.db import connection, models, transaction
 from django.forms import ValidationError
 from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
@@ -27,9 +28,19 @@ from django.utils import timezone, translation
 from celery.app.task import Task
 
 import temba.utils.analytics
+from temba.channels.models import ChannelCount
 from temba.contacts.models import Contact, ContactField, ContactGroup, ContactGroupCount, ExportContactsTask
-from temba.flows.models import FlowRun
-from temba.orgs.models import Org, UserSettings
+from temba.flows.models import (
+    FlowCategoryCount,
+    FlowNodeCount,
+    FlowPathCount,
+    FlowRun,
+    FlowRunCount,
+    FlowStart,
+    FlowStartCount,
+)
+from temba.msgs.models import BroadcastMsgCount, LabelCount, SystemLabelCount
+from temba.orgs.models import Org, TopUpCredits, UserSettings
 from temba.tests import ESMockWithScroll, TembaTest, matchers
 from temba.utils import json, uuid
 from temba.utils.json import TembaJsonAdapter
@@ -44,7 +55,16 @@ from . import (
     sizeof_fmt,
     str_to_bool,
 )
-from .cache import get_cacheable_attr, get_cacheable_result, incrby_existing
+from .cache import (
+    LOCAL_CACHE_CHANNEL,
+    LocalCache,
+    get_cacheable_attr,
+    get_cacheable_many,
+    get_cacheable_result,
+    get_local_cache,
+    get_local_cache_stats,
+    incrby_existing,
+)
 from .celery import nonoverlapping_task
 from .dates import datetime_to_str, datetime_to_timestamp, timestamp_to_datetime
 from .email import is_valid_address, send_simple_email
@@ -53,7 +73,7 @@ from .fields import validate_external_url
 from .gsm7 import calculate_num_segments, is_gsm7, replace_non_gsm7_accents
 from .http import http_headers
 from .locks import LockNotAcquiredException, NonBlockingLock
-from .models import IDSliceQuerySet, JSONAsTextField, patch_queryset_count
+from .models import IDSliceQuerySet, JSONAsTextField, KeysetIterator, patch_queryset_count
 from .templatetags.temba import oxford, short_datetime
 from .text import (
     clean_string,
@@ -512,6 +532,34 @@ class CacheTest(TembaTest):
         with self.assertNumQueries(0):
             self.assertEqual(get_cacheable_result("test_contact_count", calculate), 2)  # from cache
 
+    def test_get_cacheable_many(self):
+        r = get_redis_connection()
+        r.set("test_count_1", 10)
+        calculated = []
+
+        def calculate(keys):
+            calculated.append(keys)
+            return {k: (int(k[-1]) * 100, 60 if k.endswith("2") else None) for k in keys}
+
+        keys = ["test_count_1", "test_count_2", "test_count_3"]
+
+        self.assertEqual(get_cacheable_many(keys, calculate), {k: v for k, v in zip(keys, [10, 200, 300])})
+        self.assertEqual(calculated, [["test_count_2", "test_count_3"]])  # only misses calculated in a single call
+        self.assertTrue(0 < r.ttl("test_count_2") <= 60)
+        self.assertEqual(r.ttl("test_count_3"), -1)
+
+        # now all from cache
+        self.assertEqual(get_cacheable_many(keys, calculate), {k: v for k, v in zip(keys, [10, 200, 300])})
+        self.assertEqual(len(calculated), 1)
+
+        # unless forced
+        self.assertEqual(
+            get_cacheable_many(keys, calculate, force_dirty=True), {k: v for k, v in zip(keys, [100, 200, 300])}
+        )
+        self.assertEqual(calculated[1], keys)
+
+        self.assertEqual(get_cacheable_many([], calculate), {})
+
     def test_get_cacheable_attr(self):
         def calculate():
             return "CALCULATED"
@@ -545,6 +593,59 @@ class CacheTest(TembaTest):
         incrby_existing("xxx", -2, r)  # non-existent key
         self.assertIsNone(r.get("xxx"))
 
+    def test_local_cache(self):
+        cache = LocalCache("test", max_size=2, ttl=60)
+        calls = []
+
+        def calculate(v):
+            def _calculate():
+                calls.append(v)
+                return v
+
+            return _calculate
+
+        self.assertEqual(cache.get(1, calculate("a")), "a")
+        self.assertEqual(cache.get(1, calculate("b")), "a")
+        self.assertEqual(cache.get(2, calculate("c")), "c")
+        self.assertEqual(calls, ["a", "c"])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertAlmostEqual(cache.hit_ratio, 1 / 3)
+
+        # use key 1 so that key 2 is least recently used and is evicted when key 3 is added
+        cache.get(1, calculate("x"))
+        cache.get(3, calculate("d"))
+        self.assertEqual(cache.get(2, calculate("e")), "e")
+        self.assertEqual(calls, ["a", "c", "d", "e"])
+
+        # invalidating discards locally and publishes to other processes
+        r = get_redis_connection()
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(LOCAL_CACHE_CHANNEL)
+        pubsub.get_message(timeout=1)
+
+        cache.invalidate(2)
+        self.assertEqual(json.loads(pubsub.get_message(timeout=1)["data"]), {"cache": "test", "key": 2})
+        self.assertEqual(cache.get(2, calculate("f")), "f")
+        pubsub.close()
+
+        # expired entries are recalculated
+        cache.ttl = -1
+        cache.get(4, calculate("g"))
+        self.assertEqual(cache.get(4, calculate("h")), "h")
+
+        # caches from get_local_cache are invalidated by published messages
+        shared = get_local_cache("test_shared")
+        shared.get("k", calculate("i"))
+        r.publish(LOCAL_CACHE_CHANNEL, json.dumps({"cache": "test_shared", "key": "k"}))
+
+        for i in range(20):
+            if shared.get("k", calculate("j")) == "j":
+                break
+            time.sleep(0.1)
+
+        self.assertEqual(calls[-1], "j")
+        self.assertEqual(get_local_cache_stats()["test_shared"]["misses"], 2)
+
 
 class EmailTest(TembaTest):
     @override_settings(SEND_EMAILS=True)
@@ -788,6 +889,87 @@ class GSM7Test(TembaTest):
 
 
 class ModelsTest(TembaTest):
+    def test_squash_batched(self):
+        flow = self.get_flow("color")
+        contact = self.create_contact("Bob", phone="+250788000001")
+        group = self.create_group("Testers", [contact])
+        label = self.create_label("Spam")
+        broadcast = self.create_broadcast(self.admin, "Hi", contacts=[contact])
+        start = FlowStart.create(flow, self.admin)
+        topup = self.org.topups.first()
+        today = timezone.now().date()
+
+        # deltas of a few sets for each model which opts into batched squashing
+        deltas = {
+            FlowNodeCount: [
+                dict(flow=flow, node_uuid="57b50d33-2b5a-4726-82de-9848c61eff6e", count=4),
+                dict(flow=flow, node_uuid="57b50d33-2b5a-4726-82de-9848c61eff6e", count=-1),
+                dict(flow=flow, node_uuid="6e3e3ef1-7c7e-4ec1-a8a0-1f0d2a5e6f01", count=2),
+            ],
+            FlowRunCount: [
+                dict(flow=flow, exit_type=None, count=2),
+                dict(flow=flow, exit_type=None, count=1),
+                dict(flow=flow, exit_type="C", count=3),
+                dict(flow=flow, exit_type="C", count=-5),
+            ],
+            FlowStartCount: [dict(start=start, count=3), dict(start=start, count=2)],
+            TopUpCredits: [dict(topup=topup, used=3), dict(topup=topup, used=-1)],
+            BroadcastMsgCount: [dict(broadcast=broadcast, count=2), dict(broadcast=broadcast, count=1)],
+            SystemLabelCount: [
+                dict(org=self.org, label_type="I", is_archived=False, count=2),
+                dict(org=self.org, label_type="I", is_archived=False, count=1),
+                dict(org=self.org, label_type="I", is_archived=True, count=1),
+            ],
+            LabelCount: [
+                dict(label=label, is_archived=False, count=3),
+                dict(label=label, is_archived=False, count=1),
+                dict(label=label, is_archived=True, count=-1),
+            ],
+            ContactGroupCount: [dict(group=group, count=5), dict(group=group, count=-2)],
+            ChannelCount: [
+                dict(channel=self.channel, count_type="IM", day=today, count=3),
+                dict(channel=self.channel, count_type="IM", day=today, count=1),
+                dict(channel=self.channel, count_type="IM", day=None, count=2),
+            ],
+        }
+
+        def get_rows(model):
+            fields = model.SQUASH_OVER + model.SQUASH_CARRY + (model.SQUASH_FIELD, "is_squashed")
+            return sorted(model.objects.values_list(*fields), key=str)
+
+        for model, rows in deltas.items():
+            self.assertTrue(model.SQUASH_BATCHED)
+
+            for row in rows:
+                model.objects.create(**row)
+
+            # squash one set at a time and then undo that
+            with transaction.atomic():
+                num_sets = model.squash(batched=False)
+                per_set_rows = get_rows(model)
+                transaction.set_rollback(True)
+
+            # batched squashing should give the same rows as the model's own squash query
+            self.assertEqual(num_sets, model.squash(), f"sets mismatch for {model.__name__}")
+            self.assertEqual(per_set_rows, get_rows(model), f"rows mismatch for {model.__name__}")
+
+        # models with their own limits on what's squashed don't batch
+        self.assertFalse(FlowCategoryCount.SQUASH_BATCHED)
+        self.assertFalse(FlowPathCount.SQUASH_BATCHED)
+
+        # a batched squash removes no more than SQUASH_BATCH_MAX_ROWS rows, leaving the rest for the next squash
+        FlowRunCount.objects.create(flow=flow, exit_type="I", count=2)
+        FlowRunCount.objects.create(flow=flow, exit_type="I", count=3)
+
+        with patch.object(FlowRunCount, "SQUASH_BATCH_MAX_ROWS", 1):
+            self.assertEqual(1, FlowRunCount.squash())
+            self.assertEqual(2, FlowRunCount.objects.filter(exit_type="I").count())
+            self.assertEqual(5, FlowRunCount.get_totals(flow)["I"])
+
+            self.assertEqual(1, FlowRunCount.squash())
+            self.assertEqual(0, FlowRunCount.objects.filter(exit_type="I", is_squashed=False).count())
+            self.assertEqual(5, FlowRunCount.get_totals(flow)["I"])
+
     def test_require_update_fields(self):
         contact = self.create_contact("Bob", urns=["twitter:bobby"])
         flow = self.get_flow("color")
@@ -828,6 +1010,59 @@ class ModelsTest(TembaTest):
 
             self.assertEqual(qs.count(), 33)
 
+    def test_keyset_iterator(self):
+        created = [
+            self.create_contact("Bob", urns=["twitter:bob"]),
+            self.create_contact(None, urns=["twitter:anon1"]),
+            self.create_contact("Ann", urns=["twitter:ann"]),
+            self.create_contact("Bob", urns=["twitter:bob2"]),
+            self.create_contact(None, urns=["twitter:anon2"]),
+        ]
+
+        contacts = Contact.objects.filter(id__in=[c.id for c in created])
+        expected = list(contacts.order_by("name", "id"))
+
+        # nullable keys sort last and ties are broken by id
+        batches = list(KeysetIterator(contacts, keys=("name", "id"), batch_size=2))
+        self.assertEqual([2, 2, 1], [len(b) for b in batches])
+        self.assertEqual(expected, [c for b in batches for c in b])
+
+        # one query per batch, without an extra query when the last batch is short
+        with self.assertNumQueries(3):
+            list(KeysetIterator(contacts, keys=("name", "id"), batch_size=2))
+
+        # an exact multiple of the batch size needs a final empty query
+        with self.assertNumQueries(2):
+            list(KeysetIterator(contacts, keys=("name", "id"), batch_size=5))
+
+        # can resume from the last key of a previous iterator
+        iterator = KeysetIterator(contacts, keys=("name", "id"), batch_size=3)
+        first_batch = next(iter(iterator))
+        self.assertEqual(expected[:3], first_batch)
+        self.assertEqual(("Bob", expected[2].id), iterator.last_key)
+
+        resumed = KeysetIterator(contacts, keys=("name", "id"), batch_size=3, after=iterator.last_key)
+        self.assertEqual(expected[3:], [c for b in resumed for c in b])
+
+        # and from a key with a null value
+        resumed = KeysetIterator(contacts, keys=("name", "id"), after=(None, expected[3].id))
+        self.assertEqual(expected[4:], [c for b in resumed for c in b])
+
+        # can also iterate in descending order, where nulls sort first
+        expected = list(contacts.order_by("-name", "-id"))
+        iterator = KeysetIterator(contacts, keys=("-name", "-id"), batch_size=2)
+        batches = list(iterator)
+        self.assertEqual([2, 2, 1], [len(b) for b in batches])
+        self.assertEqual(expected, [c for b in batches for c in b])
+        self.assertEqual(("Ann", expected[4].id), iterator.last_key)
+
+        resumed = KeysetIterator(contacts, keys=("-name", "-id"), after=(None, expected[1].id))
+        self.assertEqual(expected[2:], [c for b in resumed for c in b])
+
+        # default keys are (created_on, id)
+        batches = list(KeysetIterator(contacts, batch_size=10, prefetch_related=("all_groups",)))
+        self.assertEqual(list(contacts.order_by("created_on", "id")), batches[0])
+
 
 class ExportTest(TembaTest):
     def setUp(self):